@@ -0,0 +1,66 @@
+import math
+import threading
+import time
+from collections import OrderedDict
+
+
+class RateLimiter():
+    """
+    Per-client token buckets. Each client gets `burst` requests straight away, then
+    `rate` more per second. Only the most recently seen max_clients are tracked; a
+    client that falls off just starts again with a full bucket.
+    """
+    def __init__(self, rate: float = 5.0, burst: int = 20, max_clients: int = 4096):
+        self.lock = threading.Lock()
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self.buckets = OrderedDict()  # client -> [tokens, last refill]
+
+    def allow(self, client: str, now=None):
+        """
+        Take a token for one request from client
+
+        Returns:
+            (bool): True if the request can go ahead
+            (int): seconds until it could, rounded up. 0 when it can
+        """
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            bucket = self.buckets.get(client)
+            if bucket is None:
+                bucket = self.buckets[client] = [float(self.burst), now]
+                if len(self.buckets) > self.max_clients:
+                    self.buckets.popitem(last=False)
+            else:
+                self.buckets.move_to_end(client)
+                bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+                bucket[1] = now
+
+            if bucket[0] >= 1:
+                bucket[0] -= 1
+                return True, 0
+            return False, math.ceil((1 - bucket[0]) / self.rate)
+
+
+class ConcurrencyLimit():
+    """
+    At most `limit` expensive requests at once. Doesn't queue: a request that finds
+    no free slot is turned away at once, so threads stay free for everything else
+    """
+    def __init__(self, limit: int = 4):
+        self.limit = limit
+        self.lock = threading.Lock()
+        self.in_flight = 0
+
+    def try_acquire(self):
+        """Take a slot if there's one free, True if it got one"""
+        with self.lock:
+            if self.in_flight >= self.limit:
+                return False
+            self.in_flight += 1
+            return True
+
+    def release(self):
+        with self.lock:
+            self.in_flight -= 1
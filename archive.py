@@ -0,0 +1,198 @@
+import importlib.util
+import mmap
+import os
+import struct
+from bisect import bisect_left, bisect_right
+# numpy is only imported once there is an archive to read or write
+
+ARCHIVE_PATH = "../namesBac.archive"
+MAGIC = b"BRARCH01"
+HEADER = struct.Struct("<8sQQd")  # magic, readings, bytes of names, cutoff
+TS_SCALE = 1_000_000  # timestamps are stored as int64 microseconds
+
+
+def can_archive() -> bool:
+    """Whether numpy, which archives are read and written with, is installed"""
+    return importlib.util.find_spec("numpy") is not None
+
+
+def to_us(timestamp: float) -> int:
+    return int(round(timestamp * TS_SCALE))
+
+
+class Archive():
+    """
+    Old readings in one fixed-width columnar file, memory-mapped rather than parsed.
+
+    After the header come three columns, float64 bac, int64 timestamp (microseconds)
+    and int32 name id, then the names themselves, newline separated. Rows are sorted
+    the way every board is, highest bac first, then timestamp, then name, so rank and
+    seek are binary searches over the mapped columns and a page is a slice of them.
+
+    Immutable: archiving more readings writes a whole new file (see merged). Every
+    reading older than `cutoff` that had been recorded by then is in here.
+    """
+    def __init__(self, path: str = ARCHIVE_PATH):
+        self.path = path
+        self.cutoff = 0.0
+        self.names = []
+        self.bac = self.ts = self.name_id = None
+        self._len = 0
+        if os.path.exists(path):
+            self._open()
+
+    def _open(self):
+        import numpy as np
+
+        with open(self.path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, count, names_len, self.cutoff = HEADER.unpack_from(self._mmap)
+        if magic != MAGIC:
+            raise ValueError(f"{self.path} is not a reading archive")
+
+        offset = HEADER.size
+        self.bac = np.frombuffer(self._mmap, "<f8", count, offset)
+        offset += 8 * count
+        self.ts = np.frombuffer(self._mmap, "<i8", count, offset)
+        offset += 8 * count
+        self.name_id = np.frombuffer(self._mmap, "<i4", count, offset)
+        offset += 4 * count
+        if names_len:
+            self.names = self._mmap[offset:offset + names_len].decode().split("\n")
+        self._len = count
+
+    def __len__(self):
+        return self._len
+
+    def rows(self, start: int, stop: int):
+        """(name, bac, timestamp) readings at 0-based positions [start, stop)"""
+        start, stop = max(start, 0), min(stop, self._len)
+        if start >= stop:
+            return []
+        names = self.names
+        return [
+            (names[i], bac, ts / TS_SCALE)
+            for i, bac, ts in zip(
+                self.name_id[start:stop].tolist(), self.bac[start:stop].tolist(), self.ts[start:stop].tolist()
+            )
+        ]
+
+    def batches(self, batch_size: int = 5000):
+        """Every reading, batch_size at a time"""
+        for start in range(0, self._len, batch_size):
+            yield self.rows(start, start + batch_size)
+
+    def count_above(self, bac: float):
+        """Number of readings with a strictly higher bac"""
+        if not self._len:
+            return 0
+        import numpy as np
+        # the column is descending, searchsorted wants ascending: a reversed view, no copy
+        return self._len - int(np.searchsorted(self.bac[::-1], bac, side="right"))
+
+    def bounds(self, row):
+        """
+        (lo, hi): positions of the first reading that sorts at or after a (name, bac,
+        timestamp) reading and the first that sorts strictly after it. hi - lo is how
+        many exact copies of it are archived
+        """
+        if not self._len:
+            return 0, 0
+        import numpy as np
+
+        name, bac, ts = row[0], float(row[1]), to_us(float(row[2]))
+        # same bac, then same timestamp, then by name; each narrows the range
+        first = self.count_above(bac)
+        last = self._len - int(np.searchsorted(self.bac[::-1], bac, side="left"))
+        same_bac = self.ts[first:last]
+        lo = first + int(np.searchsorted(same_bac, ts, side="left"))
+        hi = first + int(np.searchsorted(same_bac, ts, side="right"))
+        names = [self.names[i] for i in self.name_id[lo:hi].tolist()]
+        return lo + bisect_left(names, name), lo + bisect_right(names, name)
+
+    def contains(self, row):
+        lo, hi = self.bounds(row)
+        return hi > lo
+
+    def recent(self, since: float):
+        """Readings with timestamp >= since, oldest first"""
+        if not self._len or since >= self.cutoff:
+            return []
+        import numpy as np
+
+        idx = np.flatnonzero(self.ts >= to_us(since))
+        idx = idx[np.argsort(self.ts[idx], kind="stable")]
+        return [(self.names[self.name_id[i]], float(self.bac[i]), int(self.ts[i]) / TS_SCALE) for i in idx.tolist()]
+
+    def user_totals(self):
+        """
+        Per name aggregates, worked out over the columns rather than row by row
+
+        Yields:
+            (tuple): name, count, total, best, best timestamp, last, last timestamp
+        """
+        if not self._len:
+            return
+        import numpy as np
+
+        counts = np.bincount(self.name_id, minlength=len(self.names))
+        totals = np.bincount(self.name_id, weights=self.bac, minlength=len(self.names))
+        # rows are in leaderboard order, so a name's first row is its best
+        ids, best_at = np.unique(self.name_id, return_index=True)
+        by_time = np.lexsort((self.ts, self.name_id))
+        sorted_ids = self.name_id[by_time]
+        last_at = by_time[np.flatnonzero(np.r_[sorted_ids[1:] != sorted_ids[:-1], True])]
+
+        for i, best, last in zip(ids.tolist(), best_at.tolist(), last_at.tolist()):
+            yield (
+                self.names[i], int(counts[i]), float(totals[i]),
+                float(self.bac[best]), int(self.ts[best]) / TS_SCALE,
+                float(self.bac[last]), int(self.ts[last]) / TS_SCALE,
+            )
+
+    def latest_timestamp(self):
+        return int(self.ts.max()) / TS_SCALE if self._len else None
+
+    def merged(self, rows, cutoff: float):
+        """
+        Write a new archive over this one's file with these (name, bac, timestamp)
+        readings added, everything older than cutoff now being in it
+
+        Returns:
+            (Archive): the new archive, opened
+        """
+        import numpy as np
+
+        names = list(self.names)
+        ids = {name: i for i, name in enumerate(names)}
+        new_ids = []
+        for name, _, _ in rows:
+            if name not in ids:
+                ids[name] = len(names)
+                names.append(name)
+            new_ids.append(ids[name])
+
+        if self._len:
+            old = (self.bac, self.ts, self.name_id)
+        else:
+            old = (np.empty(0, "<f8"), np.empty(0, "<i8"), np.empty(0, "<i4"))
+        bac = np.concatenate((old[0], np.array([r[1] for r in rows], dtype="<f8")))
+        ts = np.concatenate((old[1], np.array([to_us(r[2]) for r in rows], dtype="<i8")))
+        name_id = np.concatenate((old[2], np.array(new_ids, dtype="<i4")))
+
+        name_rank = np.empty(len(names), dtype=np.int64)
+        name_rank[np.argsort(np.array(names, dtype=object), kind="stable")] = np.arange(len(names))
+        order = np.lexsort((name_rank[name_id], ts, -bac))
+
+        blob = "\n".join(names).encode()
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(HEADER.pack(MAGIC, len(order), len(blob), max(cutoff, self.cutoff)))
+            f.write(bac[order].tobytes())
+            f.write(ts[order].tobytes())
+            f.write(name_id[order].tobytes())
+            f.write(blob)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+        return Archive(self.path)
@@ -0,0 +1,78 @@
+"""Shared bits for the benchmarks: fake leaderboards, a scratch dir the servers can run in, stats"""
+import csv
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO not in sys.path:
+    sys.path.insert(0, REPO)
+
+DEFAULT_SIZES = (1_000, 100_000, 1_000_000)
+NAMES = ["Avery", "Jordan", "Sam", "Riley", "Casey", "Morgan", "Quinn", "Taylor", "Jamie", "Drew"]
+
+
+def parse_sizes(text):
+    """"1k,100k,1m" -> (1000, 100000, 1000000)"""
+    sizes = []
+    for part in text.split(","):
+        part = part.strip().lower()
+        scale = {"k": 1_000, "m": 1_000_000}.get(part[-1:], 1)
+        sizes.append(int(float(part.rstrip("km")) * scale))
+    return tuple(sizes)
+
+
+def make_readings(n: int, seed: int = 0):
+    """n (name, bac, timestamp) readings spread over the last year, in submit order"""
+    rng = random.Random(seed)
+    start = time.time() - 365 * 24 * 3600
+    step = 365 * 24 * 3600 / max(n, 1)
+    return [
+        (f"{rng.choice(NAMES)}{i % 997}", round(rng.uniform(0.0, 0.25), 4), start + i * step)
+        for i in range(n)
+    ]
+
+
+class Workdir():
+    """
+    A throwaway directory laid out the way the servers expect: they run in work/ and
+    keep their data one level up (../namesBac.csv etc), with static/ and assets/
+    linked in from the repo
+    """
+    def __init__(self, rows):
+        self.root = tempfile.mkdtemp(prefix="breath-bench-")
+        self.path = os.path.join(self.root, "work")
+        os.mkdir(self.path)
+        for name in ("static", "assets"):
+            os.symlink(os.path.join(REPO, name), os.path.join(self.path, name))
+
+        with open(os.path.join(self.root, "namesBac.csv"), "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["name", "bac", "timestamp"])
+            writer.writerows(rows)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+
+def percentile(sorted_values, p):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return float("nan")
+    k = max(int(round(p / 100 * len(sorted_values) + 0.5)) - 1, 0)
+    return sorted_values[min(k, len(sorted_values) - 1)]
+
+
+def print_table(headers, rows):
+    widths = [max(len(str(h)), *(len(str(r[i])) for r in rows)) for i, h in enumerate(headers)]
+    line = "  ".join(str(h).ljust(w) for h, w in zip(headers, widths))
+    print(line)
+    print("-" * len(line))
+    for row in rows:
+        print("  ".join(str(c).ljust(w) for c, w in zip(row, widths)))
@@ -0,0 +1,211 @@
+"""
+Load test for new_flask_server.py under a party-shaped mix of clients.
+
+For every leaderboard size the server is started fresh in a scratch dir holding
+that many readings, then for --duration seconds:
+    - --browsers threads do what static/script.js does: poll /leaderboard.json?top=10
+      (with If-None-Match) and /get-most-recent, and now and then load the full
+      /leaderboard table
+    - one station polls /should-start-blow (no long-poll wait, so its latency counts)
+    - every --submit-every seconds someone does /initialize-session + /submit-bac
+
+and p50/p95/p99 latency plus throughput are reported per route.
+
+    python bench/load.py --sizes 1k,100k,1m --duration 30 --json results.json
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+from collections import defaultdict
+
+from common import DEFAULT_SIZES, REPO, Workdir, make_readings, parse_sizes, percentile, print_table
+
+STATION = "bench-1"
+FULL_TABLE_EVERY = 10  # a browser loads /leaderboard once in this many polls
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(workdir, port, storage):
+    env = dict(os.environ, PYTHONPATH=REPO, BREATH_STORAGE=storage, BREATH_COOLDOWN_MINUTES="0",
+               BREATH_RATE_LIMIT="0")
+    code = (
+        "import new_flask_server as s; "
+        f"s.app.run(host='127.0.0.1', port={port}, threaded=True)"
+    )
+    return subprocess.Popen([sys.executable, "-c", code], cwd=workdir, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def wait_ready(port, proc, timeout):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"server exited with {proc.returncode}")
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+            conn.request("GET", "/can-cache")
+            conn.getresponse().read()
+            conn.close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError("server didn't come up in time")
+
+
+class Recorder():
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)  # route -> seconds
+        self.errors = defaultdict(int)
+
+    def add(self, route, seconds, ok):
+        with self.lock:
+            self.latencies[route].append(seconds)
+            if not ok:
+                self.errors[route] += 1
+
+
+class Client():
+    """One keep-alive connection, timing every request on it"""
+    def __init__(self, port, recorder):
+        self.port = port
+        self.recorder = recorder
+        self.conn = None
+
+    def request(self, method, path, body=None, headers=None, route=None):
+        route = route or path.split("?", 1)[0]
+        headers = dict(headers or {})
+        if body is not None:
+            body = json.dumps(body)
+            headers["Content-Type"] = "application/json"
+
+        start = time.perf_counter()
+        try:
+            if self.conn is None:
+                self.conn = http.client.HTTPConnection("127.0.0.1", self.port, timeout=30)
+            self.conn.request(method, path, body=body, headers=headers)
+            response = self.conn.getresponse()
+            data = response.read()
+        except (OSError, http.client.HTTPException):
+            self.recorder.add(route, time.perf_counter() - start, False)
+            self.conn = None
+            return None, None, b""
+        self.recorder.add(route, time.perf_counter() - start, response.status < 500)
+        return response.status, response, data
+
+
+def browser(port, recorder, stop, think):
+    client = Client(port, recorder)
+    etag = None
+    polls = 0
+    while not stop.is_set():
+        headers = {"Accept-Encoding": "gzip"}
+        if etag:
+            headers["If-None-Match"] = etag
+        status, response, _ = client.request("GET", "/leaderboard.json?top=10", headers=headers)
+        if status == 200:
+            etag = response.getheader("ETag")
+        client.request("GET", "/get-most-recent")
+
+        polls += 1
+        if polls % FULL_TABLE_EVERY == 0:
+            client.request("GET", "/leaderboard", headers={"Accept-Encoding": "gzip"})
+        stop.wait(think)
+
+
+def station(port, recorder, stop, think):
+    client = Client(port, recorder)
+    while not stop.is_set():
+        client.request("GET", f"/should-start-blow?device={STATION}")
+        stop.wait(think)
+
+
+def submitter(port, recorder, stop, every):
+    client = Client(port, recorder)
+    rng = random.Random(1)
+    i = 0
+    while not stop.wait(every):
+        i += 1
+        status, _, _ = client.request("POST", "/initialize-session", body={"name": f"bench{i}"})
+        if status == 200:
+            client.request("POST", "/submit-bac", body={"bac": round(rng.uniform(0, 0.25), 4), "device": STATION})
+
+
+def run_size(size, args):
+    print(f"\n== {size:,} readings ({args.storage}) ==")
+    with Workdir(make_readings(size)) as workdir:
+        port = free_port()
+        proc = start_server(workdir.path, port, args.storage)
+        try:
+            t0 = time.time()
+            wait_ready(port, proc, args.startup_timeout)
+            startup = time.time() - t0
+            print(f"server up in {startup:.1f}s")
+
+            recorder = Recorder()
+            stop = threading.Event()
+            threads = [threading.Thread(target=station, args=(port, recorder, stop, args.station_think))]
+            threads += [threading.Thread(target=browser, args=(port, recorder, stop, args.think))
+                        for _ in range(args.browsers)]
+            threads.append(threading.Thread(target=submitter, args=(port, recorder, stop, args.submit_every)))
+            for t in threads:
+                t.start()
+            time.sleep(args.duration)
+            stop.set()
+            for t in threads:
+                t.join()
+        finally:
+            proc.terminate()
+            proc.wait()
+
+    results = {"size": size, "startup_s": round(startup, 2), "routes": {}}
+    rows = []
+    for route in sorted(recorder.latencies):
+        values = sorted(recorder.latencies[route])
+        stats = {
+            "count": len(values),
+            "rps": round(len(values) / args.duration, 1),
+            "p50_ms": round(percentile(values, 50) * 1000, 2),
+            "p95_ms": round(percentile(values, 95) * 1000, 2),
+            "p99_ms": round(percentile(values, 99) * 1000, 2),
+            "errors": recorder.errors[route],
+        }
+        results["routes"][route] = stats
+        rows.append([route, *stats.values()])
+    print_table(["route", "count", "req/s", "p50 ms", "p95 ms", "p99 ms", "errors"], rows)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=parse_sizes, default=DEFAULT_SIZES, help="eg 1k,100k,1m")
+    parser.add_argument("--duration", type=float, default=20, help="seconds of load per size")
+    parser.add_argument("--browsers", type=int, default=20)
+    parser.add_argument("--think", type=float, default=0.5, help="seconds between a browser's polls")
+    parser.add_argument("--station-think", type=float, default=0.5)
+    parser.add_argument("--submit-every", type=float, default=2.0)
+    parser.add_argument("--storage", default="csv", choices=("csv", "sqlite"))
+    parser.add_argument("--startup-timeout", type=float, default=600)
+    parser.add_argument("--json", help="also write the results here, for comparing runs")
+    args = parser.parse_args()
+
+    results = [run_size(size, args) for size in args.sizes]
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
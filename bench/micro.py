@@ -0,0 +1,118 @@
+"""
+Microbenchmarks for the pieces a request spends its time in, at each leaderboard size:
+bin_search (the old insert-point search), LeaderboardIndex insert/rank, load_csv
+(pandas) next to the stdlib csv reader ReadingLog uses, and rendering the
+leaderboard as html and json.
+
+    python bench/micro.py --sizes 1k,100k,1m
+"""
+import argparse
+import bisect
+import importlib
+import os
+import random
+import statistics
+import sys
+import timeit
+
+from common import DEFAULT_SIZES, Workdir, make_readings, parse_sizes, print_table
+
+
+def measure(fn, repeat=5):
+    """(median, best) seconds per call"""
+    timer = timeit.Timer(fn)
+    number, _ = timer.autorange()
+    times = [t / number for t in timer.repeat(repeat=repeat, number=number)]
+    return statistics.median(times), min(times)
+
+
+def fmt(seconds):
+    for unit, scale in (("s", 1), ("ms", 1e-3), ("us", 1e-6)):
+        if seconds >= scale:
+            return f"{seconds / scale:.2f} {unit}"
+    return f"{seconds / 1e-9:.0f} ns"
+
+
+def bench_search(rows, results):
+    from server_utils import bin_search
+    from leaderboard import LeaderboardIndex
+
+    rng = random.Random(2)
+    bacs = sorted((bac for _, bac, _ in rows), reverse=True)
+    targets = [rng.uniform(0, 0.25) for _ in range(1000)]
+    ascending = bacs[::-1]
+
+    results.append(("bin_search", *measure(lambda: [bin_search(bacs, t) for t in targets]), 1000))
+    results.append(("bisect (c)", *measure(lambda: [bisect.bisect(ascending, t) for t in targets]), 1000))
+
+    index = LeaderboardIndex(rows)
+    results.append(("index.rank_of", *measure(lambda: [index.rank_of(t) for t in targets]), 1000))
+
+    def insert():
+        for t in targets[:100]:
+            index.insert(("bench", t, 0.0))
+    results.append(("index.insert", *measure(insert, repeat=3), 100))
+
+
+def bench_load(workdir, results):
+    import server_utils
+    from reading_log import _read_rows
+
+    cwd = os.getcwd()
+    os.chdir(workdir.path)
+    try:
+        results.append(("load_csv (pandas)", *measure(server_utils.load_csv, repeat=3), 1))
+        results.append(("_read_rows (csv)", *measure(lambda: _read_rows("../namesBac.csv"), repeat=3), 1))
+    finally:
+        os.chdir(cwd)
+
+
+def bench_render(workdir, results):
+    cwd = os.getcwd()
+    os.chdir(workdir.path)
+    try:
+        # importing it opens the store in the scratch dir, same as a real startup.
+        # reloaded for every size after the first
+        if "new_flask_server" in sys.modules:
+            server = importlib.reload(sys.modules["new_flask_server"])
+        else:
+            server = importlib.import_module("new_flask_server")
+        calibration = server.CALIBRATION.current
+
+        results.append(("render html", *measure(lambda: server.render_leaderboard_html(calibration), repeat=3), 1))
+        results.append(("render json top=10", *measure(
+            lambda: server.render_leaderboard_json(calibration, 0, 25, None, 10)), 1))
+        results.append(("render json page", *measure(
+            lambda: server.render_leaderboard_json(calibration, len(server.STORE) // 2, 200, None, None)), 1))
+        server.STORE.close()
+    finally:
+        os.chdir(cwd)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=parse_sizes, default=DEFAULT_SIZES, help="eg 1k,100k,1m")
+    parser.add_argument("--skip", default="", help="comma separated: search,load,render")
+    args = parser.parse_args()
+    skip = set(filter(None, args.skip.split(",")))
+
+    for size in args.sizes:
+        print(f"\n== {size:,} readings ==")
+        rows = make_readings(size)
+        results = []  # (name, median, best, ops per call)
+        with Workdir(rows) as workdir:
+            if "search" not in skip:
+                bench_search(rows, results)
+            if "load" not in skip:
+                bench_load(workdir, results)
+            if "render" not in skip:
+                bench_render(workdir, results)
+
+        print_table(
+            ["benchmark", "median", "best", "per op"],
+            [[name, fmt(median), fmt(best), fmt(median / ops)] for name, median, best, ops in results],
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+Cold start cost of each server: time to import it (which loads the store, the assets
+and everything else done at module level) and the peak RSS afterwards, measured in a
+fresh interpreter. --preload pandas,numpy imports those first, for comparing against
+how startup used to look.
+
+    python bench/startup.py --sizes 1k,100k
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+from common import REPO, Workdir, make_readings, parse_sizes, print_table
+
+SERVERS = ("new_flask_server", "flask_server", "pi_server")
+HEAVY = ("pandas", "numpy")
+
+PROBE = """
+import json, resource, sys, time
+start = time.perf_counter()
+for name in sys.argv[2].split(","):
+    if name:
+        __import__(name)
+__import__(sys.argv[1])
+elapsed = time.perf_counter() - start
+print(json.dumps({
+    "seconds": elapsed,
+    "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    "heavy": [m for m in %r if m in sys.modules],
+}))
+""" % (HEAVY,)
+
+
+def probe(server, workdir, preload):
+    env = dict(os.environ, PYTHONPATH=REPO)
+    out = subprocess.run(
+        [sys.executable, "-c", PROBE, server, ",".join(preload)],
+        cwd=workdir, env=env, capture_output=True, text=True, timeout=600,
+    )
+    if out.returncode != 0:
+        return None
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=parse_sizes, default=(1_000, 100_000))
+    parser.add_argument("--servers", default=",".join(SERVERS))
+    parser.add_argument("--preload", default="", help="modules to import first, eg pandas,numpy")
+    parser.add_argument("--runs", type=int, default=3, help="best of this many cold starts")
+    args = parser.parse_args()
+    preload = tuple(filter(None, args.preload.split(",")))
+
+    for size in args.sizes:
+        print(f"\n== {size:,} readings ==")
+        rows = []
+        for server in args.servers.split(","):
+            runs = []
+            for _ in range(args.runs):
+                with Workdir(make_readings(size)) as workdir:
+                    result = probe(server, workdir.path, preload)
+                if result:
+                    runs.append(result)
+            if not runs:
+                rows.append([server, "failed", "", ""])
+                continue
+            best = min(runs, key=lambda r: r["seconds"])
+            rows.append([server, f"{best['seconds']:.2f} s", f"{best['max_rss_mb']:.1f} MB",
+                         ",".join(best["heavy"]) or "-"])
+        print_table(["server", "startup", "peak rss", "heavy imports"], rows)
+
+
+if __name__ == "__main__":
+    main()
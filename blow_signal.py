@@ -0,0 +1,131 @@
+# numpy is only imported once samples actually arrive, it isn't needed to start the server
+
+ADC_MAX = 4095  # 12 bit ADC on the photon
+ADC_VREF = 5.0
+SAMPLE_DTYPE = "<u2"  # batches are little-endian uint16 ADC counts
+MAX_SAMPLES = 120_000  # per blow, a couple of minutes at 1 kHz
+
+BASELINE_S = 0.5  # the first half second is taken as the sensor at rest
+SMOOTH_S = 0.1  # moving average window
+START_DELTA_V = 0.05  # above baseline by this much counts as blowing
+END_HOLD_S = 0.5  # back under the threshold this long and the blow is over
+
+
+def decode_samples(payload: bytes):
+    """Raw request body -> uint16 array of ADC counts"""
+    import numpy as np
+
+    if len(payload) % 2:
+        raise ValueError("sample batch must be a whole number of uint16 values")
+    return np.frombuffer(payload, dtype=SAMPLE_DTYPE)
+
+
+class BlowDetector():
+    """
+    Streaming peak detection over a blow's ADC samples.
+
+    Samples can arrive in any number of batches, each is processed in one vectorised
+    pass: baseline removal, moving average smoothing, then blow start/end and peak.
+    The smoothing window carries over between batches so chunking doesn't change the
+    result. Only a handful of numbers are kept, never the samples themselves.
+    """
+    def __init__(self, rate_hz: float):
+        import numpy as np
+
+        if not 0 < rate_hz <= 10_000:
+            raise ValueError("sample rate must be between 0 and 10000 Hz")
+        self.rate = float(rate_hz)
+        self.window = max(1, int(round(SMOOTH_S * rate_hz)))
+        self.baseline_n = max(self.window, int(round(BASELINE_S * rate_hz)))
+        self.end_hold = max(1, int(round(END_HOLD_S * rate_hz)))
+        self.threshold = START_DELTA_V * ADC_MAX / ADC_VREF  # in counts
+
+        self.seen = 0  # samples fed so far
+        self._head = np.empty(0)  # samples held back until there's enough for the baseline
+        self._tail = np.empty(0)  # last window-1 samples, so smoothing spans batches
+        self.baseline = None
+        self.start = None  # sample index the blow started at
+        self.end = None
+        self._last_above = None
+        self.peak = 0.0  # smoothed counts above baseline
+        self.peak_at = None
+
+    def feed(self, samples):
+        """Process the next batch of ADC counts"""
+        import numpy as np
+
+        samples = np.asarray(samples, dtype=np.float64)
+        if self.seen + len(self._head) + len(samples) > MAX_SAMPLES:
+            raise ValueError(f"more than {MAX_SAMPLES} samples in one blow")
+
+        if self.baseline is None:
+            self._head = np.concatenate((self._head, samples))
+            if len(self._head) < self.baseline_n:
+                return
+            self.baseline = float(np.median(self._head[:self.baseline_n]))
+            samples, self._head = self._head, np.empty(0)
+
+        if self.end is not None or not len(samples):
+            return
+
+        # moving average over the carried tail + this batch, one output per new sample
+        joined = np.concatenate((self._tail, samples))
+        csum = np.cumsum(np.concatenate(([0.0], joined)))
+        lo = np.maximum(np.arange(len(self._tail), len(joined)) + 1 - self.window, 0)
+        hi = np.arange(len(self._tail), len(joined)) + 1
+        smoothed = (csum[hi] - csum[lo]) / (hi - lo) - self.baseline
+        self._tail = joined[-(self.window - 1):] if self.window > 1 else np.empty(0)
+
+        offset = self.seen
+        self.seen += len(samples)
+
+        above = np.flatnonzero(smoothed > self.threshold)
+        if self.start is None:
+            if not len(above):
+                return
+            self.start = offset + int(above[0])
+
+        if len(above):
+            # gaps longer than the hold time end the blow
+            positions = offset + above
+            prev = np.concatenate(([self._last_above if self._last_above is not None else positions[0]], positions[:-1]))
+            gaps = np.flatnonzero(positions - prev > self.end_hold)
+            if len(gaps):
+                self.end = int(prev[gaps[0]])
+                positions = positions[:gaps[0]]
+            if len(positions):
+                self._last_above = int(positions[-1])
+
+        stop = (self.end if self.end is not None else self.seen - 1) - offset + 1
+        begin = max(self.start - offset, 0)
+        if stop > begin:
+            i = int(np.argmax(smoothed[begin:stop]))
+            if smoothed[begin + i] > self.peak:
+                self.peak = float(smoothed[begin + i])
+                self.peak_at = offset + begin + i
+
+        if self.end is None and self._last_above is not None and self.seen - 1 - self._last_above > self.end_hold:
+            self.end = self._last_above
+
+    def result(self):
+        """
+        Summary of the blow so far
+
+        Returns:
+            (dict): volts (absolute sensor voltage at the peak, the same unit a
+                /submit-bac reading is in), peak_v (peak above baseline in volts),
+                baseline_v, start_s, end_s, duration_s. None if no blow was detected
+        """
+        if self.start is None:
+            return None
+        end = self.end if self.end is not None else (self._last_above or self.start)
+        volts = ADC_VREF / ADC_MAX
+        return {
+            "volts": round((self.baseline + self.peak) * volts, 4),
+            "peak_v": round(self.peak * volts, 4),
+            "baseline_v": round(self.baseline * volts, 4),
+            "peak_s": round(self.peak_at / self.rate, 3),
+            "start_s": round(self.start / self.rate, 3),
+            "end_s": round(end / self.rate, 3),
+            "duration_s": round((end - self.start) / self.rate, 3),
+        }
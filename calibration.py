@@ -0,0 +1,126 @@
+import hashlib
+import json
+import os
+import threading
+from blow_signal import ADC_MAX, ADC_VREF
+
+CALIBRATION_PATH = "../calibration.json"
+LUT_SIZE = ADC_MAX + 1  # one entry per ADC count, finer than the sensor can tell apart
+
+
+class Calibration():
+    """
+    Voltage -> BAC curve, fitted from reference readings.
+
+    The store keeps the raw sensor voltage for every blow and BAC is worked out when
+    it's served, so changing the curve recalibrates the whole history without touching
+    a single stored row. The curve is forced to be non-decreasing, which means the
+    leaderboard order (sorted by voltage) is the same as the BAC order and the indexes
+    stay valid across recalibrations.
+
+    The fitted polynomial is evaluated once into a dense lookup table, a conversion is
+    then an index into it: to_bac for one reading, apply for a whole column at once.
+    With no reference points the curve is the identity, readings show as volts, and
+    numpy never gets imported.
+    """
+    def __init__(self, points=(), degree: int = 2):
+        self.points = [(float(v), float(bac)) for v, bac in points]
+        self.degree = degree
+        self.coefficients = [1.0, 0.0]  # identity
+        self.table = None
+        if self.points:
+            self._fit()
+        self.version = hashlib.sha1(
+            json.dumps([self.points, degree]).encode()
+        ).hexdigest()[:8]
+
+    def _fit(self):
+        import numpy as np
+
+        volts, bacs = np.array(self.points).T
+        if len(self.points) == 1:
+            # one reference, assume BAC is proportional to voltage
+            coefficients = np.array([bacs[0] / volts[0] if volts[0] else 0.0, 0.0])
+        else:
+            degree = min(self.degree, len(np.unique(volts)) - 1)
+            coefficients = np.polyfit(volts, bacs, degree)
+
+        table = np.polyval(coefficients, np.linspace(0.0, ADC_VREF, LUT_SIZE))
+        # never negative, never going down as the voltage goes up
+        self.table = np.maximum.accumulate(np.clip(table, 0.0, None))
+        self.coefficients = coefficients.tolist()
+        self._lut = self.table.tolist()  # plain floats for single lookups
+
+    def to_bac(self, volts: float) -> float:
+        """BAC for one reading, a table lookup"""
+        if self.table is None:
+            return volts
+        return self._lut[min(max(int(round(volts * (LUT_SIZE - 1) / ADC_VREF)), 0), LUT_SIZE - 1)]
+
+    def apply(self, volts):
+        """
+        BAC for a whole column of readings, in one vectorised pass over the table
+
+        Returns:
+            (list): floats, same order as volts
+        """
+        if self.table is None:
+            return list(volts)
+        import numpy as np
+
+        volts = np.asarray(volts, dtype=np.float64)
+        indexes = np.clip(np.rint(volts * ((LUT_SIZE - 1) / ADC_VREF)), 0, LUT_SIZE - 1).astype(np.intp)
+        return self.table[indexes].tolist()
+
+    def to_dict(self):
+        return {
+            "points": self.points,
+            "degree": self.degree,
+            "coefficients": self.coefficients,
+            "version": self.version,
+        }
+
+
+class CalibrationStore():
+    """The current Calibration, loaded from and saved to CALIBRATION_PATH"""
+    def __init__(self, path: str = CALIBRATION_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+        self.current = Calibration()
+        self._mtime = None
+        self.reload()
+
+    def reload(self):
+        """
+        Pick up a curve another process saved. Just a stat when nothing changed,
+        so workers of a multi-process server can call it on every request
+        """
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return self.current
+        if mtime != self._mtime:
+            with open(self.path) as f:
+                saved = json.load(f)
+            self.current = Calibration(saved.get("points", ()), saved.get("degree", 2))
+            self._mtime = mtime
+        return self.current
+
+    def update(self, points, degree: int = 2):
+        """
+        Fit a new curve and make it current. Everything served afterwards uses it
+
+        Returns:
+            (Calibration): the new calibration
+        """
+        calibration = Calibration(points, degree)
+        with self.lock:
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(calibration.to_dict(), f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+            self.current = calibration
+            self._mtime = os.stat(self.path).st_mtime_ns
+        return calibration
@@ -0,0 +1,60 @@
+import math
+import threading
+import time
+
+
+class Cooldown():
+    """
+    Per-name time-between-blows rule, answered from memory in O(1).
+
+    The sensor's own cooldown is per station and lives in the session managers; this
+    only spaces out each person's blows, and does nothing unless per_name_minutes is
+    set (BREATH_NAME_COOLDOWN_MINUTES for the server). Only readings newer than the
+    window can matter, so that's all that gets seeded from storage at startup.
+    """
+    def __init__(self, per_name_minutes: int = None):
+        self.lock = threading.Lock()
+        self.per_name_window = per_name_minutes * 60 if per_name_minutes else None
+        self.last_by_name = {}
+
+    def horizon(self, now=None):
+        """Oldest timestamp that can still block a blow"""
+        now = time.time() if now is None else now
+        return now - (self.per_name_window or 0)
+
+    def seed(self, rows):
+        """Load (name, bac, timestamp) readings, eg Storage.recent(cooldown.horizon())"""
+        for name, _, ts in rows:
+            self.record(name, ts)
+
+    def record(self, name: str, timestamp: float):
+        """Note a blow, called on every submit"""
+        with self.lock:
+            if self.per_name_window and timestamp > self.last_by_name.get(name, -math.inf):
+                self.last_by_name[name] = timestamp
+                if len(self.last_by_name) > 1024:
+                    self._prune()
+
+    def _prune(self):
+        # names whose window has passed can't block anything anymore
+        cutoff = time.time() - self.per_name_window
+        self.last_by_name = {n: ts for n, ts in self.last_by_name.items() if ts > cutoff}
+
+    def check(self, name: str = None, now=None):
+        """
+        Check if enough time has passed since this name's last blow
+
+        Returns:
+            (bool): True if a blow can start
+            (int): Minutes until it can, rounded up. 0 when it already can
+        """
+        now = time.time() if now is None else now
+        wait = 0.0
+
+        with self.lock:
+            if name is not None and self.per_name_window and name in self.last_by_name:
+                wait = max(wait, self.last_by_name[name] + self.per_name_window - now)
+
+        if wait > 0:
+            return False, math.ceil(wait / 60)
+        return True, 0
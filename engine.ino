@@ -27,7 +27,12 @@ http_header_t headers[] = {
 http_request_t request;
 request.hostname = "raspberrypi.local";
 request.port = 8000;
-request.path = "/blow-status";
+// long-poll: the server holds the request for up to 4 seconds and answers TRUE as
+// soon as someone queues up, so there's no need to hammer it.
+// HttpClient gives up after its TIMEOUT (5000 ms, fixed in HttpClient.h) with no data,
+// so the wait has to stay under that or every poll would time out instead
+// each station has its own id so several can run blows at once
+request.path = "/should-start-blow?device=station-1&wait=4";
 
 http_response_t response;
 
@@ -48,7 +53,7 @@ void loop() {
     Serial.print("HTTP Response: ");
     Serial.println(response.body);
     
-    if (response.body == "READY"){
+    if (response.body == "TRUE"){
         //initialize by putting the animation on the screen
         lcd.print("GET READY TO BLOW JOE.")
         sleep(3)
@@ -61,19 +66,51 @@ void loop() {
         lcd.print("1")
         sleep(1)
         lcd.print("TAKE A DEEEEP BREATH AND.... BLOW!")
+
+        // sample the whole blow, then send it in one request
+        recordBlow();
+        postSamples();
     }
-    
-    int sensorValue = analogRead(A0);  // Raw reading (0–4095)
-    float voltage = sensorValue * (5.0 / 4095.0);  // Convert to volts
+}
 
-    // Create a message string with both values
-    char msg[64];
-    snprintf(msg, sizeof(msg), "Raw: %d | V: %.2f", sensorValue, voltage);
+// sampling a blow: 50 Hz for 12 seconds, 2 bytes a sample
+const int SAMPLE_RATE_HZ = 50;
+const int BLOW_SAMPLES = SAMPLE_RATE_HZ * 12;
+uint16_t samples[BLOW_SAMPLES];
+
+void recordBlow() {
+    unsigned long next = millis();
+    for (int i = 0; i < BLOW_SAMPLES; i++) {
+        while ((long)(millis() - next) < 0) {}
+        samples[i] = analogRead(A0);  // Raw reading (0–4095)
+        next += 1000 / SAMPLE_RATE_HZ;
+    }
+}
 
-    // Publish it to the Particle cloud
-    Particle.publish("alcohol_reading", msg, PRIVATE);
+// POST the raw samples as little-endian uint16 to /submit-samples. the server does the
+// baseline, smoothing and peak detection. HttpClient only sends string bodies, so this
+// writes the request straight to a TCPClient
+void postSamples() {
+    TCPClient client;
+    if (!client.connect(request.hostname, request.port)) {
+        Serial.println("couldn't reach the server");
+        return;
+    }
 
-    // Wait 5 seconds between updates (1/sec will hit rate limit)
-    delay(5000);
+    int length = sizeof(samples);
+    client.printlnf("POST /submit-samples?device=station-1&rate=%d HTTP/1.1", SAMPLE_RATE_HZ);
+    client.printlnf("Host: %s", request.hostname.c_str());
+    client.println("Content-Type: application/octet-stream");
+    client.printlnf("Content-Length: %d", length);
+    client.println("Connection: close");
+    client.println();
+    client.write((const uint8_t *)samples, length);  // the photon is little-endian already
+
+    unsigned long deadline = millis() + 10000;
+    while (client.connected() && millis() < deadline) {
+        while (client.available()) {
+            Serial.write(client.read());
+        }
+    }
+    client.stop();
 }
-
@@ -0,0 +1,74 @@
+import itertools
+import json
+import queue
+import threading
+
+
+def format_sse(event: str, data, event_id=None):
+    """Encode one Server-Sent Events message"""
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"event: {event}")
+    for line in json.dumps(data).splitlines():
+        lines.append(f"data: {line}")
+    return "\n".join(lines) + "\n\n"
+
+
+class EventBroker():
+    """
+    Fans server state changes out to every open /events stream.
+
+    Each subscriber gets a small bounded queue. A client too slow to keep up gets
+    dropped instead of holding memory; its EventSource reconnects and resyncs.
+    """
+    def __init__(self, max_backlog: int = 32):
+        self.lock = threading.Lock()
+        self.subscribers = set()
+        self.max_backlog = max_backlog
+        self._ids = itertools.count(1)
+
+    def subscribe(self):
+        q = queue.Queue(self.max_backlog)
+        with self.lock:
+            self.subscribers.add(q)
+        return q
+
+    def unsubscribe(self, q):
+        with self.lock:
+            self.subscribers.discard(q)
+
+    def publish(self, event: str, data):
+        """Push an event to every subscriber"""
+        with self.lock:
+            msg = format_sse(event, data, next(self._ids))
+            subscribers = list(self.subscribers)
+
+        for q in subscribers:
+            try:
+                q.put_nowait(msg)
+            except queue.Full:
+                self.unsubscribe(q)
+                with q.mutex:
+                    q.queue.clear()
+                q.put_nowait(None)  # tells the stream to close
+
+    def stream(self, heartbeat: float = 15):
+        """
+        Generator of SSE text for one client. Sends a comment every heartbeat seconds
+        so proxies and phones don't time the connection out.
+        """
+        q = self.subscribe()
+        try:
+            yield "retry: 3000\n\n"
+            while True:
+                try:
+                    msg = q.get(timeout=heartbeat)
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+                    continue
+                if msg is None:
+                    return
+                yield msg
+        finally:
+            self.unsubscribe(q)
@@ -1,94 +1,38 @@
-from flask import Flask, request, jsonify, send_from_directory, render_template_string
-import pandas as pd
-import time
+from flask import Flask, request, jsonify
 import os
-import mimetypes
+import time
+from reading_log import ReadingLog
+from server_utils import render_leaderboard_table
+from static_assets import StaticAssets
 
-app = Flask(__name__)
+app = Flask(__name__, static_folder=None)  # static files are served from ASSETS
 
 # Global variables (consider using a database or session storage for production)
 PENDING_NAME = {}
 MOST_RECENT = {}
 READY = False
-
-# Helper functions (you'll need to include these from your original code)
-def load_csv():
-    """Load the CSV file, create if doesn't exist"""
-    try:
-        return pd.read_csv("../namesBac.csv")
-    except FileNotFoundError:
-        # Create empty DataFrame with required columns
-        df = pd.DataFrame(columns=["name", "bac", "timestamp"])
-        df.to_csv("../namesBac.csv", index=False)
-        return df
-
-
-def bin_search(arr, target):
-    """Binary search to find insertion point for maintaining sorted order"""
-    left, right = 0, len(arr)
-    while left < right:
-        mid = (left + right) // 2
-        if arr[mid] > target:  # Assuming descending order (highest BAC first)
-            left = mid + 1
-        else:
-            right = mid
-    return left
-
-
-def serve_static_file(path):
-    """Serve static files from the static/ directory"""
-    # Remove leading slash and ensure it's in static directory
-    if path.startswith('/static/'):
-        file_path = path[1:]  # Remove leading slash
-    else:
-        file_path = f"static{path}"
-
-    # Security check - prevent directory traversal
-    if '..' in file_path or not file_path.startswith('static/'):
-        return None
-
-    if not os.path.exists(file_path):
-        return None
-
-    try:
-        with open(file_path, 'rb') as f:
-            content = f.read()
-
-        # Get MIME type
-        mime_type, _ = mimetypes.guess_type(file_path)
-        if not mime_type:
-            if file_path.endswith('.js'):
-                mime_type = 'application/javascript'
-            elif file_path.endswith('.css'):
-                mime_type = 'text/css'
-            elif file_path.endswith('.html'):
-                mime_type = 'text/html'
-            else:
-                mime_type = 'application/octet-stream'
-
-        return content, mime_type
-    except Exception:
-        return None
-
+# debug=True runs a reloader: the first process only watches files, the child serves,
+# and only the one serving may compact the shared csv files
+READINGS = ReadingLog(background=not (__name__ == "__main__" and os.environ.get("WERKZEUG_RUN_MAIN") != "true"))
+ASSETS = StaticAssets()
 
 @app.route('/')
 def index():
     """Serve the main index.html file"""
-    static_result = serve_static_file("/index.html")
-    if static_result:
-        content, mime_type = static_result
-        return content, 200, {'Content-Type': mime_type}
+    response = ASSETS.response("/", request)
+    if response:
+        return response
     else:
         return "<html><body><h1>404 Not Found</h1></body></html>", 404
 
 
 @app.route('/static/<path:filename>')
+@app.route('/assets/<path:filename>')
 def serve_static(filename):
     """Serve static files"""
-    static_result = serve_static_file(f"/static/{filename}")
-    if static_result:
-        content, mime_type = static_result
-        return content, 200, {'Content-Type': mime_type}
+    response = ASSETS.response(request.path, request)
+    if response:
+        return response
     else:
         return "File not found", 404
 
@@ -137,6 +81,8 @@ def submit_bac():
 
         # Get cached name
         cached_name = PENDING_NAME.get("name")
+        if not cached_name:
+            return "No pending name", 400
 
         write_data = {
             "name": cached_name,
@@ -154,20 +100,10 @@ def submit_bac():
         # Clear from pending
         PENDING_NAME = {}
 
-        # Save to CSV
-        og_df = load_csv()
-
-        # Insert row at correct place
-        bac_list = og_df["bac"].tolist() if "bac" in og_df else []
-        insert_index = bin_search(bac_list, bac)
+        # Append to the reading log (sorted order is kept in memory)
+        insert_index = READINGS.append(**write_data) - 1
         MOST_RECENT["rank"] = insert_index
 
-        new_row = write_data
-        top = og_df.iloc[:insert_index]
-        bottom = og_df.iloc[insert_index:]
-        og_df = pd.concat([top, pd.DataFrame([new_row]), bottom]).reset_index(drop=True)
-
-        og_df.to_csv("../namesBac.csv", index=False)
         READY = False
 
         return f"Success: {cached_name} - {bac:.3f}", 200
@@ -181,14 +117,7 @@ def submit_bac():
 def leaderboard():
     """Display leaderboard as HTML table"""
     try:
-        og_df = load_csv()
-
-        if "timestamp" in og_df:
-            og_df["time"] = pd.to_datetime(og_df["timestamp"], unit="s")
-
-        html_table = og_df[["name", "bac", "time"]].to_html(
-            index=False, float_format="%.3f"
-        )
+        html_table = render_leaderboard_table(READINGS.snapshot())
 
         return html_table, 200, {'Content-Type': 'text/html'}
 
@@ -233,12 +162,10 @@ def blow_status():
 def status():
     """Check system status"""
     try:
-        og_df = load_csv()
-
-        if og_df.empty:
+        if READINGS.latest_ts is None:
             msg = "No entries yet."
         else:
-            latest_ts = MOST_RECENT.get("timestamp") if MOST_RECENT.get("timestamp") else (og_df["timestamp"].max())
+            latest_ts = MOST_RECENT.get("timestamp") if MOST_RECENT.get("timestamp") else READINGS.latest_ts
             elapsed = int(time.time()) - latest_ts
 
             if elapsed <= 900:  # 15 minutes = 900 seconds
@@ -0,0 +1,31 @@
+# Multi-worker setup for new_flask_server.py, one worker per core:
+#
+#     gunicorn -c gunicorn.conf.py new_flask_server:app
+#
+# Workers share sessions, readings and events through SQLite (BREATH_SHARED_STATE=1),
+# so any worker can serve any request. `python new_flask_server.py` still runs the
+# single-process server with everything in memory.
+import multiprocessing
+import os
+
+bind = "0.0.0.0:8000"
+workers = multiprocessing.cpu_count()
+worker_class = "gthread"
+threads = 16  # /events streams and /should-start-blow long-polls each hold a thread
+timeout = 60
+preload_app = False  # each worker opens its own sqlite connections and relay thread
+
+raw_env = ["BREATH_SHARED_STATE=1", "BREATH_STORAGE=sqlite"]
+
+
+def on_starting(server):
+    # create the databases (and do the one-time csv import) in the master, before
+    # the workers would all race to do it
+    os.environ.update(BREATH_SHARED_STATE="1", BREATH_STORAGE="sqlite")
+    from server_utils import open_storage
+    from sessions import SqliteSessionManager
+    from shared_state import SharedState
+
+    open_storage("sqlite").close()
+    SqliteSessionManager()
+    SharedState()
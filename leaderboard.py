@@ -0,0 +1,355 @@
+import heapq
+import math
+import random
+import threading
+import time
+
+MAX_LEVELS = 32  # plenty for 2**32 readings
+
+# the time-windowed boards, by ?window= name. "tonight" is the last 12 hours, so it
+# keeps a whole night out together whatever time it is asked for
+WINDOWS = {
+    "hour": 60 * 60,
+    "tonight": 12 * 60 * 60,
+    "week": 7 * 24 * 60 * 60,
+}
+
+
+def row_key(row):
+    """
+    Sort key for a (name, bac, timestamp) reading: higher bac first, earlier reading
+    wins a tie. The name breaks exact ties so a reading can be found again to remove it
+    """
+    return (-row[1], row[2], row[0])
+
+
+def resume_point(rows, after=None, seen=0):
+    """
+    (reading, seen) to pass to after() to carry on past rows: the last reading, and how
+    many exact copies of it there have been so far, rows being the batch that came
+    after (after, seen)
+    """
+    last = tuple(rows[-1])
+    copies = 0
+    for row in reversed(rows):
+        if tuple(row) != last:
+            break
+        copies += 1
+    if copies == len(rows) and after == last:
+        copies += seen
+    return last, copies
+
+
+def keyset_batches(board, batch_size: int, after=None, seen: int = 0):
+    """
+    Everything on a board (a Storage or WindowedLeaderboard) from after on, highest bac
+    first, as lists of up to batch_size readings. Each batch is a keyset seek past the
+    last, so only one is held at a time and readings landing meanwhile aren't repeated
+    """
+    while True:
+        rows = board.page(0, batch_size) if after is None else board.after(after, batch_size, seen)
+        if rows:
+            yield rows
+        if len(rows) < batch_size:
+            return
+        after, seen = resume_point(rows, after, seen)
+
+
+class _Node():
+    __slots__ = ("key", "row", "next", "width")
+
+    def __init__(self, key, row, levels):
+        self.key = key
+        self.row = row
+        self.next = [None] * levels
+        self.width = [1] * levels  # how many positions each link skips
+
+
+class LeaderboardIndex():
+    """
+    Indexable skiplist of (name, bac, timestamp) readings, highest bac first.
+
+    Insert, remove, rank-of-value and seek-to-rank are all O(log n) expected, and slices
+    walk the bottom level from there, so top-K / pages / neighbours cost
+    O(log n + k) no matter how deep into the history they are.
+
+    Not thread safe on its own, callers hold their own lock (see ReadingLog).
+    """
+    def __init__(self, rows=()):
+        self._nil = _Node((math.inf,), None, 0)  # sentinel that sorts after everything
+        self._head = _Node(None, None, MAX_LEVELS)
+        self._size = 0
+        self._build(sorted(rows, key=row_key))
+
+    @staticmethod
+    def _random_level():
+        # geometric(1/2): 1 + number of trailing zero bits, capped at MAX_LEVELS
+        bits = random.getrandbits(MAX_LEVELS - 1) | (1 << (MAX_LEVELS - 1))
+        return (bits & -bits).bit_length()
+
+    def _build(self, rows):
+        """Link already sorted rows in one pass, O(n) instead of n inserts"""
+        last = [self._head] * MAX_LEVELS
+        last_pos = [0] * MAX_LEVELS
+
+        for pos, row in enumerate(rows, 1):
+            node = _Node(row_key(row), row, self._random_level())
+            for level in range(len(node.next)):
+                last[level].next[level] = node
+                last[level].width[level] = pos - last_pos[level]
+                last[level] = node
+                last_pos[level] = pos
+
+        self._size = len(rows)
+        for level in range(MAX_LEVELS):
+            last[level].next[level] = self._nil
+            last[level].width[level] = self._size + 1 - last_pos[level]
+
+    def __len__(self):
+        return self._size
+
+    def __iter__(self):
+        node = self._head.next[0]
+        while node is not self._nil:
+            yield node.row
+            node = node.next[0]
+
+    def _count_before(self, key):
+        """Number of readings that sort strictly before key"""
+        node = self._head
+        pos = 0
+        for level in reversed(range(MAX_LEVELS)):
+            while node.next[level].key < key:
+                pos += node.width[level]
+                node = node.next[level]
+        return pos
+
+    def _node_at(self, i):
+        """Node at 0-based position i, nil if past the end"""
+        if i >= self._size:
+            return self._nil
+        node = self._head
+        remaining = i + 1
+        for level in reversed(range(MAX_LEVELS)):
+            while node.width[level] <= remaining:
+                remaining -= node.width[level]
+                node = node.next[level]
+        return node
+
+    def insert(self, row):
+        """
+        Add a (name, bac, timestamp) reading
+
+        Returns:
+            (int): 1-based rank of the new reading (ties share a rank)
+        """
+        key = row_key(row)
+        rank = self.rank_of(row[1])
+
+        chain = [None] * MAX_LEVELS
+        steps_at_level = [0] * MAX_LEVELS
+        node = self._head
+        for level in reversed(range(MAX_LEVELS)):
+            while node.next[level].key <= key:
+                steps_at_level[level] += node.width[level]
+                node = node.next[level]
+            chain[level] = node
+
+        new = _Node(key, row, self._random_level())
+        steps = 0
+        for level in range(len(new.next)):
+            prev = chain[level]
+            new.next[level] = prev.next[level]
+            prev.next[level] = new
+            new.width[level] = prev.width[level] - steps
+            prev.width[level] = steps + 1
+            steps += steps_at_level[level]
+        for level in range(len(new.next), MAX_LEVELS):
+            chain[level].width[level] += 1
+
+        self._size += 1
+        return rank
+
+    def merge(self, rows):
+        """
+        Add many readings at once: they're sorted, merged with what's already here and
+        everything is relinked in one pass. O(n + k log k) rather than k inserts
+        """
+        merged = list(heapq.merge(self, sorted(rows, key=row_key), key=row_key))
+        self._head = _Node(None, None, MAX_LEVELS)
+        self._build(merged)
+
+    def remove(self, row):
+        """
+        Drop a (name, bac, timestamp) reading
+
+        Returns:
+            (bool): False if it wasn't there
+        """
+        key = row_key(row)
+
+        chain = [None] * MAX_LEVELS
+        node = self._head
+        for level in reversed(range(MAX_LEVELS)):
+            while node.next[level].key < key:
+                node = node.next[level]
+            chain[level] = node
+
+        target = chain[0].next[0]
+        if target.key != key:
+            return False
+
+        for level in range(len(target.next)):
+            prev = chain[level]
+            prev.width[level] += target.width[level] - 1
+            prev.next[level] = target.next[level]
+        for level in range(len(target.next), MAX_LEVELS):
+            chain[level].width[level] -= 1
+
+        self._size -= 1
+        return True
+
+    def rank_of(self, bac: float):
+        """1-based rank a reading of this bac gets, ie 1 + number of strictly higher readings"""
+        return self._count_before((-bac,)) + 1
+
+    def _walk(self, node, n):
+        """Up to n readings from node on along the bottom level"""
+        out = []
+        while node is not self._nil and len(out) < n:
+            out.append(node.row)
+            node = node.next[0]
+        return out
+
+    def row_at(self, i: int):
+        """Reading at 0-based position i"""
+        if not 0 <= i < self._size:
+            raise IndexError(i)
+        return self._node_at(i).row
+
+    def slice(self, start: int, stop: int):
+        """Readings at 0-based positions [start, stop), highest bac first"""
+        start = max(start, 0)
+        return self._walk(self._node_at(start), stop - start)
+
+    def after(self, row, limit: int, seen: int = 1):
+        """
+        Up to limit readings that sort after a (name, bac, timestamp) reading, which
+        doesn't have to be in the index any more. A keyset seek, O(log n + limit).
+        Exact copies of the reading are all returned but the first `seen`
+        """
+        key = row_key(row)
+        node = self._head
+        for level in reversed(range(MAX_LEVELS)):
+            while node.next[level].key < key:
+                node = node.next[level]
+        node = node.next[0]
+        while seen > 0 and node.key == key:
+            node = node.next[0]
+            seen -= 1
+        return self._walk(node, limit)
+
+    def top(self, k: int):
+        """The k highest readings"""
+        return self.slice(0, k)
+
+    def around(self, rank: int, radius: int = 2):
+        """
+        Readings within radius places of a 1-based rank
+
+        Returns:
+            (int): 1-based rank of the first returned reading
+            (list): the readings
+        """
+        start = max(rank - 1 - radius, 0)
+        return start + 1, self.slice(start, rank + radius)
+
+
+class WindowedLeaderboard():
+    """
+    Leaderboard of just the readings from the last `seconds`, eg the last hour.
+
+    Kept up incrementally rather than rebuilt per request: a reading goes into the
+    skiplist when it's recorded and comes back out when it ages past the window, which
+    happens lazily on the next read. Both are O(log n) in the readings in the window,
+    and so are rank and seek, same as LeaderboardIndex.
+
+    Thread safe, it holds its own lock. Has the same read methods as Storage so the
+    servers can render either one.
+    """
+    def __init__(self, seconds: float, rows=(), clock=time.time):
+        self.seconds = seconds
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.expired = 0  # readings aged out so far, tells cached renders apart
+
+        cutoff = clock() - seconds
+        rows = [tuple(r) for r in rows if r[2] >= cutoff]
+        self.index = LeaderboardIndex(rows)
+        self._expiry = [(r[2], r) for r in rows]  # min-heap, oldest reading on top
+        heapq.heapify(self._expiry)
+
+    def add(self, row):
+        """Record a (name, bac, timestamp) reading, ignored if it's already too old"""
+        row = tuple(row)
+        with self.lock:
+            if row[2] < self.clock() - self.seconds:
+                return
+            self.index.insert(row)
+            heapq.heappush(self._expiry, (row[2], row))
+
+    def _expire(self):
+        """Drop readings that have aged out, caller holds the lock"""
+        cutoff = self.clock() - self.seconds
+        while self._expiry and self._expiry[0][0] < cutoff:
+            _, row = heapq.heappop(self._expiry)
+            self.index.remove(row)
+            self.expired += 1
+
+    def expire(self):
+        """
+        Age out old readings now
+
+        Returns:
+            (int): how many readings have been aged out in total
+        """
+        with self.lock:
+            self._expire()
+            return self.expired
+
+    def rank_of(self, bac: float):
+        with self.lock:
+            self._expire()
+            return self.index.rank_of(bac)
+
+    def page(self, offset: int, limit: int):
+        """Readings ranked offset+1 .. offset+limit within the window"""
+        with self.lock:
+            self._expire()
+            return self.index.slice(offset, offset + limit)
+
+    def top(self, k: int):
+        return self.page(0, k)
+
+    def around(self, rank: int, radius: int = 2):
+        """(first rank, readings) for the neighbours of a 1-based rank"""
+        with self.lock:
+            self._expire()
+            return self.index.around(rank, radius)
+
+    def after(self, row, limit: int, seen: int = 1):
+        """Up to limit readings in the window that sort after a (name, bac, timestamp) reading"""
+        with self.lock:
+            self._expire()
+            return self.index.after(row, limit, seen)
+
+    def snapshot(self):
+        """Every reading in the window, highest bac first"""
+        with self.lock:
+            self._expire()
+            return list(self.index)
+
+    def __len__(self):
+        with self.lock:
+            self._expire()
+            return len(self.index)
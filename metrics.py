@@ -0,0 +1,189 @@
+import bisect
+import threading
+import time
+
+# seconds. fine at the bottom for dict lookups, up to the multi-second full table renders
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric():
+    kind = None
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(labels)
+        self.lock = threading.Lock()
+        self.children = {}  # label values -> child
+
+    def labels(self, *values):
+        """The child for these label values, kept so hot paths can hold on to it"""
+        values = tuple(str(v) for v in values)
+        child = self.children.get(values)
+        if child is None:
+            with self.lock:
+                child = self.children.setdefault(values, self._new_child())
+        return child
+
+    def expose(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for values, child in sorted(self.children.items()):
+            lines.extend(self._expose_child(values, child))
+        return lines
+
+
+class Gauge(_Metric):
+    """A value read at scrape time from fn, so there's nothing to keep up to date"""
+    kind = "gauge"
+
+    def __init__(self, name, help_text, fn):
+        super().__init__(name, help_text)
+        self.fn = fn
+
+    def expose(self):
+        try:
+            value = self.fn()
+        except Exception:
+            return []  # whatever it reads isn't there yet
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge",
+                f"{self.name} {_format_value(value)}"]
+
+
+class _HistogramChild():
+    __slots__ = ("bounds", "counts", "sum", "lock")
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # last one is +Inf
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.bounds, value)
+        with self.lock:
+            self.counts[i] += 1
+            self.sum += value
+
+    def time(self):
+        return _Timer(self)
+
+
+class _Timer():
+    __slots__ = ("child", "start")
+
+    def __init__(self, child):
+        self.child = child
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.child.observe(time.perf_counter() - self.start)
+
+
+class Histogram(_Metric):
+    """
+    Fixed-bucket histogram. Recording is a bisect and an increment under a per-child
+    lock, cheap enough to leave on for every request
+    """
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def time(self):
+        return self.labels().time()
+
+    def _expose_child(self, values, child):
+        with child.lock:
+            counts = list(child.counts)
+            total = child.sum
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += count
+            labels = _format_labels(self.label_names, values, [("le", _format_value(float(bound)))])
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        labels = _format_labels(self.label_names, values)
+        lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+        lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class TimedLock():
+    """
+    A lock that records how long each blocking acquire waited, used as `with lock:`
+    like any other, or under a threading.Condition
+    """
+    __slots__ = ("lock", "wait")
+
+    def __init__(self, lock, wait):
+        self.lock = lock
+        self.wait = wait  # a Histogram child
+
+    def acquire(self, blocking=True, timeout=-1):
+        if not blocking:
+            return self.lock.acquire(False)
+        start = time.perf_counter()
+        acquired = self.lock.acquire(True, timeout)
+        self.wait.observe(time.perf_counter() - start)
+        return acquired
+
+    def release(self):
+        self.lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.lock.release()
+
+
+class Registry():
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def expose(self):
+        """Everything in Prometheus text format"""
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.expose())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+REQUEST_SECONDS = REGISTRY.register(Histogram(
+    "breath_request_duration_seconds", "Time to handle a request", ("route", "method", "status")))
+LOCK_WAIT_SECONDS = REGISTRY.register(Histogram(
+    "breath_lock_wait_seconds", "Time spent waiting to acquire a lock", ("lock",)))
+STORAGE_SECONDS = REGISTRY.register(Histogram(
+    "breath_storage_io_seconds", "Time spent in storage reads and writes", ("backend", "op")))
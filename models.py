@@ -1,19 +1,111 @@
+import threading
 import time
+from array import array
 from enum import Enum
 
+TRACE_SLOTS = 8  # traces held at once, stations blowing right now
+TRACE_CAPACITY = 30_000  # samples per trace, 60 s at 500 Hz. the last ones are kept if a blow runs over
+
 class BlowState(Enum):
     CACHED_NAME = "cached_name"
     PREBLOW = "preblow"
     BLOWING = "blowing"
     FINISHED = "finished"
 
+
+class SampleRing():
+    """
+    Fixed-size ring of uint16 ADC samples, backed by one preallocated array.
+
+    Batches are copied in straight from the request bytes, nothing is allocated after
+    construction. Once full the oldest samples get overwritten.
+    """
+    __slots__ = ("buf", "_bytes", "capacity", "start", "count")
+
+    def __init__(self, capacity: int = TRACE_CAPACITY):
+        self.buf = array("H", bytes(2 * capacity))
+        self._bytes = memoryview(self.buf).cast("B")
+        self.capacity = capacity
+        self.start = 0  # index of the oldest sample
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def clear(self):
+        self.start = 0
+        self.count = 0
+
+    def extend(self, payload: bytes):
+        """Append little-endian uint16 samples given as raw bytes"""
+        data = memoryview(payload).cast("B")
+        n = len(data) // 2
+        if n >= self.capacity:
+            # only the tail survives anyway
+            data = data[-2 * self.capacity:]
+            n = self.capacity
+
+        end = (self.start + self.count) % self.capacity
+        first = min(n, self.capacity - end)
+        self._bytes[2 * end:2 * (end + first)] = data[:2 * first]
+        self._bytes[:2 * (n - first)] = data[2 * first:]
+
+        overflow = max(self.count + n - self.capacity, 0)
+        self.start = (self.start + overflow) % self.capacity
+        self.count = min(self.count + n, self.capacity)
+
+    def segments(self):
+        """The samples oldest first, as one or two memoryviews into the buffer (no copy)"""
+        end = self.start + self.count
+        if end <= self.capacity:
+            return [self._bytes[2 * self.start:2 * end]]
+        return [self._bytes[2 * self.start:], self._bytes[:2 * (end - self.capacity)]]
+
+
+class TracePool():
+    """
+    A fixed set of SampleRings handed out to sessions while they blow.
+
+    All of them are allocated up front, so traces can never take more than
+    slots * capacity * 2 bytes however many sessions are running or queued. When the
+    pool is empty a session just goes without a trace, the reading still works.
+    """
+    def __init__(self, slots: int = TRACE_SLOTS, capacity: int = TRACE_CAPACITY):
+        self.lock = threading.Lock()
+        self.free = [SampleRing(capacity) for _ in range(slots)]
+
+    def acquire(self):
+        """A cleared ring, None if they're all in use"""
+        with self.lock:
+            if not self.free:
+                return None
+            ring = self.free.pop()
+        ring.clear()
+        return ring
+
+    def release(self, ring):
+        if ring is not None:
+            with self.lock:
+                self.free.append(ring)
+
+
+TRACES = TracePool()
+
+
 class BlowSession():
     # initialize a BlowSession when the name is successfully cached
-    def __init__(self, name):
+    # slots: there can be a lot of these alive in the queue, no __dict__ per instance
+    __slots__ = ("name", "device_id", "queue_no", "ts", "state", "bac", "detector", "trace")
+
+    def __init__(self, name, device_id=None):
         self.name = name
+        self.device_id = device_id  # station the blow happens on, None while queued
+        self.queue_no = None  # set if the session had to wait in the queue
         self.ts = time.time()
         self.state = BlowState.CACHED_NAME
-        self.bac = None # currently just a voltage while calibrating
+        self.bac = None # the sensor voltage, calibration.py turns it into a BAC
+        self.detector = None  # BlowDetector while raw samples are coming in
+        self.trace = None  # SampleRing from TRACES, only while samples are coming in
 
     def update_state(self, new_state: BlowState):
         self.state = new_state
@@ -24,3 +116,15 @@ class BlowSession():
         """
         self.bac = bac
         self.update_state(BlowState.FINISHED)
+
+    def record_samples(self, payload: bytes):
+        """Keep a batch of raw samples in this session's trace, if it could get one"""
+        if self.trace is None:
+            self.trace = TRACES.acquire()
+        if self.trace is not None:
+            self.trace.extend(payload)
+
+    def release_trace(self):
+        """Give the trace buffer back to the pool"""
+        TRACES.release(self.trace)
+        self.trace = None
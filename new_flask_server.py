@@ -1,196 +1,800 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify
 from server_utils import *
-from models import BlowSession
+from admission import ConcurrencyLimit, RateLimiter
+from sessions import DEFAULT_DEVICE, SessionManager, SqliteSessionManager
+from shared_state import SharedState
+from blow_signal import MAX_SAMPLES, BlowDetector, decode_samples
+from calibration import CalibrationStore
+from storage import EXPORT_FORMATS, TraceStore, clean_name, export_readings, import_readings
+from cooldown import Cooldown
+from leaderboard import WINDOWS, keyset_batches, resume_point
+from events import EventBroker
+from metrics import CONTENT_TYPE, LOCK_WAIT_SECONDS, REGISTRY, REQUEST_SECONDS, Gauge, TimedLock
+from render_cache import RenderCache
+from static_assets import StaticAssets
 from threading import Lock
-import pandas as pd
-
-app = Flask(__name__)
-ACTIVE_SESSION = None
+import base64
+import hmac
+import io
+import json
+import math
+import os
+import time
+import uuid
+
+app = Flask(__name__, static_folder=None)  # static files are served from ASSETS
+
+# BREATH_SHARED_STATE=1 when running as several worker processes (see gunicorn.conf.py):
+# sessions, the most recent reading and events then go through SQLite so every worker
+# sees the same ones. Readings have to be in SqliteStorage too, the csv log is per process
+SHARED = os.environ.get("BREATH_SHARED_STATE") == "1"
+if SHARED and os.environ.get("BREATH_STORAGE", "sqlite") != "sqlite":
+    raise RuntimeError("BREATH_SHARED_STATE=1 needs BREATH_STORAGE=sqlite")
+
+# minutes each station's sensor needs between blows. BREATH_COOLDOWN_MINUTES=0 turns it
+# off, eg for bench/load.py
+STATION_COOLDOWN = int(os.environ.get("BREATH_COOLDOWN_MINUTES", 15)) * 60
+# one BlowSession per breathalyzer station
+SESSIONS = (SqliteSessionManager if SHARED else SessionManager)(cooldown_s=STATION_COOLDOWN)
+SHARED_STATE = SharedState() if SHARED else None
 MOST_RECENT = None
-session_lock = Lock()
+# guards MOST_RECENT only; waits on the session manager's own lock are under "sessions"
+most_recent_lock = TimedLock(Lock(), LOCK_WAIT_SECONDS.labels("most_recent"))
+# `python new_flask_server.py` runs with the debug reloader: this first process only
+# watches files and restarts a child that does the serving, so it mustn't compact
+RELOADER_PARENT = __name__ == "__main__" and os.environ.get("WERKZEUG_RUN_MAIN") != "true"
+STORE = open_storage("sqlite" if SHARED else None, background=not RELOADER_PARENT)  # readings are stored as raw sensor volts
+CALIBRATION = CalibrationStore()  # volts -> BAC, applied when serving
+TRACES = TraceStore()  # raw sample traces of finished blows
+EVENTS = EventBroker()
+if SHARED:
+    PUBLISH = SHARED_STATE.publish  # reaches every worker's EVENTS through its relay
+    SHARED_STATE.relay(EVENTS)
+else:
+    PUBLISH = EVENTS.publish
+RENDERED = RenderCache()
+ASSETS = StaticAssets()
+
+# minutes between one person's blows, BREATH_NAME_COOLDOWN_MINUTES=0 (the default) turns
+# it off. The sensor's own cooldown is per station in SESSIONS
+COOLDOWN = Cooldown(per_name_minutes=int(os.environ.get("BREATH_NAME_COOLDOWN_MINUTES", 0)))
+if COOLDOWN.per_name_window:
+    COOLDOWN.seed(STORE.recent(COOLDOWN.horizon()))
+# per client: BREATH_RATE_LIMIT requests a second after a burst of 20 (0 turns it off,
+# eg for bench/load.py, which is all one client). Each worker keeps its own buckets
+RATE = float(os.environ.get("BREATH_RATE_LIMIT", 5))
+RATE_LIMIT = RateLimiter(rate=RATE, burst=20) if RATE > 0 else None
+EXPENSIVE_SLOTS = ConcurrencyLimit(int(os.environ.get("BREATH_MAX_EXPENSIVE", 4)))
+# POST /import and POST /calibration rewrite the public board, they need the header
+# "Authorization: Bearer <BREATH_ADMIN_TOKEN>". Unset, they're turned off altogether
+ADMIN_TOKEN = os.environ.get("BREATH_ADMIN_TOKEN", "")
+# keeps ETags from a previous run from matching this one. Pre-forked workers share their
+# parent, so they agree on it
+BOOT_ID = f"{os.getppid():x}" if SHARED else uuid.uuid4().hex[:8]
+
+REGISTRY.register(Gauge("breath_leaderboard_readings", "Readings on the leaderboard", lambda: len(STORE)))
+REGISTRY.register(Gauge("breath_queue_length", "Sessions waiting for a station", lambda: SESSIONS.queue_length()))
+REGISTRY.register(Gauge("breath_event_subscribers", "Open /events streams", lambda: len(EVENTS.subscribers)))
+REGISTRY.register(Gauge("breath_expensive_in_flight", "Requests holding an expensive slot", lambda: EXPENSIVE_SLOTS.in_flight))
+
+# endpoints browsers poll or that anyone can hit, rate limited per client. The device
+# paths (/should-start-blow, /submit-bac, /submit-samples) are deliberately not here
+RATE_LIMITED = {
+    "can_start_process", "set_active_session", "queue_position", "stations", "calibration",
+    "events", "user_stats", "get_most_recent", "leaderboard", "leaderboard_json", "export",
+    "import_history",
+}
+# ones that can walk a lot of readings, only EXPENSIVE_SLOTS.limit of them run at once
+EXPENSIVE = {"user_stats", "leaderboard", "leaderboard_json", "export", "import_history"}
+# ones that answer from their last render when turned away, see busy_response
+STALE_OK = {"leaderboard", "leaderboard_json"}
+
+
+@app.before_request
+def start_timer():
+    g.request_start = time.perf_counter()
+
+
+@app.before_request
+def admit():
+    """
+    Token bucket per client, then a slot for expensive routes. Turned away requests
+    get 429 (too fast) or 503 (server busy) with a Retry-After, except the leaderboards,
+    which serve their last render instead
+    """
+    endpoint = request.endpoint
+    if endpoint not in RATE_LIMITED:
+        return None
+
+    retry_after = 0
+    if RATE_LIMIT is not None:
+        allowed, retry_after = RATE_LIMIT.allow(request.remote_addr or "unknown")
+        status = 429
+    if not retry_after and endpoint in EXPENSIVE:
+        if EXPENSIVE_SLOTS.try_acquire():
+            g.slot = True
+        else:
+            retry_after, status = 1, 503
+
+    if not retry_after:
+        return None
+    if endpoint in STALE_OK:
+        g.retry_after = retry_after
+        return None
+    return Response("BUSY, TRY AGAIN SOON", status, {"Retry-After": str(retry_after)})
+
+
+@app.after_request
+def release_slot(response):
+    if g.pop("slot", False):
+        if response.is_streamed:
+            # /export and ?stream=1 keep it until the body is fully sent
+            response.call_on_close(EXPENSIVE_SLOTS.release)
+        else:
+            EXPENSIVE_SLOTS.release()
+    return response
+
+
+@app.teardown_request
+def release_slot_on_error(exc):
+    if g.pop("slot", False):
+        EXPENSIVE_SLOTS.release()
+
+
+@app.after_request
+def record_request(response):
+    # labelled by route pattern, not path, so the number of series stays fixed
+    start = g.get("request_start")
+    if start is not None:
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        REQUEST_SECONDS.labels(route, request.method, response.status_code).observe(time.perf_counter() - start)
+    return response
+
+
+@app.route('/metrics')
+def metrics():
+    """Request latencies, lock waits, storage I/O timings and sizes in Prometheus text format"""
+    return Response(REGISTRY.expose(), 200, {"Content-Type": CONTENT_TYPE, "Cache-Control": "no-store"})
 
 
 @app.route('/')
 def index():
     """Serve the main index.html file"""
-    static_result = serve_static_file("/index.html")
-    if static_result:
-        content, mime_type = static_result
-        return content, 200, {'Content-Type': mime_type}
+    response = ASSETS.response("/", request)
+    if response:
+        return response
     else:
         return "<html><body><h1>404 Not Found</h1></body></html>", 404
 
 
-@app.route('/can-cache')
-def can_start_process():
+@app.route('/static/<path:filename>')
+@app.route('/assets/<path:filename>')
+def static_file(filename):
+    """Serve files from static/ and assets/"""
+    response = ASSETS.response(request.path, request)
+    if response:
+        return response
+    else:
+        return "File not found", 404
+
+
+def check_cooldown(name):
     """
-    Hit by frontend to check if user can cache name to start process
+    COOLDOWN.check for name. Another worker may have recorded their last blow, so with
+    several workers that one name's latest reading is looked up first, an index lookup
     """
-    can, mins = check_long_enough(15)  # 15 minutes
+    if not COOLDOWN.per_name_window:
+        return True, 0
+    if SHARED:
+        latest = STORE.latest_timestamp(name)
+        if latest is not None:
+            COOLDOWN.record(name, latest)
+    return COOLDOWN.check(name)
 
-    if mins == -1:
-        return "Error checking DB", 500
 
-    if can:
+@app.route('/can-cache')
+def can_start_process():
+    """
+    Hit by frontend to check if user can cache name to start process. A station
+    that's busy or cooling down doesn't stop anyone, the session just queues for the
+    next ready one; only a full queue does
+    """
+    if SESSIONS.queue_length() < SESSIONS.max_queue:
         return "READY"
-    else:
-        print(mins)
-        return f"WAIT {mins} MINUTES"
+    return f"WAIT {math.ceil(SESSIONS.wait_estimate() / 60)} MINUTES"
 
 
 @app.route('/initialize-session', methods=["POST"])
 def set_active_session():
     """
-    This route gets hit when user goes to cache their name
+    This route gets hit when user goes to cache their name. The session goes to
+    whichever station is free and cooled down, or into the queue if none is
     """
-    global ACTIVE_SESSION
-
-    result = check_long_enough(15)
-    if not result[0]:  # can't start yet
-        return "NOT LONG ENOUGH", 403
-
     data = request.get_json()
-    name = data.get("name")
+    name = clean_name(str(data.get("name") or ""))
 
     if not name:
         return "NAME REQUIRED", 400
 
-    with session_lock:
-        ACTIVE_SESSION = BlowSession(name=name)
+    can, mins = check_cooldown(name)
+    if not can:  # they blew too recently
+        return f"NOT LONG ENOUGH, WAIT {mins} MINUTES", 403
+
+    session = SESSIONS.start(name)
+    if session is None:
+        return "QUEUE FULL", 409
+
+    if session.device_id is None:
+        place, wait_s, _ = SESSIONS.position(session.queue_no)
+        PUBLISH("queue", {"length": SESSIONS.queue_length()})
+        return jsonify({
+            "status": "QUEUED",
+            "ticket": session.queue_no,
+            "position": place,
+            "estimated_wait_s": round(wait_s),
+        }), 200
+
+    PUBLISH("session", {"name": name, "device": session.device_id, "state": session.state.value})
 
-    return "SESSION INITIALIZED", 200
+    return jsonify({"status": "SESSION INITIALIZED", "device": session.device_id}), 200
+
+
+@app.route('/queue-position')
+def queue_position():
+    """Where a queued session (?ticket=<n> from /initialize-session) stands"""
+    try:
+        ticket = int(request.args.get('ticket', ''))
+    except ValueError:
+        return "TICKET REQUIRED", 400
+
+    place, wait_s, device_id = SESSIONS.position(ticket)
+    return jsonify({
+        "position": place,
+        "estimated_wait_s": round(wait_s),
+        "device": device_id,
+    }), 200, {"Cache-Control": "no-store"}
+
+
+MAX_BLOW_WAIT = 30  # seconds a long-poll on /should-start-blow may block
 
 
 @app.route('/should-start-blow')
 def should_start_blow():
     """
-    This gets polled by the breathalyzer to see if it should start blow process
+    This gets polled by each breathalyzer (?device=<id>) to see if it should start blow process
+
+    With ?wait=<seconds> it long-polls: the request blocks until a session is waiting
+    or the wait runs out, so the device can ask again straight away instead of spinning
     """
-    with session_lock:
-        if ACTIVE_SESSION and ACTIVE_SESSION.name and getattr(ACTIVE_SESSION, "name", None) and getattr(ACTIVE_SESSION, "bac", None) is None:
-            return ("TRUE", 200, {"Content-Type": "text/plain", "Cache-Control": "no-store"})
+    device_id = request.args.get('device', DEFAULT_DEVICE)
+    try:
+        wait = min(max(float(request.args.get('wait', 0)), 0), MAX_BLOW_WAIT)
+    except ValueError:
+        return ("bad wait", 400, {"Content-Type": "text/plain"})
+
+    if SESSIONS.poll(device_id, wait):
+        return ("TRUE", 200, {"Content-Type": "text/plain", "Cache-Control": "no-store"})
     return ("FALSE", 200, {"Content-Type": "text/plain", "Cache-Control": "no-store"})
 
 
+@app.route('/stations')
+def stations():
+    """Online stations and who is on each one"""
+    return jsonify(SESSIONS.stations()), 200
+
+
+def record_reading(device_id, volts):
+    """
+    Finish the session on a station with its reading (sensor volts) and store it
+
+    Returns:
+        (dict): the new MOST_RECENT, None if the station had no session
+    """
+
+    # set_bac updates the session state and frees the station
+    session = SESSIONS.finish(device_id, volts)
+    if session is None:
+        return None
+
+    cached_name = session.name
+    timest = session.ts
+
+    # Record the reading, the store hands back its rank
+    rank = STORE.append(cached_name, volts, timest)
+    COOLDOWN.record(cached_name, timest)
+
+    if session.trace is not None:
+        # written out of the ring buffer as is, then it goes back to the pool
+        try:
+            TRACES.save(device_id, timest, session.trace.segments())
+        except OSError as e:
+            print(f"ERROR saving trace: {e}")
+        session.release_trace()
+
+    # Set most recent with rank
+    reading = {
+        "name": cached_name,
+        "bac": CALIBRATION.current.to_bac(volts),
+        "voltage": volts,
+        "timestamp": timest,
+        "rank": rank
+    }
+    set_most_recent(reading)
+
+    PUBLISH("most-recent", reading)
+    PUBLISH("leaderboard", {"total": len(STORE)})
+    PUBLISH("queue", {"length": SESSIONS.queue_length()})
+    return reading
+
+
+def set_most_recent(reading):
+    global MOST_RECENT
+    with most_recent_lock:
+        MOST_RECENT = reading
+    if SHARED:
+        SHARED_STATE.set("most_recent", reading)
+
+
+def get_most_recent_reading():
+    if SHARED:
+        return SHARED_STATE.get("most_recent")
+    with most_recent_lock:
+        return MOST_RECENT
+
+
 @app.route('/submit-bac', methods=['POST'])
 def submit_bac():
-    """Submit BAC reading and match with cached name"""
-    global MOST_RECENT, ACTIVE_SESSION
+    """Submit BAC reading from a station and match with the name cached on it"""
     print("BAC submit called")
 
     try:
         data = request.get_json()
-        bac = float(data.get('bac', 0))
+        bac = float(data.get('bac', 0))  # still the sensor voltage, calibrated when served
+        device_id = data.get('device', DEFAULT_DEVICE)
 
-        with session_lock:
-            if not ACTIVE_SESSION:
-                return "No active session", 400
+        reading = record_reading(device_id, bac)
+        if reading is None:
+            return "No active session", 400
 
-            # Use the session's set_bac method to update state properly
-            ACTIVE_SESSION.set_bac(bac)
+        return jsonify({
+            "status": "success",
+            "name": reading["name"],
+            "bac": reading["bac"],
+            "rank": reading["rank"]
+        }), 200
 
-            cached_name = ACTIVE_SESSION.name
-            timest = ACTIVE_SESSION.ts
+    except Exception as e:
+        print(f"ERROR submitting BAC: {e}")
+        return jsonify({"error": str(e)}), 400
 
-            # Clear session after extracting data
-            ACTIVE_SESSION = None
 
-        write_data = {
-            "name": cached_name,
-            "bac": bac,
-            "timestamp": timest
-        }
+@app.route('/submit-samples', methods=['POST'])
+def submit_samples():
+    """
+    Raw ADC samples for the blow on a station, as a little-endian uint16 body
+    (?device=<id>&rate=<Hz>). A whole blow can go in one request, or in several
+    with &final=0 on all but the last. The sensor voltage at the peak becomes the
+    reading, absolute like a /submit-bac one, so both sit on the same board and curve
+    """
+    device_id = request.args.get('device', DEFAULT_DEVICE)
+    final = request.args.get('final', '1') != '0'
 
-        # Save to CSV
-        og_df = load_csv()
+    if (request.content_length or 0) > MAX_SAMPLES * 2:
+        return "TOO MANY SAMPLES", 413
 
-        # Insert row at correct place
-        bac_list = og_df["bac"].tolist() if "bac" in og_df.columns else []
-        insert_index = bin_search(bac_list, bac)
+    session = SESSIONS.active(device_id)
+    if session is None:
+        return "No active session", 400
 
-        # Set most recent with rank
-        with session_lock:
-            MOST_RECENT = {
-                "name": cached_name,
-                "bac": bac,
-                "timestamp": timest,
-                "rank": insert_index + 1
-            }
+    payload = request.get_data()
+    try:
+        if session.detector is None:
+            session.detector = BlowDetector(float(request.args.get('rate', '')))
+        session.detector.feed(decode_samples(payload))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    session.record_samples(payload)
+
+    blow = session.detector.result()
+    if not final:
+        return jsonify({"status": "partial", "blow": blow}), 200
+    if blow is None:
+        # nothing that looks like a blow, keep the session so they can try again
+        session.detector = None
+        session.release_trace()
+        return jsonify({"error": "NO BLOW DETECTED"}), 422
+
+    reading = record_reading(device_id, blow["volts"])
+    if reading is None:
+        return "No active session", 400
+    return jsonify({"status": "success", "name": reading["name"], "bac": reading["bac"],
+                    "rank": reading["rank"], "blow": blow}), 200
+
+
+def admin_denied():
+    """Error response unless the request carries the admin token, None if it does"""
+    if not ADMIN_TOKEN:
+        return jsonify({"error": "turned off, set BREATH_ADMIN_TOKEN to use it"}), 403
+    supplied = request.headers.get("Authorization", "").encode()
+    if not hmac.compare_digest(supplied, f"Bearer {ADMIN_TOKEN}".encode()):
+        return jsonify({"error": "admin token required"}), 401, {"WWW-Authenticate": "Bearer"}
+    return None
+
+
+@app.route('/calibration', methods=["GET", "POST"])
+def calibration():
+    """
+    GET the current voltage -> BAC curve. POST {"points": [[volts, bac], ...], "degree": 2}
+    with reference readings and the admin token to fit a new one, the whole leaderboard is
+    recalibrated by it.
+    Point volts are absolute sensor voltage, what /submit-bac sends and what
+    /submit-samples takes from the peak of the blow (baseline included)
+    """
+    if request.method == "GET":
+        return jsonify(CALIBRATION.current.to_dict()), 200
 
-        new_row = write_data
-        top = og_df.iloc[:insert_index]
-        bottom = og_df.iloc[insert_index:]
-        og_df = pd.concat([top, pd.DataFrame([new_row]), bottom], ignore_index=True)
+    denied = admin_denied()
+    if denied:
+        return denied
 
-        og_df.to_csv("../namesBac.csv", index=False)
+    data = request.get_json(silent=True) or {}
+    try:
+        points = data.get("points")
+        if not points:
+            raise ValueError("points required")
+        current = CALIBRATION.update(points, int(data.get("degree", 2)))
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": f"bad calibration: {e}"}), 400
 
-        return jsonify({
-            "status": "success",
-            "name": cached_name,
-            "bac": bac,
-            "rank": insert_index + 1
-        }), 200
+    PUBLISH("leaderboard", {"total": len(STORE)})
+    return jsonify(current.to_dict()), 200
+
+
+@app.route('/events')
+def events():
+    """
+    Server-Sent Events stream. Pushes "session", "most-recent" and "leaderboard"
+    events only when they change, so browsers don't have to poll
+    """
+    return Response(EVENTS.stream(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-store", "X-Accel-Buffering": "no"})
+
+
+@app.route('/user/<name>')
+def user_stats(name):
+    """
+    Someone's personal stats: how many times they've blown, their best and last BAC,
+    their mean sensor voltage and where their best ranks. Names match ignoring case
+    and spacing
+    """
+    version, calibration = data_version()
+    etag = data_etag(version)
+    cached = not_modified(etag)
+    if cached:
+        return cached
+
+    stats = STORE.user_stats(name)
+    if stats is None:
+        return jsonify({"error": "NO READINGS"}), 404
+
+    for field in ("best", "last"):
+        stats[field] = calibration.to_bac(stats[field])
+    # the running mean is of stored voltages and the curve isn't linear, so converting
+    # it gives the BAC of an average blow, not the average BAC. Both say which they are
+    stats["mean_volts"] = stats.pop("mean")
+    stats["bac_at_mean_volts"] = calibration.to_bac(stats["mean_volts"])
+    return jsonify(stats), 200, {"ETag": etag, "Cache-Control": "no-cache"}
 
-    except Exception as e:
-        print(f"ERROR submitting BAC: {e}")
-        return jsonify({"error": str(e)}), 400
 
 @app.route('/get-most-recent')
 def get_most_recent():
     """Example route that reads MOST_RECENT"""
-    with session_lock:
-        if MOST_RECENT:
-            return jsonify(MOST_RECENT), 200
-        else:
-            return jsonify({"message": "No recent blows"}), 404
+    reading = get_most_recent_reading()
+    if reading:
+        return jsonify(reading), 200
+    else:
+        return jsonify({"message": "No recent blows"}), 404
+
+
+def data_version():
+    """
+    (version, calibration) to render with. The version covers both the stored readings
+    and the curve, so a recalibration invalidates caches just like a new reading
+    """
+    calibration = CALIBRATION.reload() if SHARED else CALIBRATION.current
+    return f"{STORE.version()}-{calibration.version}", calibration
+
+
+def data_etag(version):
+    """ETag for anything derived from the readings at this data version"""
+    return f'"{BOOT_ID}-{version}"'
+
+
+def leaderboard_window(name):
+    """
+    Board for a ?window= value, and what to add to the data version for it: readings
+    ageing out of a window change it without a new reading landing
+
+    Returns:
+        (Storage | WindowedLeaderboard): STORE itself when name is None
+        (str): version suffix
+
+    Raises:
+        (ValueError): unknown window name
+    """
+    if name is None:
+        return STORE, ""
+    if name not in WINDOWS:
+        raise ValueError(f"window must be one of {', '.join(WINDOWS)}")
+    board = STORE.window(WINDOWS[name])
+    return board, f"-{name}.{board.expire()}"
+
+
+def not_modified(etag):
+    """304 response if the client already has this version, else None"""
+    if etag in request.headers.get("If-None-Match", ""):
+        return Response(status=304, headers={"ETag": etag, "Cache-Control": "no-cache"})
+    return None
+
+
+def rendered_response(version, key, render, content_type, etag=None):
+    """
+    Serve a body out of RENDERED, rendering it only if this version/query hasn't been
+    seen yet. Gzipped for clients that accept it
+    """
+    want_gzip = "gzip" in request.headers.get("Accept-Encoding", "")
+    body, gzipped = RENDERED.get(version, key, render, want_gzip)
+
+    headers = {
+        "Content-Type": content_type,
+        "ETag": etag or data_etag(version),
+        "Cache-Control": "no-cache",
+        "Vary": "Accept-Encoding",
+    }
+    if gzipped:
+        headers["Content-Encoding"] = "gzip"
+    return Response(body, 200, headers)
+
+
+def busy_response(key, content_type):
+    """
+    What a turned away leaderboard request gets: the last render of the same query,
+    however stale, or a 503 if there isn't one. With Retry-After either way
+    """
+    retry_after = str(g.retry_after)
+    cached = RENDERED.last(key, "gzip" in request.headers.get("Accept-Encoding", ""))
+    if cached is None:
+        return Response("BUSY, TRY AGAIN SOON", 503, {"Retry-After": retry_after})
+
+    body, gzipped = cached
+    headers = {
+        "Content-Type": content_type,
+        "Retry-After": retry_after,
+        "Cache-Control": "no-store",
+        "Vary": "Accept-Encoding",
+    }
+    if gzipped:
+        headers["Content-Encoding"] = "gzip"
+    return Response(body, 200, headers)
+
+
+def render_leaderboard_html(calibration, board=None):
+    rows = (STORE if board is None else board).snapshot()
+    bacs = calibration.apply([volts for _, volts, _ in rows])
+    return render_leaderboard_table(rows, bacs).encode()
 
 
 @app.route('/leaderboard')
 def leaderboard():
-    """Display leaderboard as HTML table"""
+    """Display leaderboard as HTML table, ?window=hour|tonight|week for recent readings only"""
+    # read the version before the data, so a submit landing in between can only
+    # cost an extra render, never a stale 304 or cache entry
+    version, calibration = data_version()
     try:
-        og_df = load_csv()
+        board, suffix = leaderboard_window(request.args.get('window'))
+    except ValueError as e:
+        return str(e), 400
+    if g.get("retry_after"):
+        return busy_response(("html", suffix), "text/html")
+    etag = data_etag(version + suffix)
+    cached = not_modified(etag)
+    if cached:
+        return cached
 
-        if "timestamp" in og_df:
-            og_df["time"] = pd.to_datetime(og_df["timestamp"], unit="s")
-
-        html_table = og_df[["name", "bac", "time"]].to_html(
-            index=False, float_format="%.3f"
+    try:
+        return rendered_response(
+            version, ("html", suffix), lambda: render_leaderboard_html(calibration, board), "text/html", etag,
         )
 
-        return html_table, 200, {'Content-Type': 'text/html'}
-
     except Exception as e:
         return f"Error displaying leaderboard: {e}", 500
-    
+
+
+STREAM_BATCH = 1000  # readings per keyset seek when streaming the whole board
+
+
+def encode_cursor(row, position, seen):
+    """
+    Opaque ?cursor= for the page after a reading: its sort key, its 0-based position
+    and how many exact copies of it have been served so far
+    """
+    name, volts, ts = row
+    return base64.urlsafe_b64encode(json.dumps([volts, ts, name, position, seen]).encode()).decode()
+
+
+def decode_cursor(cursor):
+    """
+    Returns:
+        (tuple): the (name, volts, timestamp) reading to continue after
+        (int): how many readings came before the next one, for numbering ranks
+        (int): copies of that reading already served
+
+    Raises:
+        (ValueError): not a cursor we handed out
+    """
+    try:
+        volts, ts, name, position, seen = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        row, position, seen = (str(name), float(volts), float(ts)), int(position), int(seen)
+    except (TypeError, ValueError):
+        raise ValueError("bad cursor")
+    if position < 0 or seen < 1:
+        raise ValueError("bad cursor")
+    return row, position, seen
+
+
+def leaderboard_items(rows, calibration, first_rank):
+    bacs = calibration.apply([volts for _, volts, _ in rows])
+    return [
+        {
+            "rank": first_rank + i,
+            "name": name,
+            "bac": bac,
+            "voltage": volts,
+            "timestamp": ts
+        }
+        for i, ((name, volts, ts), bac) in enumerate(zip(rows, bacs))
+    ]
+
+
+def render_leaderboard_json(calibration, offset, limit, around, top, board=None, cursor=None):
+    if board is None:
+        board = STORE
+    if top is not None:
+        # just [name, bac] pairs, ranks are implied by position
+        rows = board.top(top)
+        bacs = calibration.apply([volts for _, volts, _ in rows])
+        rows = [[name, bac] for (name, _, _), bac in zip(rows, bacs)]
+        return json.dumps({"total": len(board), "rows": rows}).encode()
+
+    if around is not None:
+        first_rank, rows = board.around(around, radius=limit // 2)
+        offset = first_rank - 1
+    elif cursor is not None:
+        # keyset seek: costs the same on page 1000 as on page 1, and a reading landing
+        # above the cursor doesn't shift what comes next
+        after, offset, seen = cursor
+        rows = board.after(after, limit, seen)
+    else:
+        rows = board.page(offset, limit)
+
+    body = {"total": len(board), "items": leaderboard_items(rows, calibration, offset + 1)}
+    if around is None:
+        next_cursor = None
+        if len(rows) == limit:
+            after, _, seen = cursor or (None, offset, 0)
+            after, seen = resume_point(rows, after, seen)
+            next_cursor = encode_cursor(after, offset + len(rows), seen)
+        body["next_cursor"] = next_cursor
+    return json.dumps(body).encode()
+
+
+def stream_leaderboard_json(calibration, board, cursor=None):
+    """
+    The whole board (from cursor on) as one JSON document, written out a batch at a
+    time so memory stays flat however many readings there are
+    """
+    after, position, seen = cursor or (None, 0, 0)
+    yield b'{"total": %d, "items": [' % len(board)
+    sep = b""
+    for rows in keyset_batches(board, STREAM_BATCH, after, seen):
+        items = leaderboard_items(rows, calibration, position + 1)
+        yield sep + b",".join(json.dumps(item).encode() for item in items)
+        sep = b","
+        position += len(rows)
+    yield b"]}"
+
+
 @app.route('/leaderboard.json')
 def leaderboard_json():
     # Query params: /leaderboard.json?offset=0&limit=25
+    #               /leaderboard.json?cursor=<next_cursor>&limit=25  (the page after the last one)
+    #               /leaderboard.json?around=<rank>&limit=5   (neighbours of a rank)
+    #               /leaderboard.json?top=10                  (compact rows for the podium)
+    #               /leaderboard.json?stream=1                (everything, no limit)
+    #               any of them with &window=hour|tonight|week  (recent readings only)
     try:
         offset = int(request.args.get('offset', 0))
+        if offset < 0:  # page() would clamp it, but ranks are numbered from offset + 1
+            raise ValueError("negative offset")
         limit  = min(max(int(request.args.get('limit', 25)), 1), 200)  # cap to 200 per page
+        around = request.args.get('around')
+        around = int(around) if around is not None else None
+        top = request.args.get('top')
+        top = min(max(int(top), 1), 200) if top is not None else None
+        cursor = request.args.get('cursor')
+        cursor = decode_cursor(cursor) if cursor else None
     except ValueError:
-        return jsonify({"error":"bad offset/limit"}), 400
+        return jsonify({"error":"bad offset/limit/cursor"}), 400
+
+    version, calibration = data_version()
+    try:
+        board, suffix = leaderboard_window(request.args.get('window'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    key = ("json", suffix, offset, limit, around, top, request.args.get('cursor'))
+    if g.get("retry_after"):
+        if request.args.get('stream') == '1':
+            return Response("BUSY, TRY AGAIN SOON", 503, {"Retry-After": str(g.retry_after)})
+        return busy_response(key, "application/json")
+
+    if request.args.get('stream') == '1':
+        # live rather than a snapshot of one version, so no ETag and no render cache
+        return Response(
+            stream_leaderboard_json(calibration, board, cursor),
+            200, {"Content-Type": "application/json", "Cache-Control": "no-store"},
+        )
+
+    etag = data_etag(version + suffix)
+    cached = not_modified(etag)
+    if cached:
+        return cached
+
+    return rendered_response(
+        version, key,
+        lambda: render_leaderboard_json(calibration, offset, limit, around, top, board, cursor),
+        "application/json", etag,
+    )
+
+
+@app.route('/export')
+def export():
+    """Whole reading history as ?format=csv (default) or ndjson, streamed out in batches"""
+    fmt = request.args.get('format', 'csv')
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({"error": f"format must be one of {', '.join(EXPORT_FORMATS)}"}), 400
 
-    df = load_csv()  # your helper that reads namesBac.csv
-    # Ensure sorted descending on BAC
-    if 'bac' in df.columns:
-        df = df.sort_values('bac', ascending=False, kind='stable').reset_index(drop=True)
+    return Response(export_readings(STORE, fmt), 200, {
+        "Content-Type": EXPORT_FORMATS[fmt],
+        "Content-Disposition": f'attachment; filename="readings.{fmt}"',
+        "Cache-Control": "no-store",
+    })
+
+
+@app.route('/import', methods=['POST'])
+def import_history():
+    """
+    Add readings from a body in the /export format (?format=csv or ndjson, default
+    from the Content-Type). Read and inserted in batches as it streams in, malformed
+    lines are skipped and reported. Needs the admin token
+    """
+    denied = admin_denied()
+    if denied:
+        return denied
 
-    total = len(df)
-    slice_df = df.iloc[offset:offset+limit]
-    items = []
-    for i, row in slice_df.iterrows():
-        items.append({
-            "rank": offset + i + 1,
-            "name": row.get("name"),
-            "bac": row.get("bac"),
-            "timestamp": row.get("timestamp")
-        })
+    fmt = request.args.get('format') or ("ndjson" if "json" in (request.content_type or "") else "csv")
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({"error": f"format must be one of {', '.join(EXPORT_FORMATS)}"}), 400
 
-    return jsonify({"total": total, "items": items}), 200
+    lines = io.TextIOWrapper(request.stream, encoding="utf-8", newline="")
+    result = import_readings(lines, STORE, fmt)
 
+    if result["imported"]:
+        PUBLISH("leaderboard", {"total": len(STORE)})
+    # a body that broke off partway still imported everything before the break, the
+    # counts say how much
+    return jsonify(result), 400 if "error" in result else 200
 
 
 if __name__ == '__main__':
-    app.run(debug=True, host='0.0.0.0', port=8000)
\ No newline at end of file
+    app.run(debug=True, host='0.0.0.0', port=8000, threaded=True)  # /events holds a thread per client
\ No newline at end of file
@@ -1,408 +1,343 @@
-import os
-import socket
-import pandas as pd
+import asyncio
+import json
 import time
-import mimetypes
+from urllib.parse import parse_qsl, urlsplit
+from reading_log import ReadingLog
+from server_utils import render_leaderboard_table
+from storage import clean_name
+from static_assets import StaticAssets
 
 HOST ='' # just 0.0.0.0 - all avail channels ie lan, eth, etc. as opposed to just picking one channel
 PORT = 8080 # dev port
-LEADERBOARD = []
+
+MAX_HEADER_BYTES = 16 * 1024
+MAX_BODY_BYTES = 1024 * 1024
+IDLE_TIMEOUT = 15  # seconds a kept-alive connection may sit between requests
 
 # caching name to use when finish blowing
 PENDING_NAME = {}  # {"name": str, "timestamp": float}
 MOST_RECENT = {}
+READINGS = ReadingLog()
+ASSETS = StaticAssets()
 
 
-def bin_search(lst, val):
-    """Binary search for descending list; return insertion index."""
-    left, right = 0, len(lst) - 1
-    while left <= right:
-        mid = (left + right) // 2
-        if lst[mid] == val:
-            return mid
-        elif lst[mid] > val:
-            left = mid + 1   # go right because values decrease
-        else:
-            right = mid - 1
-    return left
+class HttpError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class Request():
+    __slots__ = ("method", "path", "query", "version", "headers", "body")
+
+    def __init__(self, method, path, query, version, headers, body):
+        self.method = method
+        self.path = path
+        self.query = query
+        self.version = version
+        self.headers = headers  # lower-cased names
+        self.body = body
+
+    def form(self):
+        """Body parsed as application/x-www-form-urlencoded"""
+        return dict(parse_qsl(self.body.decode(), keep_blank_values=True))
+
+    def keep_alive(self):
+        connection = self.headers.get("connection", "").lower()
+        if self.version == "HTTP/1.1":
+            return connection != "close"
+        return connection == "keep-alive"
+
+
+class Response():
+    __slots__ = ("status", "headers", "body", "sendfile_path")
+
+    def __init__(self, status="200 OK", body=b"", content_type="text/plain", headers=None, sendfile_path=None):
+        self.status = status
+        self.body = body.encode() if isinstance(body, str) else body
+        self.headers = {"Content-Type": content_type}
+        if headers:
+            self.headers.update(headers)
+        self.sendfile_path = sendfile_path  # file streamed after the body, for big assets
 
 
-def load_csv(path="../namesBac.csv"):
-    if not os.path.exists(path):
-        return pd.DataFrame(columns=["name", "bac"])
+async def read_request(reader):
+    """
+    Read one request off the connection. Headers are read up to the blank line and the
+    body by Content-Length, so nothing gets truncated no matter how it arrives
+
+    Returns:
+        (Request): the request, None if the client closed the connection
+    """
     try:
-        return pd.read_csv(path)
-    except pd.errors.EmptyDataError:
-        return pd.DataFrame(columns=["name", "bac"])
-
-def serve_static_file(path):
-    """Serve static files from the static/ directory"""
-    # Remove leading slash and ensure it's in static directory
-    if path.startswith('/static/'):
-        file_path = path[1:]  # Remove leading slash
-    else:
-        file_path = f"static{path}"
-    
-    # Security check - prevent directory traversal
-    if '..' in file_path or not file_path.startswith('static/'):
-        return None
-    
-    if not os.path.exists(file_path):
+        head = await reader.readuntil(b"\r\n\r\n")
+    except asyncio.IncompleteReadError as e:
+        if e.partial.strip():
+            raise HttpError("400 Bad Request", "Incomplete request")
         return None
-    
+    except asyncio.LimitOverrunError:
+        raise HttpError("431 Request Header Fields Too Large", "Headers too large")
+
+    lines = head.decode("latin-1").split("\r\n")
+    try:
+        method, target, version = lines[0].split(" ") #ie GET / HTTP/1.1
+    except ValueError:
+        raise HttpError("400 Bad Request", "Bad request line")
+
+    headers = {}
+    for line in lines[1:]:
+        if not line:
+            break
+        key, _, value = line.partition(":")
+        headers[key.strip().lower()] = value.strip()
+
+    try:
+        length = int(headers.get("content-length", 0))
+    except ValueError:
+        raise HttpError("400 Bad Request", "Bad Content-Length")
+    if length > MAX_BODY_BYTES:
+        raise HttpError("413 Payload Too Large", "Body too large")
+    body = await reader.readexactly(length) if length else b""
+
+    url = urlsplit(target)
+    return Request(method, url.path, dict(parse_qsl(url.query)), version, headers, body)
+
+
+# =================== ROUTES ===================
+
+async def submit(request):
+    # Example body: "name=Jack&score=0.09&timestamp=1736210521"
+    # this is just for testing
+    try:
+        params = request.form()
+        name = clean_name(params.get("name", ""))
+        bac = float(params.get("score", "0"))
+
+        # use provided timestamp if valid, else current unix time
+        ts = params.get("timestamp")
+        if ts and ts.isdigit():
+            timestamp = int(ts)
+        else:
+            timestamp = int(time.time())
+
+        # append to the reading log, it keeps the sorted order in memory. The write
+        # fsyncs, so it goes to a thread rather than blocking the event loop
+        await asyncio.to_thread(READINGS.append, name, bac, timestamp)
+
+        return Response(body="Success")
+
+    except Exception as e:
+        return Response("400 Error", f"Error: {e}")
+
+
+def cache_name(request):
+    """Cache user's name for breathalyzer workflow"""
+    global PENDING_NAME
+
+    try:
+        name = clean_name(request.form().get("name", ""))
+
+        if not name:
+            return Response("400 Bad Request", "Name is required")
+
+        # check if someone else is already pending
+        if PENDING_NAME != {}:
+            return Response("201 BUSY", "Another user is already pending")
+
+        PENDING_NAME = {
+            "name": name,
+            "timestamp": time.time()
+        }
+        return Response(body="Success initializing session")
+
+    except Exception as e:
+        return Response("400 Error", f"Error: {e}")
+
+
+async def submit_bac(request):
+    """Submit BAC reading and match with cached name"""
+    global PENDING_NAME, MOST_RECENT
+
     try:
-        with open(file_path, 'rb') as f:
-            content = f.read()
-        
-        # Get MIME type
-        mime_type, _ = mimetypes.guess_type(file_path)
-        if not mime_type:
-            if file_path.endswith('.js'):
-                mime_type = 'application/javascript'
-            elif file_path.endswith('.css'):
-                mime_type = 'text/css'
-            elif file_path.endswith('.html'):
-                mime_type = 'text/html'
+        bac = float(request.form().get("bac", "0"))
+        timest = time.time()
+        name = PENDING_NAME.get("name")
+        if not name:
+            return Response("400 Bad Request", "No pending name")
+
+        # setting most recent
+        MOST_RECENT = reading = {
+            "name": name,
+            "bac": bac,
+            "timestamp": timest
+        }
+
+        # clear from pending
+        PENDING_NAME = {}
+
+        # append to the reading log, it keeps the sorted order in memory. Off the event
+        # loop like submit; another submit can replace MOST_RECENT meanwhile, so the rank
+        # goes on this reading's own dict
+        insert_index = await asyncio.to_thread(READINGS.append, name, bac, timest) - 1
+        reading["rank"] = insert_index
+
+        return Response(body=f"Success: {name} - {bac:.3f}")
+
+    except Exception as e:
+        return Response("400 Error", f"Error: {e}")
+
+
+def static(request):
+    """index.html and static files (CSS, JS, images, etc.) out of ASSETS"""
+    asset = ASSETS.lookup(request.path)
+    if asset is None:
+        return Response("404 Not Found", "<html><body><h1>404 Not Found</h1></body></html>", "text/html")
+
+    if asset.etag in request.headers.get("if-none-match", ""):
+        return Response("304 Not Modified", headers={"ETag": asset.etag, "Cache-Control": asset.cache_control})
+
+    if asset.body is None:
+        # big file, goes out with sendfile straight from the page cache
+        return Response(headers=asset.headers(), content_type=asset.mime_type, sendfile_path=asset.file_path)
+
+    body, gzipped = asset.pick_body(request.headers.get("accept-encoding", ""))
+    return Response(body=body, content_type=asset.mime_type, headers=asset.headers(gzipped))
+
+
+def render_leaderboard():
+    return render_leaderboard_table(READINGS.snapshot())
+
+
+async def leaderboard(request):
+    try:
+        # rendering is CPU work, keep it off the event loop so other clients aren't stalled
+        html_table = await asyncio.to_thread(render_leaderboard)
+        return Response(body=html_table, content_type="text/html")
+
+    except Exception as e:
+        return Response("500 Internal Server Error", f"Error displaying leaderboard: {e}")
+
+
+def recent(request):
+    """Get most recent reading"""
+    data = {
+        "name": MOST_RECENT.get("name", ""),
+        "bac": MOST_RECENT.get("bac", 0),
+        "timestamp": MOST_RECENT.get("timestamp", 0),
+        "rank": MOST_RECENT.get("rank", 0)
+    }
+    return Response(body=json.dumps(data), content_type="application/json")
+
+
+def status(request):
+    try:
+        if READINGS.latest_ts is None:
+            msg = "No entries yet."
+        else:
+            latest_ts = MOST_RECENT.get("timestamp") if MOST_RECENT.get("timestamp") else READINGS.latest_ts
+            elapsed = int(time.time()) - latest_ts
+
+            if elapsed <= 900:  # 15 minutes = 900 seconds
+                msg = f"Last blow was {elapsed // 60} min ago → OK"
             else:
-                mime_type = 'application/octet-stream'
-        
-        return content, mime_type
-    except Exception:
-        return None
+                msg = f"Last blow was {elapsed // 60} min ago → TOO LONG"
+        if PENDING_NAME != {}:
+            msg = "BUSY. Someone is already in the process"
+
+        return Response(body=msg)
+
+    except Exception as e:
+        return Response("500 Internal Server Error", f"Error checking status: {e}")
+
+
+ROUTES = {
+    ("POST", "/submit"): submit,
+    ("POST", "/cache-name"): cache_name,
+    ("POST", "/submit-bac"): submit_bac,
+    ("GET", "/leaderboard"): leaderboard,
+    ("GET", "/recent"): recent,
+    ("GET", "/status"): status,
+}
 
 
-def generate_session_id():
-    """Generate a simple session ID"""
-    return str(int(time.time() * 1000))[-8:]  # Last 8 digits of timestamp
+async def dispatch(request):
+    handler = ROUTES.get((request.method, request.path))
+    if handler is None and request.method == "GET" and (
+        request.path == "/" or request.path.startswith(("/static/", "/assets/"))
+    ):
+        handler = static
+    if handler is None:
+        return Response("404 Not Found", "<html><body><h1>404 Not Found</h1></body></html>", "text/html")
 
+    response = handler(request)
+    if asyncio.iscoroutine(response):
+        response = await response
+    return response
 
-with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-    s.bind((HOST, PORT)) # says socket listens to specified channels, on given port
-    s.listen(1) # starts listening for incoming conns, 1 is amount of unaccepted connections allowed in queue
 
+# =================== ENGINE ===================
+
+async def write_response(writer, response, keep_alive):
+    headers = dict(response.headers)
+    headers.setdefault("Content-Length", str(len(response.body)))
+    headers["Connection"] = "keep-alive" if keep_alive else "close"
+
+    head = f"HTTP/1.1 {response.status}\r\n"
+    head += "".join(f"{key}: {value}\r\n" for key, value in headers.items())
+    writer.write(head.encode() + b"\r\n" + response.body)
+    await writer.drain()
+
+    if response.sendfile_path:
+        with open(response.sendfile_path, "rb") as f:
+            await asyncio.get_running_loop().sendfile(writer.transport, f)
+
+
+async def handle_connection(reader, writer):
+    """Serve requests off one connection until the client closes it or goes idle"""
+    addr = writer.get_extra_info("peername")
+    print(f"Connected by address: {addr}")
+
+    try:
+        while True:
+            try:
+                request = await asyncio.wait_for(read_request(reader), IDLE_TIMEOUT)
+            except asyncio.TimeoutError:
+                break
+            except HttpError as e:
+                await write_response(writer, Response(e.status, str(e)), keep_alive=False)
+                break
+
+            if request is None:
+                break
+            print(f"Method: {request.method}, Path: {request.path}")
+
+            try:
+                response = await dispatch(request)
+            except Exception as e:
+                response = Response("500 Internal Server Error", f"Error: {e}")
+
+            keep_alive = request.keep_alive()
+            await write_response(writer, response, keep_alive)
+            if not keep_alive:
+                break
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass  # client went away mid-request
+    finally:
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except ConnectionError:
+            pass
+
+
+async def main():
+    server = await asyncio.start_server(
+        handle_connection, HOST or None, PORT, limit=MAX_HEADER_BYTES, backlog=128
+    )
     print(f"Serving on port: {PORT}")
+    async with server:
+        await server.serve_forever()
 
-    while True:
-        conn, addr = s.accept() # .accept() blocks (halts) until someone connects, returning new conn object for this
-        # ... connection and the ip address of the connection
-
-        with conn:
-            print(f"Connected by address: {addr}")
-
-            raw_request = conn.recv(1024) # receives HTTP request in BYTES, max 1024
-
-            request = raw_request.decode()
-            print(f"HTTP request decoded: {request}")
-
-            lines = request.split("\r\n")
-            request_line = lines[0]
-            method, path, version = request_line.split(" ") #ie GET / HTTP/1.1
-            print(f"Method: {method}, Path: {path}")
-
-            if method == "POST" and path == "/submit":
-                # Example body: "name=Jack&score=0.09&timestamp=1736210521"
-                # this is just for testing
-                body = lines[-1]
-                print(f"POST body: {body}")
-
-                try:
-                    params = dict(p.split("=") for p in body.split("&"))
-                    name = params.get("name", "").strip().replace(",", "")
-                    bac = float(params.get("score", "0"))
-
-                    # use provided timestamp if valid, else current unix time
-                    ts = params.get("timestamp")
-                    if ts and ts.isdigit():
-                        timestamp = int(ts)
-                    else:
-                        timestamp = int(time.time())
-
-                    # load leaderboard
-                    og_df = load_csv()
-
-                    # insert row at correct place
-                    bac_list = og_df["bac"].tolist() if "bac" in og_df else []
-                    insert_index = bin_search(bac_list, bac)
-
-                    new_row = {"name": name, "bac": bac, "timestamp": timestamp}
-                    top = og_df.iloc[:insert_index]
-                    bottom = og_df.iloc[insert_index:]
-                    og_df = pd.concat([top, pd.DataFrame([new_row]), bottom]).reset_index(drop=True)
-
-                    og_df.to_csv("../namesBac.csv", index=False)
-
-                    response = (
-                        "HTTP/1.1 200 OK\r\n"
-                        "Content-Type: text/plain\r\n"
-                        "Connection: close\r\n"
-                        "\r\n"
-                        "Success\r\n"
-                    )
-
-                except Exception as e:
-                    response = (
-                        "HTTP/1.1 400 Error\r\n"
-                        "Content-Type: text/plain\r\n"
-                        "Connection: close\r\n"
-                        "\r\n"
-                        f"Error: {e}\r\n"
-                    )
-
-            elif method == "POST" and path == "/cache-name":
-                # Cache user's name for breathalyzer workflow
-                body = lines[-1]
-                print(f"POST body: {body}")
-
-                try:
-                    params = dict(p.split("=") for p in body.split("&"))
-                    name = params.get("name", "").strip().replace(",", "")
-                    
-                    if not name:
-                        response = (
-                            "HTTP/1.1 400 Bad Request\r\n"
-                            "Content-Type: text/plain\r\n"
-                            "Connection: close\r\n"
-                            "\r\n"
-                            "Name is required\r\n"
-                        )
-                    else:
-                        # check if someone else is already pending
-                        if PENDING_NAME != {}:
-                            response = (
-                                "HTTP/1.1 201 BUSY\r\n"
-                                "Content-Type: text/plain\r\n"
-                                "Connection: close\r\n"
-                                "\r\n"
-                                f"Another user is already pending\r\n"
-                            )
-                        
-                        else:
-                            # Generate session ID and cache name
-                            PENDING_NAME = {
-                                "name": name,
-                                "timestamp": time.time()
-                            }
-
-                            response = (
-                                "HTTP/1.1 200 OK\r\n"
-                                "Content-Type: text/plain\r\n"
-                                "Connection: close\r\n"
-                                "\r\n"
-                                f"Success initializing session\r\n"
-                            )
-
-                except Exception as e:
-                    response = (
-                        "HTTP/1.1 400 Error\r\n"
-                        "Content-Type: text/plain\r\n"
-                        "Connection: close\r\n"
-                        "\r\n"
-                        f"Error: {e}\r\n"
-                    )
-
-            elif method == "POST" and path == "/submit-bac":
-                # Submit BAC reading and match with cached name
-                body = lines[-1]
-                print(f"POST body: {body}")
-
-                try:
-                    params = dict(p.split("=") for p in body.split("&"))
-                    bac = float(params.get("bac", "0"))
-                    timest = time.time()
-                    
-                    # Find cached name for this session
-                    write_data = {
-                        "name": PENDING_NAME.get("name"),
-                        "bac": bac,
-                        "timestamp": timest
-                    }
-
-                    # setting most recent
-                    MOST_RECENT = {
-                        "name": PENDING_NAME.get("name"),
-                        "bac": bac,
-                        "timestamp": timest
-                    }
-
-                    # clear from pending
-                    PENDING_NAME = {}
-                        
-                    # Save to CSV
-                    og_df = load_csv()
-
-                    # insert row at correct place
-                    bac_list = og_df["bac"].tolist() if "bac" in og_df else []
-                    insert_index = bin_search(bac_list, bac)
-                    MOST_RECENT["rank"] = insert_index
-
-                    new_row = write_data
-                    top = og_df.iloc[:insert_index]
-                    bottom = og_df.iloc[insert_index:]
-                    og_df = pd.concat([top, pd.DataFrame([new_row]), bottom]).reset_index(drop=True)
-
-                    og_df.to_csv("../namesBac.csv", index=False)
-
-                    response = (
-                        "HTTP/1.1 200 OK\r\n"
-                        "Content-Type: text/plain\r\n"
-                        "Connection: close\r\n"
-                        "\r\n"
-                        f"Success: {name} - {bac:.3f}\r\n"
-                    )
-
-                except Exception as e:
-                    response = (
-                        "HTTP/1.1 400 Error\r\n"
-                        "Content-Type: text/plain\r\n"
-                        "Connection: close\r\n"
-                        "\r\n"
-                        f"Error: {e}\r\n"
-                    )
-
-
-            if method == "GET" and path == "/":
-                # Serve the main index.html file
-                static_result = serve_static_file("/index.html")
-                if static_result:
-                    content, mime_type = static_result
-                    response = (
-                        "HTTP/1.1 200 OK\r\n"
-                        f"Content-Type: {mime_type}\r\n"
-                        f"Content-Length: {len(content)}\r\n"
-                        "Connection: close\r\n"
-                        "\r\n"
-                    ).encode() + content
-                else:
-                    response = (
-                        "HTTP/1.1 404 Not Found\r\n"
-                        "Content-Type: text/html\r\n"
-                        "Connection: close\r\n"
-                        "\r\n"
-                        "<html><body><h1>404 Not Found</h1></body></html>\r\n"
-                    )
-
-            elif method == "GET" and path.startswith("/static/"):
-                # Serve static files (CSS, JS, images, etc.)
-                static_result = serve_static_file(path)
-                if static_result:
-                    content, mime_type = static_result
-                    response = (
-                        "HTTP/1.1 200 OK\r\n"
-                        f"Content-Type: {mime_type}\r\n"
-                        f"Content-Length: {len(content)}\r\n"
-                        "Connection: close\r\n"
-                        "\r\n"
-                    ).encode() + content
-                else:
-                    response = (
-                        "HTTP/1.1 404 Not Found\r\n"
-                        "Content-Type: text/plain\r\n"
-                        "Connection: close\r\n"
-                        "\r\n"
-                        "File not found\r\n"
-                    )
-
-            elif method == "GET" and path == "/leaderboard":
-                try:
-                    og_df = load_csv()
-
-                    if "timestamp" in og_df:
-                        og_df["time"] = pd.to_datetime(og_df["timestamp"], unit="s")
-
-                    html_table = og_df[["name", "bac", "time"]].to_html(
-                        index=False, float_format="%.3f"
-                    )
-
-                    response = (
-                        "HTTP/1.1 200 OK\r\n"
-                        "Content-Type: text/html\r\n"
-                        "Connection: close\r\n"
-                        "\r\n"
-                        f"{html_table}"
-                    )
-
-                except Exception as e:
-                    response = (
-                        "HTTP/1.1 500 Internal Server Error\r\n"
-                        "Content-Type: text/plain\r\n"
-                        "Connection: close\r\n"
-                        "\r\n"
-                        f"Error displaying leaderboard: {e}\r\n"
-                    )
-
-            elif method == "GET" and path == "/recent":
-                # Get most recent reading
-                try:
-                    if MOST_RECENT:
-                        response = (
-                            "HTTP/1.1 200 OK\r\n"
-                            "Content-Type: application/json\r\n"
-                            "Connection: close\r\n"
-                            "\r\n"
-                            f'{{"name": "{MOST_RECENT.get("name", "")}", "bac": {MOST_RECENT.get("bac", 0)}, "timestamp": {MOST_RECENT.get("timestamp", 0)}, "rank": {MOST_RECENT.get("rank", 0)}}}\r\n'
-                        )
-                    else:
-                        response = (
-                            "HTTP/1.1 200 OK\r\n"
-                            "Content-Type: application/json\r\n"
-                            "Connection: close\r\n"
-                            "\r\n"
-                            '{"name": "", "bac": 0, "timestamp": 0, "rank": 0}\r\n'
-                        )
-                except Exception as e:
-                    response = (
-                        "HTTP/1.1 500 Internal Server Error\r\n"
-                        "Content-Type: text/plain\r\n"
-                        "Connection: close\r\n"
-                        "\r\n"
-                        f"Error: {e}\r\n"
-                    )
-
-            elif method == "GET" and path == "/status":
-                try:
-                    og_df = load_csv()
-
-                    if og_df.empty:
-                        msg = "No entries yet."
-                    else:
-                        latest_ts = MOST_RECENT.get("timestamp") if MOST_RECENT.get("timestamp") else (og_df["timestamp"].max())
-                        elapsed = int(time.time()) - latest_ts
-
-                        if elapsed <= 900:  # 15 minutes = 900 seconds
-                            msg = f"Last blow was {elapsed // 60} min ago → OK"
-                        else:
-                            msg = f"Last blow was {elapsed // 60} min ago → TOO LONG"
-                    if PENDING_NAME != {}:
-                        msg = "BUSY. Someone is already in the process"
-
-                    response = (
-                        "HTTP/1.1 200 OK\r\n"
-                        "Content-Type: text/plain\r\n"
-                        "Connection: close\r\n"
-                        "\r\n"
-                        f"{msg}\r\n"
-                    )
-
-                except Exception as e:
-                    response = (
-                        "HTTP/1.1 500 Internal Server Error\r\n"
-                        "Content-Type: text/plain\r\n"
-                        "Connection: close\r\n"
-                        "\r\n"
-                        f"Error checking status: {e}\r\n"
-                    )
-
-            if 'response' not in locals() or response is None:
-                response = (
-                    "HTTP/1.1 404 Not Found\r\n"
-                    "Content-Type: text/html\r\n"
-                    "Connection: close\r\n"
-                    "\r\n"
-                    "<html><body><h1>404 Not Found</h1></body></html>\r\n"
-                )
-
-            # Send response - handle both string and bytes responses
-            if isinstance(response, str):
-                conn.sendall(response.encode())
-            else:
-                conn.sendall(response)
\ No newline at end of file
+
+if __name__ == "__main__":
+    asyncio.run(main())
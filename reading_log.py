@@ -0,0 +1,429 @@
+import csv
+import fcntl
+import heapq
+import os
+import threading
+import time
+from contextlib import contextmanager
+from itertools import islice
+from archive import ARCHIVE_PATH, Archive, can_archive
+from leaderboard import LeaderboardIndex, WindowedLeaderboard, row_key
+from metrics import STORAGE_SECONDS
+from storage import Storage, UserStats, name_key, stored_row
+
+SNAPSHOT_PATH = "../namesBac.csv"
+LOG_PATH = "../namesBac.log"
+FIELDS = ["name", "bac", "timestamp"]
+ARCHIVE_AFTER = 30 * 24 * 60 * 60  # readings older than this move to the archive
+INSERT_CHUNK = 500  # rows of a bulk insert added to the index per hold of the lock
+
+_LOAD_TIME = STORAGE_SECONDS.labels("csv", "load")
+_APPEND_TIME = STORAGE_SECONDS.labels("csv", "append")
+_COMPACT_TIME = STORAGE_SECONDS.labels("csv", "compact")
+_ARCHIVE_TIME = STORAGE_SECONDS.labels("csv", "archive")
+
+
+def parse_row(row):
+    """Turn a csv row (list of str) into a (name, bac, timestamp) tuple, None if malformed"""
+    try:
+        name, bac, ts = row[0], float(row[1]), float(row[2])
+    except (IndexError, ValueError):
+        return None
+    return (name, bac, ts)
+
+
+def _read_rows(path):
+    """Read every reading out of a csv file, skipping the header and any torn lines"""
+    if not os.path.exists(path):
+        return []
+
+    rows = []
+    with open(path, newline="") as f:
+        for row in csv.reader(f):
+            if row == FIELDS:
+                continue
+            parsed = parse_row(row)
+            if parsed:
+                rows.append(parsed)
+    return rows
+
+
+class ReadingLog(Storage):
+    """
+    Append-only store for BAC readings.
+
+    Every submit is one line appended to LOG_PATH. Recent history lives in memory
+    in a LeaderboardIndex, and a background thread periodically folds the log into
+    the SNAPSHOT_PATH csv (same name,bac,timestamp format the servers always wrote)
+    so startup replay stays short.
+
+    Readings older than archive_after seconds are moved out of both at compaction,
+    into the columnar Archive at archive_path. It's memory-mapped, so however long
+    the history gets the csv and the skiplist only hold the hot set. Queries merge
+    the two tiers; an archived reading ranks exactly as it did before it moved.
+    archive_after=None never archives, and neither does a machine without numpy.
+
+    Loading and compaction hold an flock on <log_path>.lock, so two processes
+    opening the same files (eg the debug reloader's watcher and its child) never
+    rewrite them at once. Only one of them should write though: background=False
+    is for a process that won't, it then never compacts or archives.
+    """
+    def __init__(self, snapshot_path=SNAPSHOT_PATH, log_path=LOG_PATH, compact_every=500,
+                 archive_path=ARCHIVE_PATH, archive_after=ARCHIVE_AFTER, background=True):
+        self.snapshot_path = snapshot_path
+        self.log_path = log_path
+        self.lock_path = log_path + ".lock"
+        self.compact_every = compact_every
+        self.archive_path = archive_path
+        if archive_after and not can_archive():
+            print("numpy isn't installed, old readings won't be archived")
+            archive_after = None
+        self.archive_after = archive_after
+        self.lock = threading.Lock()
+        self._compact_lock = threading.Lock()  # one compaction at a time
+
+        self.index = LeaderboardIndex()  # (name, bac, timestamp), highest bac first
+        self._pending = 0  # lines in the log not yet folded into the snapshot
+        self.latest_ts = None  # timestamp of the newest reading
+        self._latest_by_name = {}
+        self._users = {}  # name_key -> UserStats
+        self._windows = {}  # seconds -> WindowedLeaderboard, made on first use
+        self._version = 0  # bumped on every append
+
+        with self._files_locked():
+            self.archive = Archive(archive_path)
+            self._load()
+
+        self._log = open(self.log_path, "a", newline="")
+        self._writer = csv.writer(self._log)
+
+        self._wake = threading.Event()
+        if not background:
+            return
+
+        # finish off a compaction that died halfway
+        if os.path.exists(self.log_path + ".compacting"):
+            self.compact()
+
+        self._compactor = threading.Thread(target=self._compact_loop, daemon=True)
+        self._compactor.start()
+
+        # eg the first start with a long csv history: move the old part out now
+        if self.archive_after and any(r[2] < time.time() - self.archive_after for r in self.index):
+            self._wake.set()
+
+    @contextmanager
+    def _files_locked(self):
+        """Hold the cross-process lock on the snapshot, log and archive files"""
+        with open(self.lock_path, "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _load(self):
+        """Load snapshot then replay any log lines written since the last compaction"""
+        with _LOAD_TIME.time():
+            rows = _read_rows(self.snapshot_path)
+
+            # a compaction that died before cleaning up leaves its rotated log behind.
+            # those lines may or may not have made it into the snapshot, so dedupe them
+            leftover = self.log_path + ".compacting"
+            if os.path.exists(leftover):
+                seen = set(rows)
+                rows.extend(r for r in _read_rows(leftover) if r not in seen)
+
+            logged = _read_rows(self.log_path)
+        rows.extend(logged)
+        self._pending = len(logged)
+
+        # and one that died after writing the archive leaves readings in both tiers
+        archive = self.archive
+        rows = [r for r in rows if r[2] >= archive.cutoff or not archive.contains(r)]
+
+        self.index = LeaderboardIndex(rows)
+        for name, count, total, best, best_ts, last, last_ts in archive.user_totals():
+            stats = UserStats(name)
+            stats.count, stats.total, stats.best, stats.best_ts, stats.last, stats.last_ts = (
+                count, total, best, best_ts, last, last_ts)
+            self._merge_user(stats)
+            if name not in self._latest_by_name or last_ts > self._latest_by_name[name]:
+                self._latest_by_name[name] = last_ts
+
+        self.latest_ts = max((r[2] for r in rows), default=archive.latest_timestamp())
+        for name, bac, ts in rows:
+            if name not in self._latest_by_name or ts > self._latest_by_name[name]:
+                self._latest_by_name[name] = ts
+            self._add_user(name, bac, ts)
+
+    def _merge_user(self, stats):
+        key = name_key(stats.name)
+        if key in self._users:
+            self._users[key].merge(stats)
+        else:
+            self._users[key] = stats
+
+    def rank_of(self, bac: float):
+        """1-based rank a reading of this bac would get (ties share a rank)"""
+        with self.lock:
+            return self._rank_of(bac)
+
+    def _rank_of(self, bac):
+        return self.archive.count_above(bac) + self.index.rank_of(bac)
+
+    def _page(self, offset, limit):
+        """Readings at positions [offset, offset + limit) across both tiers, caller holds the lock"""
+        offset = max(offset, 0)
+        archive, hot = self.archive, self.index
+        if not len(archive):
+            return hot.slice(offset, offset + limit)
+
+        # binary search how many of the first offset readings are archived ones. On a
+        # tie the archived reading comes first
+        lo, hi = max(0, offset - len(hot)), min(offset, len(archive))
+        while lo < hi:
+            i = (lo + hi) // 2
+            if row_key(archive.rows(i, i + 1)[0]) <= row_key(hot.row_at(offset - i - 1)):
+                lo = i + 1
+            else:
+                hi = i
+        return self._merge(archive.rows(lo, lo + limit), hot.slice(offset - lo, offset - lo + limit), limit)
+
+    @staticmethod
+    def _merge(archived, hot, limit):
+        return list(islice(heapq.merge(archived, hot, key=row_key), limit))
+
+    def append(self, name: str, bac: float, timestamp: float):
+        """
+        Record a reading. Costs one small write to the log regardless of history size
+
+        Returns:
+            (int): 1-based rank of the new reading
+        """
+        row = stored_row(name, bac, timestamp)
+
+        with self.lock:
+            with _APPEND_TIME.time():
+                self._writer.writerow(row)
+                self._log.flush()
+                os.fsync(self._log.fileno())
+
+            rank = self._insert(row)
+            self._pending += 1
+
+            if self._pending >= self.compact_every:
+                self._wake.set()
+
+        return rank
+
+    def extend(self, rows):
+        """Append many (name, bac, timestamp) readings with a single flush"""
+        rows = [stored_row(*r) for r in rows]
+
+        with self.lock:
+            with _APPEND_TIME.time():
+                self._writer.writerows(rows)
+                self._log.flush()
+                os.fsync(self._log.fileno())
+
+            for row in rows:
+                self._insert(row)
+            self._pending += len(rows)
+
+            if self._pending >= self.compact_every:
+                self._wake.set()
+
+    def bulk_insert(self, batches):
+        """
+        Record batches of readings, eg an import. Each batch is one write to the log,
+        then goes into memory INSERT_CHUNK rows at a time with the lock let go in
+        between, so submits and reads never wait behind more than one chunk of a big
+        import. Every batch is in memory before the next one is read, so if batches
+        raises partway, what was recorded before it stays recorded
+
+        Returns:
+            (int): number of readings recorded
+        """
+        count = 0
+        # a compaction now would snapshot the index without the rows already logged
+        with self._compact_lock:
+            for batch in batches:
+                batch = [stored_row(*r) for r in batch]
+                with self.lock:
+                    with _APPEND_TIME.time():
+                        self._writer.writerows(batch)
+                        self._log.flush()
+                        os.fsync(self._log.fileno())
+                    self._pending += len(batch)
+                for start in range(0, len(batch), INSERT_CHUNK):
+                    with self.lock:
+                        for row in batch[start:start + INSERT_CHUNK]:
+                            self._insert(row)
+                count += len(batch)
+
+        if self._pending >= self.compact_every:
+            self._wake.set()
+        return count
+
+    def _insert(self, row):
+        """Add a row to the in-memory structures, caller holds the lock"""
+        self._note(row)
+        return self.index.insert(row)
+
+    def _note(self, row):
+        """Everything _insert does bar the index itself"""
+        self._version += 1
+        name, _, ts = row
+        if self.latest_ts is None or ts > self.latest_ts:
+            self.latest_ts = ts
+        if name not in self._latest_by_name or ts > self._latest_by_name[name]:
+            self._latest_by_name[name] = ts
+        self._add_user(name, row[1], ts)
+        for board in self._windows.values():
+            board.add(row)
+
+    def _add_user(self, name, bac, ts):
+        key = name_key(name)
+        stats = self._users.get(key)
+        if stats is None:
+            stats = self._users[key] = UserStats(name)
+        stats.add(name, bac, ts)
+
+    def user_stats(self, name):
+        """Count/best/last/mean for a name and the rank of their best, O(log n)"""
+        with self.lock:
+            stats = self._users.get(name_key(name))
+            if stats is None:
+                return None
+            return stats.to_dict(self._rank_of(stats.best))
+
+    def window(self, seconds):
+        with self.lock:
+            board = self._windows.get(seconds)
+            if board is None:
+                # one pass over the history, from then on every append keeps it current
+                cutoff = time.time() - seconds
+                rows = [r for r in self.index if r[2] >= cutoff] + self.archive.recent(cutoff)
+                board = WindowedLeaderboard(seconds, rows)
+                self._windows[seconds] = board
+        return board
+
+    def latest_timestamp(self, name=None):
+        if name is None:
+            return self.latest_ts
+        return self._latest_by_name.get(name)
+
+    def version(self):
+        return self._version
+
+    def recent(self, since):
+        with self.lock:
+            rows = [r for r in self.index if r[2] >= since] + self.archive.recent(since)
+        return sorted(rows, key=lambda r: r[2])
+
+    def snapshot(self):
+        """Copy of every reading, highest bac first"""
+        with self.lock:
+            return self._merge(self.archive.rows(0, len(self.archive)), self.index, len(self))
+
+    def page(self, offset: int, limit: int):
+        """Readings ranked offset+1 .. offset+limit"""
+        with self.lock:
+            return self._page(offset, limit)
+
+    def after(self, row, limit: int, seen: int = 1):
+        with self.lock:
+            lo, hi = self.archive.bounds(row)
+            skipped = min(seen, hi - lo)
+            archived = self.archive.rows(lo + skipped, lo + skipped + limit)
+            return self._merge(archived, self.index.after(row, limit, seen - skipped), limit)
+
+    def top(self, k: int):
+        return self.page(0, k)
+
+    def around(self, rank: int, radius: int = 2):
+        """(first rank, readings) for the neighbours of a 1-based rank"""
+        start = max(rank - 1 - radius, 0)
+        with self.lock:
+            return start + 1, self._page(start, rank + radius - start)
+
+    def __len__(self):
+        return len(self.archive) + len(self.index)
+
+    def compact(self):
+        """
+        Fold the log into the snapshot csv.
+
+        The log is rotated under the lock so submits keep appending to a fresh file
+        while the (slow) snapshot write happens outside of it.
+        """
+        rotated = self.log_path + ".compacting"
+
+        with self._compact_lock, self._files_locked():
+            with self.lock:
+                rows = list(self.index)
+                self._log.close()
+                if os.path.exists(rotated):
+                    # leftover from a crashed compaction: keep its lines until the
+                    # new snapshot is safely on disk
+                    with open(self.log_path, newline="") as src, open(rotated, "a", newline="") as dst:
+                        dst.write(src.read())
+                    os.remove(self.log_path)
+                else:
+                    os.replace(self.log_path, rotated)
+                self._log = open(self.log_path, "a", newline="")
+                self._writer = csv.writer(self._log)
+                self._pending = 0
+
+            aged = []
+            if self.archive_after:
+                cutoff = time.time() - self.archive_after
+                aged = [r for r in rows if r[2] < cutoff]
+            if aged:
+                # archive first: if we die before the snapshot is replaced, _load finds
+                # these in both and drops the csv copies
+                try:
+                    with _ARCHIVE_TIME.time():
+                        archive = self.archive.merged(aged, cutoff)
+                except Exception as e:
+                    # they stay in the csv for now, the log still has to be folded in
+                    print(f"ERROR archiving old readings: {e}")
+                    aged = []
+                else:
+                    rows = [r for r in rows if r[2] >= cutoff]
+
+            tmp = f"{self.snapshot_path}.{os.getpid()}.tmp"
+            with _COMPACT_TIME.time():
+                with open(tmp, "w", newline="") as f:
+                    writer = csv.writer(f)
+                    writer.writerow(FIELDS)
+                    writer.writerows(rows)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp, self.snapshot_path)
+
+            if aged:
+                with self.lock:
+                    self.archive = archive
+                    for row in aged:
+                        self.index.remove(row)
+                    self._version += 1  # archived timestamps are rounded to the microsecond
+
+            os.remove(rotated)
+
+    def _compact_loop(self):
+        while True:
+            self._wake.wait()
+            self._wake.clear()
+            try:
+                self.compact()
+            except Exception as e:
+                print(f"ERROR compacting reading log: {e}")
+
+    def close(self):
+        """Compact whatever is pending and close the log file"""
+        if self._pending:
+            self.compact()
+        with self.lock:
+            self._log.close()
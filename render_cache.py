@@ -0,0 +1,72 @@
+import gzip
+import threading
+from collections import OrderedDict
+
+
+class RenderCache():
+    """
+    Rendered response bodies keyed by query, valid for one data version.
+
+    As long as no new reading lands, a repeated poll is a dict lookup instead of a
+    render. The first request for a new version drops every entry, but the previous
+    version's are kept aside for last() to serve when there's no capacity to render.
+    Gzip copies are made once per entry, the first time a client that accepts gzip asks.
+    """
+    def __init__(self, max_entries: int = 64):
+        self.lock = threading.Lock()
+        self.max_entries = max_entries
+        self.version = None
+        self.entries = OrderedDict()  # key -> [body, gzipped body or None]
+        self.stale = {}  # the same for the version before
+
+    def get(self, version, key, render, want_gzip: bool = False):
+        """
+        Args:
+            version: data version the caller read before asking
+            key: anything hashable that identifies the query (route + params)
+            render: zero-arg function returning the body as bytes, called on a miss
+            want_gzip (bool): client sent Accept-Encoding: gzip
+
+        Returns:
+            (bytes): the body, gzipped if want_gzip
+            (bool): whether it's gzipped
+        """
+        with self.lock:
+            if version != self.version:
+                self.stale = self.entries
+                self.entries = OrderedDict()
+                self.version = version
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+
+        if entry is None:
+            # render outside the lock, two racing misses just render twice
+            entry = [render(), None]
+            with self.lock:
+                if version == self.version:
+                    self.entries[key] = entry
+                    while len(self.entries) > self.max_entries:
+                        self.entries.popitem(last=False)
+
+        return self._encode(entry, want_gzip)
+
+    def last(self, key, want_gzip: bool = False):
+        """
+        Most recent body rendered for key, whatever version it was for. Same return
+        as get(), or None if there isn't one
+        """
+        with self.lock:
+            entry = self.entries.get(key) or self.stale.get(key)
+        if entry is None:
+            return None
+        return self._encode(entry, want_gzip)
+
+    @staticmethod
+    def _encode(entry, want_gzip):
+        if not want_gzip:
+            return entry[0], False
+
+        if entry[1] is None:
+            entry[1] = gzip.compress(entry[0], compresslevel=6, mtime=0)
+        return entry[1], True
@@ -1,11 +1,26 @@
-import pandas as pd
-import mimetypes
+import html
 import os
 import time
 
+TABLE_HEAD = """<table border="1" class="dataframe">
+  <thead>
+    <tr style="text-align: right;">
+      <th>name</th>
+      <th>bac</th>
+      <th>time</th>
+    </tr>
+  </thead>
+  <tbody>
+"""
+TABLE_TAIL = """  </tbody>
+</table>"""
+
+
 # Helper functions (you'll need to include these from your original code)
 def load_csv():
-    """Load the CSV file, create if doesn't exist"""
+    """Load the CSV file into a DataFrame, create if doesn't exist. Analytics only, pulls in pandas"""
+    import pandas as pd
+
     try:
         return pd.read_csv("../namesBac.csv")
     except FileNotFoundError:
@@ -14,33 +29,76 @@ def load_csv():
         df.to_csv("../namesBac.csv", index=False)
         return df
 
-def check_long_enough(n: int = 15):
+
+def render_leaderboard_table(rows, bacs=None):
     """
-    Check if there has been enough elapsed time since last blow
+    The leaderboard as an html table, the same markup pandas' to_html made for
+    name/bac/time (static/script.js parses it), built with plain string formatting
 
     Args:
-        n (int): how many minutes we want in between each blow
+        rows: (name, bac, timestamp) readings in leaderboard order
+        bacs: values for the bac column if not the stored ones, eg calibrated
 
     Returns:
-        (bool): Representing status. False if not enough time elapsed, or error reading file. Else true
-        (int): Number of minutes until enough time elapsed. -1 if error
+        (str): the table
     """
-    try:
-        og_df = load_csv()
+    if bacs is None:
+        bacs = [bac for _, bac, _ in rows]
+    escape = html.escape
+    strftime = time.strftime
+    gmtime = time.gmtime
 
-        if og_df.empty:
-            return True, 0
-        else:
-            latest_ts = og_df["timestamp"].max()
-            elapsed = int(time.time()) - latest_ts
+    parts = [TABLE_HEAD]
+    for (name, _, ts), bac in zip(rows, bacs):
+        parts.append(
+            f"    <tr>\n      <td>{escape(name, quote=False)}</td>\n      <td>{bac:.3f}</td>\n"
+            f"      <td>{strftime('%Y-%m-%d %H:%M:%S', gmtime(ts))}</td>\n    </tr>\n"
+        )
+    parts.append(TABLE_TAIL)
+    return "".join(parts)
 
-            if elapsed <= n*60:  # 15 minutes = 900 seconds
-                return False, n*60 - elapsed//60
-            else:
-                return True, 0
+def open_storage(kind: str = None, background: bool = True):
+    """
+    Open the reading store the servers use
 
-    except Exception as e:
-        return (False, -1)
+    Args:
+        kind (str): "csv" for the append-only ReadingLog, "sqlite" for SqliteStorage.
+            Defaults to the BREATH_STORAGE env var, then "csv". For "csv",
+            BREATH_ARCHIVE_DAYS sets how old readings get before they're archived
+            (0 never archives)
+        background (bool): False for a process that only reads the csv store and
+            mustn't compact it, see ReadingLog
+
+    Returns:
+        (Storage): the opened store
+    """
+    kind = kind or os.environ.get("BREATH_STORAGE", "csv")
+
+    if kind == "sqlite":
+        from archive import ARCHIVE_PATH
+        from leaderboard import keyset_batches
+        from reading_log import LOG_PATH, SNAPSHOT_PATH, ReadingLog
+        from storage import SqliteStorage, DB_PATH
+        first_run = not os.path.exists(DB_PATH)
+        store = SqliteStorage(DB_PATH)
+        legacy = (SNAPSHOT_PATH, LOG_PATH, LOG_PATH + ".compacting", ARCHIVE_PATH)
+        if first_run and any(os.path.exists(path) for path in legacy):
+            # one-shot import of the history from before the db existed. Through a
+            # ReadingLog, so readings still in its log (not yet compacted into the csv)
+            # and archived ones come along too. It only reads, never compacts
+            history = ReadingLog(background=False)
+            n = store.bulk_insert(keyset_batches(history, 5000))
+            history.close()
+            print(f"Imported {n} readings from the csv reading log")
+        return store
+
+    if kind == "csv":
+        from reading_log import ARCHIVE_AFTER, ReadingLog
+        days = os.environ.get("BREATH_ARCHIVE_DAYS")
+        archive_after = float(days) * 24 * 60 * 60 if days is not None else ARCHIVE_AFTER
+        return ReadingLog(archive_after=archive_after or None, background=background)
+
+    raise ValueError(f"unknown storage {kind!r}")
 
 
 def bin_search(arr, target):
@@ -53,38 +111,3 @@ def bin_search(arr, target):
         else:
             right = mid
     return left
-
-def serve_static_file(path):
-    """Serve static files from the static/ directory"""
-    # Remove leading slash and ensure it's in static directory
-    if path.startswith('/static/'):
-        file_path = path[1:]  # Remove leading slash
-    else:
-        file_path = f"static{path}"
-
-    # Security check - prevent directory traversal
-    if '..' in file_path or not file_path.startswith('static/'):
-        return None
-
-    if not os.path.exists(file_path):
-        return None
-
-    try:
-        with open(file_path, 'rb') as f:
-            content = f.read()
-
-        # Get MIME type
-        mime_type, _ = mimetypes.guess_type(file_path)
-        if not mime_type:
-            if file_path.endswith('.js'):
-                mime_type = 'application/javascript'
-            elif file_path.endswith('.css'):
-                mime_type = 'text/css'
-            elif file_path.endswith('.html'):
-                mime_type = 'text/html'
-            else:
-                mime_type = 'application/octet-stream'
-
-        return content, mime_type
-    except Exception:
-        return None
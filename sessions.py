@@ -0,0 +1,490 @@
+import sqlite3
+import threading
+import time
+from collections import deque
+from metrics import LOCK_WAIT_SECONDS, TimedLock
+from models import BlowSession, BlowState
+
+DEFAULT_DEVICE = "default"  # what a device that doesn't send an id is called
+STATION_TIMEOUT = 90  # seconds without a poll before a station counts as offline
+SESSION_TIMEOUT = 180  # seconds a session may sit on a station before it's given up on
+MAX_QUEUE = 20
+SHARED_DB_PATH = "../shared.db"  # session state shared between worker processes
+POLL_INTERVAL = 0.2  # seconds between checks while a station long-polls the shared store
+STATION_COOLDOWN = 15 * 60  # seconds a station's sensor needs to recover after a blow
+
+_WRITE_WAIT = LOCK_WAIT_SECONDS.labels("shared_sessions")  # BEGIN IMMEDIATE on the shared db
+
+
+class SessionManager():
+    """
+    BlowSessions keyed by breathalyzer station, plus a FIFO queue for when they're all busy.
+
+    Stations register themselves just by polling /should-start-blow with their device
+    id. A new session goes to whichever online station is free and has cooled down
+    since its last blow (the sensor needs cooldown_s to recover), otherwise it waits
+    in the queue and is handed to the next station that's ready, so stations never sit
+    idle while people are waiting.
+    """
+    def __init__(self, max_queue: int = MAX_QUEUE, cooldown_s: float = STATION_COOLDOWN):
+        self.cooldown_s = cooldown_s
+        self.lock = TimedLock(threading.Lock(), LOCK_WAIT_SECONDS.labels("sessions"))
+        self.changed = threading.Condition(self.lock)  # notified whenever a session starts or ends
+        self.sessions = {}  # device id -> BlowSession
+        self.last_seen = {}  # device id -> last poll time
+        self.ready_at = {}  # device id -> when its sensor has cooled down from the last blow
+
+        self.queue = deque()
+        self.max_queue = max_queue
+        self._enqueued = 0  # queue numbers handed out so far
+        self._dequeued = 0  # queue numbers that have reached a station
+        self.avg_blow_s = 60.0  # moving average of station time per session, for wait estimates
+        self.by_queue_no = {}  # queue number -> session, until the session ends
+
+    def _online(self, now):
+        return [d for d, ts in self.last_seen.items() if now - ts <= STATION_TIMEOUT]
+
+    def _ready(self, device_id, now):
+        """Station has no session and its sensor has cooled down, caller holds the lock"""
+        return device_id not in self.sessions and self.ready_at.get(device_id, 0) <= now
+
+    def _free_station(self, now):
+        """
+        Online, ready station, the one idle longest first. None if there's none, also
+        when nothing has polled yet (eg right after a restart): the session then queues
+        for whichever station turns up first. Caller holds the lock
+        """
+        free = [d for d in self._online(now) if self._ready(d, now)]
+        if not free:
+            return None
+        return min(free, key=lambda d: self.last_seen.get(d, 0))
+
+    def _assign(self, session, device_id):
+        """Put a session on a station, caller holds the lock"""
+        session.device_id = device_id
+        session.state = BlowState.PREBLOW
+        session.ts = time.time()  # the blow is timed from when it reaches a station
+        self.sessions[device_id] = session
+        self.changed.notify_all()
+
+    def _expire(self, now):
+        """
+        Drop sessions nobody blew on in time, on any station: one that went offline
+        never polls again to clear its own. Caller holds the lock
+        """
+        for device_id, session in list(self.sessions.items()):
+            if now - session.ts > SESSION_TIMEOUT:
+                del self.sessions[device_id]
+                self.by_queue_no.pop(session.queue_no, None)
+                session.release_trace()
+                self.changed.notify_all()
+
+    def _hand_off(self, device_id):
+        """Give a station that's ready the next queued session, caller holds the lock"""
+        if self.queue and self._ready(device_id, time.time()):
+            self._dequeued += 1
+            self._assign(self.queue.popleft(), device_id)
+
+    def start(self, name: str):
+        """
+        Start a session for name on a free station, or queue it
+
+        Returns:
+            (BlowSession): the new session (device_id is None while it's queued),
+                None if every station is busy and the queue is full
+        """
+        with self.lock:
+            now = time.time()
+            self._expire(now)
+            session = BlowSession(name=name)
+            device_id = self._free_station(now)
+            if device_id is not None and not self.queue:
+                self._assign(session, device_id)
+                return session
+
+            if len(self.queue) >= self.max_queue:
+                return None
+            self._enqueued += 1
+            session.queue_no = self._enqueued
+            self.queue.append(session)
+            self.by_queue_no[session.queue_no] = session
+            return session
+
+    def position(self, queue_no: int):
+        """
+        Where a queued session stands, O(1)
+
+        Returns:
+            (int): place in the queue, 1 is next up. 0 once it's reached a station
+            (float): estimated seconds until it gets a station
+            (str): the station it's on, None while queued or once it's over
+        """
+        with self.lock:
+            place = queue_no - self._dequeued
+            if place <= 0:
+                session = self.by_queue_no.get(queue_no)
+                return 0, 0.0, getattr(session, "device_id", None)
+            stations = max(len(self._online(time.time())), 1)
+            return place, place * (self.avg_blow_s + self.cooldown_s) / stations, None
+
+    def wait_estimate(self):
+        """Seconds until a session started now would reach a station"""
+        with self.lock:
+            now = time.time()
+            if not self.queue and self._free_station(now) is not None:
+                return 0.0
+            stations = max(len(self._online(now)), 1)
+            return (len(self.queue) + 1) * (self.avg_blow_s + self.cooldown_s) / stations
+
+    def _pending(self, device_id):
+        session = self.sessions.get(device_id)
+        if session and session.name and session.bac is None:
+            return session
+        return None
+
+    def active(self, device_id: str):
+        """The session on a station that's still waiting for its reading, None if there isn't one"""
+        with self.lock:
+            return self._pending(device_id)
+
+    def poll(self, device_id: str, wait: float = 0):
+        """
+        Called when a station asks whether to start a blow. Optionally blocks up to
+        wait seconds for a session to show up
+
+        Returns:
+            (BlowSession): the session waiting on this station, None if there isn't one
+        """
+        with self.lock:
+            now = time.time()
+            self.last_seen[device_id] = now
+
+            # nobody blew in time, move on to whoever's next
+            self._expire(now)
+            self._hand_off(device_id)
+
+            if wait:
+                deadline = now + wait
+                while not self._pending(device_id) and time.time() < deadline:
+                    # also wake when this station's sensor is ready, to take the next in line
+                    ready = self.ready_at.get(device_id, 0)
+                    until = ready if time.time() < ready < deadline else deadline
+                    self.changed.wait(timeout=until - time.time())
+                    self._hand_off(device_id)
+                self.last_seen[device_id] = time.time()
+            return self._pending(device_id)
+
+    def finish(self, device_id: str, bac: float):
+        """
+        Record the station's reading and free it up. It gets the next queued session
+        once its sensor has cooled down
+
+        Returns:
+            (BlowSession): the finished session, None if the station had none
+        """
+        with self.lock:
+            session = self.sessions.pop(device_id, None)
+            if session is None:
+                return None
+            session.set_bac(bac)
+            self.by_queue_no.pop(session.queue_no, None)
+            now = time.time()
+            self.avg_blow_s = 0.8 * self.avg_blow_s + 0.2 * (now - session.ts)
+            self.ready_at[device_id] = now + self.cooldown_s
+
+            self._hand_off(device_id)
+            self.changed.notify_all()
+            return session
+
+    def stations(self):
+        """{device id: name of whoever is on it, or None} for every online station"""
+        with self.lock:
+            now = time.time()
+            return {d: getattr(self.sessions.get(d), "name", None) for d in self._online(now)}
+
+    def queue_length(self):
+        return len(self.queue)
+
+
+class SqliteSessionManager():
+    """
+    SessionManager with its state in SQLite, for running several worker processes.
+
+    Same interface and the same station/queue rules, but every worker sees the same
+    sessions, so a name cached through one worker can be blown on a station polling
+    another. Each change is one BEGIN IMMEDIATE transaction, which SQLite serialises
+    across processes. Long-polls can't be woken by another process, so they recheck
+    every POLL_INTERVAL seconds instead.
+
+    Sessions come back as BlowSession objects. The ones this worker has seen are kept,
+    so a detector or trace attached to one survives until the session ends here.
+    """
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS stations (
+            device_id TEXT PRIMARY KEY,
+            last_seen REAL NOT NULL,
+            ready_at REAL NOT NULL DEFAULT 0
+        );
+        CREATE TABLE IF NOT EXISTS sessions (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            device_id TEXT,
+            queue_no INTEGER,
+            ts REAL NOT NULL,
+            state TEXT NOT NULL,
+            bac REAL,
+            done INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE UNIQUE INDEX IF NOT EXISTS sessions_station ON sessions (device_id) WHERE done = 0;
+        CREATE INDEX IF NOT EXISTS sessions_queue ON sessions (queue_no) WHERE done = 0 AND device_id IS NULL;
+        CREATE TABLE IF NOT EXISTS counters (
+            key TEXT PRIMARY KEY,
+            value REAL NOT NULL
+        );
+        INSERT OR IGNORE INTO counters VALUES ('enqueued', 0), ('dequeued', 0), ('avg_blow_s', 60.0);
+    """
+
+    def __init__(self, path: str = SHARED_DB_PATH, max_queue: int = MAX_QUEUE,
+                 cooldown_s: float = STATION_COOLDOWN):
+        self.path = path
+        self.max_queue = max_queue
+        self.cooldown_s = cooldown_s
+        self._local = threading.local()  # sqlite connections can't be shared across threads
+        self.lock = threading.Lock()  # guards _seen
+        self._seen = {}  # session id -> BlowSession, for sessions alive in this worker
+
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(self.SCHEMA)
+        if "ready_at" not in {col[1] for col in conn.execute("PRAGMA table_info(stations)")}:
+            # state file from before stations had a cooldown
+            conn.execute("ALTER TABLE stations ADD COLUMN ready_at REAL NOT NULL DEFAULT 0")
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _write(self):
+        """Connection inside a BEGIN IMMEDIATE transaction, use as `with self._write() as conn:`"""
+        return _Transaction(self._conn())
+
+    def _session(self, row):
+        """BlowSession for a (id, name, device_id, queue_no, ts, state, bac) row"""
+        session_id, name, device_id, queue_no, ts, state, bac = row
+        with self.lock:
+            session = self._seen.get(session_id)
+            if session is None:
+                if len(self._seen) >= 1024:
+                    # sessions another worker finished never get forgotten here, drop the oldest
+                    for stale in list(self._seen)[:512]:
+                        del self._seen[stale]
+                session = self._seen[session_id] = BlowSession(name=name)
+        session.device_id = device_id
+        session.queue_no = queue_no
+        session.ts = ts
+        session.state = BlowState(state)
+        session.bac = bac
+        return session
+
+    def _forget(self, session_id):
+        with self.lock:
+            return self._seen.pop(session_id, None)
+
+    def _counter(self, conn, key):
+        return conn.execute("SELECT value FROM counters WHERE key = ?", (key,)).fetchone()[0]
+
+    def _online(self, conn, now):
+        return [d for (d,) in conn.execute(
+            "SELECT device_id FROM stations WHERE last_seen >= ? ORDER BY last_seen",
+            (now - STATION_TIMEOUT,))]
+
+    def _assign(self, conn, session_id, device_id):
+        conn.execute(
+            "UPDATE sessions SET device_id = ?, ts = ?, state = ? WHERE id = ?",
+            (device_id, time.time(), BlowState.PREBLOW.value, session_id),
+        )
+
+    def _expire(self, conn, now):
+        """Drop sessions nobody blew on in time, on any station, offline ones included"""
+        expired = conn.execute(
+            "SELECT id FROM sessions WHERE device_id IS NOT NULL AND done = 0 AND ts < ?",
+            (now - SESSION_TIMEOUT,),
+        ).fetchall()
+        for (session_id,) in expired:
+            conn.execute("UPDATE sessions SET done = 1 WHERE id = ?", (session_id,))
+            session = self._forget(session_id)
+            if session is not None:
+                session.release_trace()
+
+    def _ready_at(self, conn, device_id):
+        row = conn.execute("SELECT ready_at FROM stations WHERE device_id = ?", (device_id,)).fetchone()
+        return row[0] if row else 0.0
+
+    def _hand_off(self, conn, device_id):
+        """Give a station that's free and cooled down the next queued session"""
+        if conn.execute("SELECT 1 FROM sessions WHERE device_id = ? AND done = 0", (device_id,)).fetchone():
+            return
+        if self._ready_at(conn, device_id) > time.time():
+            return
+        row = conn.execute(
+            "SELECT id FROM sessions WHERE done = 0 AND device_id IS NULL ORDER BY queue_no LIMIT 1"
+        ).fetchone()
+        if row:
+            conn.execute("UPDATE counters SET value = value + 1 WHERE key = 'dequeued'")
+            self._assign(conn, row[0], device_id)
+
+    def _free_stations(self, conn, now):
+        """
+        Online stations with no session and a cooled down sensor, oldest last_seen first.
+        None before any station has polled, the session queues until one does
+        """
+        online = self._online(conn, now)
+        busy = {d for (d,) in conn.execute("SELECT device_id FROM sessions WHERE done = 0 AND device_id IS NOT NULL")}
+        return [d for d in online if d not in busy and self._ready_at(conn, d) <= now]
+
+    def start(self, name: str):
+        now = time.time()
+        with self._write() as conn:
+            self._expire(conn, now)
+            free = self._free_stations(conn, now)
+            (queued,) = conn.execute(
+                "SELECT COUNT(*) FROM sessions WHERE done = 0 AND device_id IS NULL").fetchone()
+
+            if free and not queued:
+                cur = conn.execute(
+                    "INSERT INTO sessions (name, device_id, ts, state) VALUES (?, ?, ?, ?)",
+                    (name, free[0], now, BlowState.PREBLOW.value),
+                )
+            else:
+                if queued >= self.max_queue:
+                    return None
+                conn.execute("UPDATE counters SET value = value + 1 WHERE key = 'enqueued'")
+                queue_no = int(self._counter(conn, "enqueued"))
+                cur = conn.execute(
+                    "INSERT INTO sessions (name, queue_no, ts, state) VALUES (?, ?, ?, ?)",
+                    (name, queue_no, now, BlowState.CACHED_NAME.value),
+                )
+            row = conn.execute(
+                "SELECT id, name, device_id, queue_no, ts, state, bac FROM sessions WHERE id = ?",
+                (cur.lastrowid,),
+            ).fetchone()
+        return self._session(row)
+
+    def position(self, queue_no: int):
+        conn = self._conn()
+        place = queue_no - int(self._counter(conn, "dequeued"))
+        if place <= 0:
+            row = conn.execute(
+                "SELECT device_id FROM sessions WHERE queue_no = ? AND done = 0", (queue_no,)
+            ).fetchone()
+            return 0, 0.0, row[0] if row else None
+        stations = max(len(self._online(conn, time.time())), 1)
+        return place, place * (self._counter(conn, "avg_blow_s") + self.cooldown_s) / stations, None
+
+    def wait_estimate(self):
+        conn = self._conn()
+        now = time.time()
+        queued = self.queue_length()
+        if not queued and self._free_stations(conn, now):
+            return 0.0
+        stations = max(len(self._online(conn, now)), 1)
+        return (queued + 1) * (self._counter(conn, "avg_blow_s") + self.cooldown_s) / stations
+
+    def _pending(self, device_id):
+        row = self._conn().execute(
+            "SELECT id, name, device_id, queue_no, ts, state, bac FROM sessions"
+            " WHERE device_id = ? AND done = 0 AND bac IS NULL",
+            (device_id,),
+        ).fetchone()
+        return self._session(row) if row else None
+
+    def active(self, device_id: str):
+        return self._pending(device_id)
+
+    def poll(self, device_id: str, wait: float = 0):
+        now = time.time()
+        with self._write() as conn:
+            conn.execute(
+                "INSERT INTO stations (device_id, last_seen) VALUES (?, ?) ON CONFLICT (device_id) DO UPDATE SET last_seen = excluded.last_seen",
+                (device_id, now),
+            )
+            # nobody blew in time, move on to whoever's next
+            self._expire(conn, now)
+            self._hand_off(conn, device_id)
+            ready_at = self._ready_at(conn, device_id)
+
+        session = self._pending(device_id)
+        deadline = now + wait
+        while session is None and time.time() < deadline:
+            time.sleep(min(POLL_INTERVAL, max(deadline - time.time(), 0)))
+            if now < ready_at <= time.time():
+                # the sensor just cooled down, take the next in line
+                with self._write() as conn:
+                    self._hand_off(conn, device_id)
+                ready_at = 0.0
+            session = self._pending(device_id)
+        if wait:
+            with self._write() as conn:
+                conn.execute("UPDATE stations SET last_seen = ? WHERE device_id = ?", (time.time(), device_id))
+        return session
+
+    def finish(self, device_id: str, bac: float):
+        now = time.time()
+        with self._write() as conn:
+            row = conn.execute(
+                "SELECT id, name, device_id, queue_no, ts, state, bac FROM sessions"
+                " WHERE device_id = ? AND done = 0",
+                (device_id,),
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                "UPDATE sessions SET bac = ?, state = ?, done = 1 WHERE id = ?",
+                (float(bac), BlowState.FINISHED.value, row[0]),
+            )
+            conn.execute(
+                "UPDATE counters SET value = 0.8 * value + 0.2 * ? WHERE key = 'avg_blow_s'",
+                (now - row[4],),
+            )
+            conn.execute("UPDATE stations SET ready_at = ? WHERE device_id = ?", (now + self.cooldown_s, device_id))
+            self._hand_off(conn, device_id)
+            # finished sessions are only kept around for a day
+            conn.execute("DELETE FROM sessions WHERE done = 1 AND ts < ?", (now - 24 * 3600,))
+
+        session = self._session(row)
+        self._forget(row[0])
+        session.set_bac(bac)
+        return session
+
+    def stations(self):
+        conn = self._conn()
+        online = self._online(conn, time.time())
+        names = dict(conn.execute("SELECT device_id, name FROM sessions WHERE done = 0 AND device_id IS NOT NULL"))
+        return {d: names.get(d) for d in online}
+
+    def queue_length(self):
+        (queued,) = self._conn().execute(
+            "SELECT COUNT(*) FROM sessions WHERE done = 0 AND device_id IS NULL").fetchone()
+        return queued
+
+
+class _Transaction():
+    """BEGIN IMMEDIATE ... COMMIT, rolled back if the block raises"""
+    __slots__ = ("conn",)
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        # waits here for any other worker's write, the shared manager's version of its lock
+        start = time.perf_counter()
+        self.conn.execute("BEGIN IMMEDIATE")
+        _WRITE_WAIT.observe(time.perf_counter() - start)
+        return self.conn
+
+    def __exit__(self, exc_type, *exc):
+        self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
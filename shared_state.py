@@ -0,0 +1,87 @@
+import json
+import sqlite3
+import threading
+import time
+from sessions import SHARED_DB_PATH
+
+KEEP_EVENTS = 1000  # events kept in the table for slow relays to catch up on
+
+
+class SharedState():
+    """
+    What the workers of a multi-process server have to agree on, besides sessions
+    (SqliteSessionManager) and readings (SqliteStorage): a few JSON values such as
+    the most recent reading, and the event feed.
+
+    Events are rows in a table. Each worker runs a relay thread that tails it and
+    republishes new rows into its own EventBroker, so an /events stream open on one
+    worker hears about a submit that landed on another.
+    """
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS kv (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS events (
+            id INTEGER PRIMARY KEY,
+            event TEXT NOT NULL,
+            data TEXT NOT NULL
+        );
+    """
+
+    def __init__(self, path: str = SHARED_DB_PATH):
+        self.path = path
+        self._local = threading.local()  # sqlite connections can't be shared across threads
+
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(self.SCHEMA)
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: str, default=None):
+        row = self._conn().execute("SELECT value FROM kv WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def set(self, key: str, value):
+        self._conn().execute(
+            "INSERT INTO kv VALUES (?, ?) ON CONFLICT (key) DO UPDATE SET value = excluded.value",
+            (key, json.dumps(value)),
+        )
+
+    def publish(self, event: str, data):
+        """Same call as EventBroker.publish, but every worker's subscribers get it"""
+        conn = self._conn()
+        cur = conn.execute("INSERT INTO events (event, data) VALUES (?, ?)", (event, json.dumps(data)))
+        if cur.lastrowid % 100 == 0:
+            conn.execute("DELETE FROM events WHERE id <= ?", (cur.lastrowid - KEEP_EVENTS,))
+
+    def relay(self, broker, interval: float = 0.25):
+        """Start a daemon thread feeding events from every worker into broker"""
+        (last,) = self._conn().execute("SELECT COALESCE(MAX(id), 0) FROM events").fetchone()
+
+        def tail():
+            nonlocal last
+            conn = self._conn()
+            while True:
+                time.sleep(interval)
+                try:
+                    rows = conn.execute(
+                        "SELECT id, event, data FROM events WHERE id > ? ORDER BY id", (last,)
+                    ).fetchall()
+                except sqlite3.Error as e:
+                    print(f"ERROR relaying events: {e}")
+                    continue
+                for event_id, event, data in rows:
+                    broker.publish(event, json.loads(data))
+                    last = event_id
+
+        thread = threading.Thread(target=tail, daemon=True)
+        thread.start()
+        return thread
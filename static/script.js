@@ -1,9 +1,16 @@
 // =================== CONFIG / STATE ===================
 const POLL_MS = 3000;
 let pollId = null;
+let events = null; // EventSource for /events, polling is the fallback
+let eventsLive = false;
 let firstLeaderboardLoad = true;
 let lastLeaderboardHTML = null;
+let leaderboardETag = null; // version of the rows we last rendered
 let lastStatus = null; // 'READY' | 'WAIT' | 'ERROR' | null
+let queueTicket = null; // our place in the station queue, while we're waiting
+let queueTimer = null; // interval id of the backup queue refresh
+let queueListener = null; // our 'queue' event handler on `events`, so it can be removed
+let statsFor = null; // "<name>@<timestamp>" whose personal stats are showing
 const MOCK = new URLSearchParams(location.search).get('mock') === '1';
 
 // =================== UTILITIES ===================
@@ -39,8 +46,14 @@ document.addEventListener('DOMContentLoaded', () => {
 
       if (res.ok) {
         // Success: show a small confirmation in the status area
-        statusEl.className = 'status-ready';
-        statusEl.textContent = '✅ You’re queued—device will prompt when ready.';
+        const data = await res.json().catch(() => ({}));
+        if (data.status === 'QUEUED') {
+          queueTicket = data.ticket;
+          renderQueuePosition(statusEl, data);
+          watchQueue(statusEl);
+        } else {
+          renderStationReady(statusEl, data.device);
+        }
         // You can also keep the form open so next user can type their name
       } else {
         const msg = (await res.text()).trim();
@@ -70,9 +83,10 @@ document.addEventListener('DOMContentLoaded', () => {
     }
   });
 
-  // Initial load + polling
+  // Initial load, then server push (or polling if push isn't available)
   loadLeaderboard();
   loadRecentReading();
+  startEvents();
   startPolling();
   document.addEventListener('visibilitychange', () => {
     if (document.hidden) stopPolling(); else startPolling();
@@ -86,9 +100,89 @@ function setFormOpen(formWrap, readyBtn, open) {
   readyBtn?.setAttribute('aria-expanded', open ? 'true' : 'false');
 }
 
+// =================== STATION QUEUE ===================
+function renderStationReady(statusEl, device) {
+  statusEl.className = 'status-ready';
+  statusEl.textContent = device && device !== 'default'
+    ? `✅ You’re up on ${device}—it will prompt you when ready.`
+    : '✅ You’re queued—device will prompt when ready.';
+}
+
+function renderQueuePosition(statusEl, data) {
+  const mins = Math.max(1, Math.ceil((data.estimated_wait_s || 0) / 60));
+  statusEl.className = 'status-wait';
+  statusEl.textContent = `⏳ Every station is busy or cooling down—you’re #${data.position} in line (about ${mins} min).`;
+}
+
+// Refresh our place when the server says the queue moved, with a slow timer as backup
+function watchQueue(statusEl) {
+  stopWatchingQueue();
+  queueListener = () => refreshQueuePosition(statusEl);
+  events?.addEventListener('queue', queueListener);
+  queueTimer = setInterval(queueListener, eventsLive ? POLL_MS * 5 : POLL_MS);
+}
+
+function stopWatchingQueue() {
+  clearInterval(queueTimer);
+  queueTimer = null;
+  if (queueListener) events?.removeEventListener('queue', queueListener);
+  queueListener = null;
+}
+
+async function refreshQueuePosition(statusEl) {
+  if (queueTicket == null) return;
+  try {
+    const res = await fetch(`/queue-position?ticket=${queueTicket}`, { cache: 'no-store' });
+    if (!res.ok) return;
+    const data = await res.json();
+    if (data.position > 0) {
+      renderQueuePosition(statusEl, data);
+      return;
+    }
+    // our turn (or the session is already over), stop watching
+    queueTicket = null;
+    stopWatchingQueue();
+    if (data.device) renderStationReady(statusEl, data.device);
+  } catch {
+    // network blip, the next refresh will catch up
+  }
+}
+
+// =================== SERVER PUSH ===================
+// The server pushes an event only when something changes, so while the stream
+// is up we don't poll at all. If it drops, polling takes over until it's back.
+function startEvents() {
+  if (MOCK || !window.EventSource) return;
+
+  events = new EventSource('/events');
+
+  events.addEventListener('open', () => {
+    eventsLive = true;
+    stopPolling();
+    // catch up on anything missed while disconnected
+    loadLeaderboard();
+    loadRecentReading();
+  });
+
+  events.addEventListener('error', () => {
+    eventsLive = false;
+    if (!document.hidden) startPolling();
+  });
+
+  events.addEventListener('leaderboard', () => loadLeaderboard());
+
+  events.addEventListener('most-recent', (e) => {
+    try {
+      renderRecentReading(JSON.parse(e.data));
+    } catch {
+      loadRecentReading();
+    }
+  });
+}
+
 // =================== POLLING ===================
 function startPolling() {
-  if (pollId) return;
+  if (pollId || eventsLive) return;
   pollId = setInterval(() => {
     loadLeaderboard();
     loadRecentReading();
@@ -163,15 +257,25 @@ async function loadLeaderboard() {
   if (firstLeaderboardLoad) mount.textContent = 'Loading...';
 
   try {
-    let html;
+    let data;
     if (MOCK) {
-      html = buildMockTableHTML(10);
+      data = parseLeaderboardHTML(buildMockTableHTML(10));
     } else {
-      const res = await fetch('/leaderboard', { cache: 'no-store' });
-      html = await res.text();
+      // compact top-10 rows; the server answers 304 if nothing changed since last time
+      const headers = leaderboardETag ? { 'If-None-Match': leaderboardETag } : {};
+      const res = await fetch('/leaderboard.json?top=10', { cache: 'no-store', headers });
+      if (res.status === 304) return;
+      if (!res.ok) throw new Error(`leaderboard ${res.status}`);
+      const body = await res.json();
+      leaderboardETag = res.headers.get('ETag');
+      data = body.rows.map(([name, bac]) => ({
+        name: String(name),
+        bacRaw: Number(bac).toFixed(3),
+        bacNum: Number(bac) || 0
+      }));
     }
 
-    const next = renderKahootLeaderboard(html);
+    const next = renderKahootLeaderboard(data);
     if (next !== lastLeaderboardHTML) {
       mount.innerHTML = next;
       lastLeaderboardHTML = next;
@@ -183,11 +287,11 @@ async function loadLeaderboard() {
   }
 }
 
-// Parse the server’s HTML table and render podium + 4–10
-function renderKahootLeaderboard(html) {
+// Parse an HTML leaderboard table (mock mode) into rows for the podium
+function parseLeaderboardHTML(html) {
   const doc = new DOMParser().parseFromString(html, 'text/html');
   const table = doc.querySelector('table');
-  if (!table) return '<p class="muted">No readings yet.</p>';
+  if (!table) return [];
 
   const headers = Array.from(table.querySelectorAll('thead th, tr:first-child th')).map(h => h.textContent.trim().toLowerCase());
   const rows = Array.from(table.querySelectorAll('tbody tr, table tr')).filter(r => r.querySelectorAll('td').length);
@@ -205,6 +309,11 @@ function renderKahootLeaderboard(html) {
     return { name, bacRaw, bacNum };
   }).filter(d => d.name);
 
+  return data;
+}
+
+// Render podium + 4–10 from rows of { name, bacRaw, bacNum }, highest first
+function renderKahootLeaderboard(data) {
   if (!data.length) return '<p class="muted">No readings yet.</p>';
 
   const top3 = data.slice(0, 3);
@@ -249,11 +358,6 @@ function renderKahootLeaderboard(html) {
 
 // =================== RECENT BANNER (Voltage-preferred) ===================
 async function loadRecentReading() {
-  const bannerEl = document.getElementById('recentBanner');
-  const nameEl = document.getElementById('recentName');
-  const bacEl  = document.getElementById('recentBAC');
-  const rankEl = document.getElementById('recentRank');
-
   try {
     let data;
     if (MOCK) {
@@ -263,34 +367,65 @@ async function loadRecentReading() {
       const res = await fetch('/get-most-recent', { cache: 'no-store' });
       data = await res.json();
     }
-
-     let metricText = '';
-      if (typeof data.bac === 'number' && !Number.isNaN(data.bac)) {
-        metricText = `${data.bac.toFixed(3)}%`;
-      } else if (data.bac != null) {
-        // Handle numeric string like "0.089" or "0.089%"
-        const bacNum = parseFloat(String(data.bac).replace(/[^\d.+-eE]/g, ''));
-        metricText = Number.isNaN(bacNum) ? String(data.bac) : `${bacNum.toFixed(3)}%`;
-      } else if (data.value != null) {
-        metricText = String(data.value);
-      } else {
-        metricText = '—';
-      }
-
-    if (data.name && metricText) {
-      nameEl.textContent = data.name;
-      bacEl.textContent = metricText;
-      rankEl.textContent = (data.rank != null) ? `#${Number(data.rank)}` : '';
-      bannerEl.classList.remove('hidden');
-    } else {
-      bannerEl.classList.add('hidden');
-    }
+    renderRecentReading(data);
   } catch (e) {
     console.error('Error loading recent reading:', e);
+    document.getElementById('recentBanner')?.classList.add('hidden');
+  }
+}
+
+function renderRecentReading(data) {
+  const bannerEl = document.getElementById('recentBanner');
+  const nameEl = document.getElementById('recentName');
+  const bacEl  = document.getElementById('recentBAC');
+  const rankEl = document.getElementById('recentRank');
+  if (!bannerEl) return;
+
+  let metricText = '';
+  if (typeof data.bac === 'number' && !Number.isNaN(data.bac)) {
+    metricText = `${data.bac.toFixed(3)}%`;
+  } else if (data.bac != null) {
+    // Handle numeric string like "0.089" or "0.089%"
+    const bacNum = parseFloat(String(data.bac).replace(/[^\d.+-eE]/g, ''));
+    metricText = Number.isNaN(bacNum) ? String(data.bac) : `${bacNum.toFixed(3)}%`;
+  } else if (data.value != null) {
+    metricText = String(data.value);
+  } else {
+    metricText = '—';
+  }
+
+  if (data.name && metricText) {
+    nameEl.textContent = data.name;
+    bacEl.textContent = metricText;
+    rankEl.textContent = (data.rank != null) ? `#${Number(data.rank)}` : '';
+    bannerEl.classList.remove('hidden');
+    loadUserStats(data.name, data.timestamp);
+  } else {
     bannerEl.classList.add('hidden');
   }
 }
 
+// Personal stats for whoever just blew, only refetched when there's a new reading
+async function loadUserStats(name, timestamp) {
+  const statsEl = document.getElementById('recentStats');
+  if (!statsEl || MOCK) return;
+  const key = `${name}@${timestamp}`;
+  if (key === statsFor) return;
+  statsFor = key;
+
+  try {
+    const res = await fetch(`/user/${encodeURIComponent(name)}`);
+    if (!res.ok) throw new Error(res.status);
+    const s = await res.json();
+    if (key !== statsFor) return; // a newer reading came in meanwhile
+    const blows = s.count === 1 ? '1 blow' : `${s.count} blows`;
+    statsEl.textContent = `Best ${Number(s.best).toFixed(3)}% (#${s.rank}) · ${blows} · typical blow ${Number(s.bac_at_mean_volts).toFixed(3)}%`;
+    statsEl.classList.remove('hidden');
+  } catch {
+    statsEl.classList.add('hidden');
+  }
+}
+
 // =================== MOCK TABLE (for ?mock=1) ===================
 const mockNames = ['Avery','Sam','Jordan','Taylor','Riley','Casey','Alex','Quinn','Morgan','Jamie','Kai','Rowan','Cameron'];
 function buildMockTableHTML(n = 10) {
@@ -0,0 +1,159 @@
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+
+PRELOAD_LIMIT = 256 * 1024  # bigger files (the assets/ photos) stay on disk and get sendfile'd
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+COMPRESSIBLE = ("text/", "application/javascript", "application/json", "image/svg+xml")
+
+
+def guess_mime_type(file_path):
+    mime_type, _ = mimetypes.guess_type(file_path)
+    if not mime_type:
+        if file_path.endswith('.js'):
+            mime_type = 'application/javascript'
+        elif file_path.endswith('.css'):
+            mime_type = 'text/css'
+        elif file_path.endswith('.html'):
+            mime_type = 'text/html'
+        else:
+            mime_type = 'application/octet-stream'
+    return mime_type
+
+
+class Asset():
+    """One servable file. body is None for files too big to keep in memory"""
+    __slots__ = ("url", "file_path", "mime_type", "size", "etag", "body", "gzip_body", "cache_control")
+
+    def __init__(self, url, file_path, mime_type, size, etag, body=None, gzip_body=None, cache_control=REVALIDATE):
+        self.url = url
+        self.file_path = file_path
+        self.mime_type = mime_type
+        self.size = size
+        self.etag = etag
+        self.body = body
+        self.gzip_body = gzip_body
+        self.cache_control = cache_control
+
+    def headers(self, gzipped: bool = False):
+        """Response headers for this asset (Content-Length included)"""
+        headers = {
+            "Content-Type": self.mime_type,
+            "ETag": self.etag,
+            "Cache-Control": self.cache_control,
+        }
+        if self.gzip_body is not None:
+            headers["Vary"] = "Accept-Encoding"
+        if gzipped:
+            headers["Content-Encoding"] = "gzip"
+            headers["Content-Length"] = str(len(self.gzip_body))
+        else:
+            headers["Content-Length"] = str(self.size)
+        return headers
+
+    def pick_body(self, accept_encoding: str = ""):
+        """(body bytes, gzipped) for a client with this Accept-Encoding header"""
+        if self.gzip_body is not None and "gzip" in accept_encoding:
+            return self.gzip_body, True
+        return self.body, False
+
+
+class StaticAssets():
+    """
+    Everything under static/ (and the assets/ images) loaded once at startup.
+
+    Small files are held in memory with a precompressed gzip copy and a strong ETag
+    (content hash). script.js and styles.css are also served under fingerprinted
+    names (script.<hash>.js), which index.html is rewritten to use, so browsers can
+    cache them for a year and never re-download until they actually change.
+    """
+    def __init__(self, roots=(("static", "/static/"), ("assets", "/assets/"))):
+        self.assets = {}  # url -> Asset
+
+        for root, prefix in roots:
+            if not os.path.isdir(root):
+                continue
+            for dirpath, _, filenames in os.walk(root):
+                for filename in filenames:
+                    file_path = os.path.join(dirpath, filename)
+                    url = prefix + os.path.relpath(file_path, root).replace(os.sep, "/")
+                    self._add(url, file_path)
+
+        self._fingerprint("/static/index.html")
+
+        # "/" is the index page
+        if "/static/index.html" in self.assets:
+            self.assets["/"] = self.assets["/static/index.html"]
+            self.assets["/index.html"] = self.assets["/static/index.html"]
+
+    def _add(self, url, file_path, body=None, cache_control=REVALIDATE):
+        mime_type = guess_mime_type(file_path)
+
+        if body is None:
+            size = os.path.getsize(file_path)
+            if size > PRELOAD_LIMIT:
+                st = os.stat(file_path)
+                etag = f'"{st.st_mtime_ns:x}-{size:x}"'
+                self.assets[url] = Asset(url, file_path, mime_type, size, etag, cache_control=cache_control)
+                return self.assets[url]
+            with open(file_path, "rb") as f:
+                body = f.read()
+
+        etag = '"' + hashlib.sha1(body).hexdigest()[:16] + '"'
+        gzip_body = None
+        if mime_type.startswith(COMPRESSIBLE):
+            compressed = gzip.compress(body, compresslevel=9, mtime=0)
+            if len(compressed) < len(body):
+                gzip_body = compressed
+
+        self.assets[url] = Asset(url, file_path, mime_type, len(body), etag, body, gzip_body, cache_control)
+        return self.assets[url]
+
+    def _fingerprint(self, index_url):
+        """Serve css/js under content-hashed names and point the index page at them"""
+        index = self.assets.get(index_url)
+        if index is None or index.body is None:
+            return
+
+        html = index.body.decode()
+        for url, asset in list(self.assets.items()):
+            if asset.body is None or not url.endswith((".js", ".css")):
+                continue
+            base, ext = url.rsplit(".", 1)
+            fingerprinted = f"{base}.{asset.etag.strip(chr(34))[:10]}.{ext}"
+            self._add(fingerprinted, asset.file_path, asset.body, IMMUTABLE)
+            html = re.sub(rf'(["\']){re.escape(url)}(["\'])', rf'\g<1>{fingerprinted}\g<2>', html)
+
+        self._add(index_url, index.file_path, html.encode())
+
+    def lookup(self, path):
+        """Asset for a request path, None if there isn't one"""
+        return self.assets.get(path.split("?", 1)[0])
+
+    def response(self, path, request):
+        """
+        Flask response for the asset at path, None if there's no such asset: 304 when
+        the client's ETag still matches, the in-memory body (gzipped if it can take
+        it) or, for big files, a stream from disk
+        """
+        from flask import Response, send_file
+
+        asset = self.lookup(path)
+        if asset is None:
+            return None
+
+        if asset.etag in request.headers.get("If-None-Match", ""):
+            return Response(status=304, headers={"ETag": asset.etag, "Cache-Control": asset.cache_control})
+
+        if asset.body is None:
+            # too big to keep in memory, stream it from disk
+            response = send_file(asset.file_path, mimetype=asset.mime_type, conditional=False, etag=False)
+            response.headers["ETag"] = asset.etag
+            response.headers["Cache-Control"] = asset.cache_control
+            return response
+
+        body, gzipped = asset.pick_body(request.headers.get("Accept-Encoding", ""))
+        return Response(body, 200, asset.headers(gzipped))
@@ -0,0 +1,576 @@
+import csv
+import io
+import json
+import math
+import os
+import sqlite3
+import sys
+import threading
+import time
+from leaderboard import WindowedLeaderboard, keyset_batches
+from metrics import STORAGE_SECONDS
+
+DB_PATH = "../namesBac.db"
+TRACE_DIR = "../traces"  # raw sensor traces, one file per blow
+EXPORT_FORMATS = {"csv": "text/csv", "ndjson": "application/x-ndjson"}  # -> content type
+
+_SQLITE_WRITE_TIME = STORAGE_SECONDS.labels("sqlite", "write")
+_SQLITE_READ_TIME = STORAGE_SECONDS.labels("sqlite", "read")
+
+
+def clean_name(name: str) -> str:
+    """Name as it gets stored: no commas (it's a csv) and single spaces"""
+    return " ".join(name.replace(",", "").split())
+
+
+def stored_row(name, bac, timestamp):
+    """
+    A (name, bac, timestamp) reading the way every backend writes it. Done before
+    anything is written, so nothing after the write can choke on the row
+
+    Raises:
+        (ValueError): bac or timestamp isn't a number
+    """
+    return (clean_name(str(name or "")), float(bac), float(timestamp))
+
+
+def name_key(name: str) -> str:
+    """What per-name stats are keyed on, so "Sam " and "sam" are the same person"""
+    return clean_name(name).casefold()
+
+
+class UserStats():
+    """Running aggregates of one person's readings, updated per reading in O(1)"""
+    __slots__ = ("name", "count", "total", "best", "best_ts", "last", "last_ts")
+
+    def __init__(self, name):
+        self.name = name  # as last written
+        self.count = 0
+        self.total = 0.0
+        self.best = None
+        self.best_ts = None
+        self.last = None
+        self.last_ts = None
+
+    def add(self, name, bac, ts):
+        self.count += 1
+        self.total += bac
+        if self.best is None or bac > self.best or (bac == self.best and ts < self.best_ts):
+            self.best, self.best_ts = bac, ts
+        if self.last_ts is None or ts >= self.last_ts:
+            self.last, self.last_ts, self.name = bac, ts, name
+
+    def merge(self, other):
+        """Fold in the aggregates of another UserStats for the same person"""
+        self.count += other.count
+        self.total += other.total
+        if self.best is None or other.best > self.best or (other.best == self.best and other.best_ts < self.best_ts):
+            self.best, self.best_ts = other.best, other.best_ts
+        if self.last_ts is None or other.last_ts >= self.last_ts:
+            self.last, self.last_ts, self.name = other.last, other.last_ts, other.name
+
+    def to_dict(self, rank):
+        return {
+            "name": self.name,
+            "count": self.count,
+            "best": self.best,
+            "best_timestamp": self.best_ts,
+            "last": self.last,
+            "last_timestamp": self.last_ts,
+            "mean": self.total / self.count,
+            "rank": rank,
+        }
+
+
+class Storage():
+    """
+    What the servers need from wherever readings live.
+
+    Readings are (name, bac, timestamp) tuples and every ordered query is highest
+    bac first, earlier reading winning a tie, then by name. Ranks are 1-based.
+    """
+    def append(self, name: str, bac: float, timestamp: float):
+        """Record a reading, returns its rank"""
+        raise NotImplementedError
+
+    def extend(self, rows):
+        """Record many (name, bac, timestamp) readings at once"""
+        raise NotImplementedError
+
+    def bulk_insert(self, batches):
+        """
+        Record readings from an iterable of batches (lists of (name, bac, timestamp)),
+        eg an import. Returns how many were recorded
+        """
+        count = 0
+        for batch in batches:
+            self.extend(batch)
+            count += len(batch)
+        return count
+
+    def rank_of(self, bac: float):
+        """Rank a reading of this bac would get (ties share a rank)"""
+        raise NotImplementedError
+
+    def page(self, offset: int, limit: int):
+        """Readings ranked offset+1 .. offset+limit"""
+        raise NotImplementedError
+
+    def after(self, row, limit: int, seen: int = 1):
+        """
+        Up to limit readings that sort after a (name, bac, timestamp) reading, for
+        keyset pagination: seeks to it however deep it is. Exact ties on bac and
+        timestamp are ordered by name. Exact copies of the reading itself (a double
+        submit) are returned too, all but the first `seen` of them
+        """
+        raise NotImplementedError
+
+    def top(self, k: int):
+        return self.page(0, k)
+
+    def around(self, rank: int, radius: int = 2):
+        """(first rank, readings) for the neighbours of a rank"""
+        start = max(rank - 1 - radius, 0)
+        return start + 1, self.page(start, rank + radius - start)
+
+    def latest_timestamp(self, name: str = None):
+        """Timestamp of the newest reading (by name if given), None if there is none"""
+        raise NotImplementedError
+
+    def user_stats(self, name: str):
+        """
+        One person's count, best, last and mean reading, and the rank of their best,
+        without scanning their readings. None if they've never blown
+        """
+        raise NotImplementedError
+
+    def snapshot(self):
+        """Every reading, highest bac first"""
+        raise NotImplementedError
+
+    def recent(self, since: float):
+        """Readings with timestamp >= since, oldest first"""
+        raise NotImplementedError
+
+    def window(self, seconds: float):
+        """
+        WindowedLeaderboard of the readings from the last `seconds`, up to date with
+        every reading recorded so far. Same page/top/around/snapshot as the store
+        """
+        raise NotImplementedError
+
+    def version(self):
+        """Data version, goes up every time a reading is recorded"""
+        raise NotImplementedError
+
+    def __len__(self):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class SqliteStorage(Storage):
+    """
+    Readings in a SQLite database (WAL mode) with indexes on bac, timestamp and name,
+    so rank, cooldown and pagination queries are index lookups rather than file scans.
+    Writes are serialised by SQLite itself, so concurrent submits can't lose rows.
+    """
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS readings (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            bac REAL NOT NULL,
+            timestamp REAL NOT NULL
+        );
+        -- the full board order, so pages and seeks need no sort step of their own
+        CREATE INDEX IF NOT EXISTS readings_rank ON readings (bac DESC, timestamp, name);
+        DROP INDEX IF EXISTS readings_bac;  -- its (bac DESC, timestamp) prefix, from older databases
+        CREATE INDEX IF NOT EXISTS readings_timestamp ON readings (timestamp);
+        CREATE INDEX IF NOT EXISTS readings_name ON readings (name, timestamp);
+        CREATE TABLE IF NOT EXISTS users (
+            key TEXT PRIMARY KEY,
+            name TEXT NOT NULL,
+            count INTEGER NOT NULL,
+            total REAL NOT NULL,
+            best REAL NOT NULL,
+            best_ts REAL NOT NULL,
+            last REAL NOT NULL,
+            last_ts REAL NOT NULL
+        );
+    """
+    # one reading folded into its person's row. Every right hand side sees the old row
+    UPSERT_USER = """
+        INSERT INTO users VALUES (?, ?, 1, ?, ?, ?, ?, ?)
+        ON CONFLICT (key) DO UPDATE SET
+            count = count + 1,
+            total = total + excluded.total,
+            best = MAX(best, excluded.best),
+            best_ts = CASE WHEN excluded.best > best OR (excluded.best = best AND excluded.best_ts < best_ts)
+                           THEN excluded.best_ts ELSE best_ts END,
+            last = CASE WHEN excluded.last_ts >= last_ts THEN excluded.last ELSE last END,
+            name = CASE WHEN excluded.last_ts >= last_ts THEN excluded.name ELSE name END,
+            last_ts = MAX(last_ts, excluded.last_ts)
+    """
+
+    def __init__(self, path=DB_PATH):
+        self.path = path
+        self._local = threading.local()  # sqlite connections can't be shared across threads
+        self._windows = {}  # seconds -> WindowedLeaderboard, in this process
+        self._windows_lock = threading.Lock()
+        self._windows_seen = 0  # id of the last reading fed to them
+
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(self.SCHEMA)
+        self._backfill_users(conn)
+
+    def _backfill_users(self, conn):
+        """Build the users table for a db from before it existed"""
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if conn.execute("SELECT 1 FROM users LIMIT 1").fetchone() is None:
+                rows = conn.execute("SELECT name, bac, timestamp FROM readings ORDER BY id")
+                conn.executemany(self.UPSERT_USER, (self._user_row(r) for r in rows.fetchall()))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    @staticmethod
+    def _user_row(row):
+        name, bac, ts = row[0], float(row[1]), float(row[2])
+        return (name_key(name), name, bac, bac, ts, bac, ts)
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")  # safe with WAL, fsyncs at checkpoints
+            self._local.conn = conn
+        return conn
+
+    def append(self, name, bac, timestamp):
+        row = stored_row(name, bac, timestamp)
+        conn = self._conn()
+        with _SQLITE_WRITE_TIME.time():
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute("INSERT INTO readings (name, bac, timestamp) VALUES (?, ?, ?)", row)
+                conn.execute(self.UPSERT_USER, self._user_row(row))
+                rank = self.rank_of(row[1])
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return rank
+
+    def extend(self, rows):
+        """Insert many (name, bac, timestamp) readings in one transaction"""
+        rows = [stored_row(*r) for r in rows]
+        conn = self._conn()
+        with _SQLITE_WRITE_TIME.time():
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.executemany("INSERT INTO readings (name, bac, timestamp) VALUES (?, ?, ?)", rows)
+                conn.executemany(self.UPSERT_USER, (self._user_row(r) for r in rows))
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+    def rank_of(self, bac):
+        (higher,) = self._conn().execute(
+            "SELECT COUNT(*) FROM readings WHERE bac > ?", (float(bac),)
+        ).fetchone()
+        return higher + 1
+
+    def page(self, offset, limit):
+        with _SQLITE_READ_TIME.time():
+            return self._conn().execute(
+                "SELECT name, bac, timestamp FROM readings"
+                " ORDER BY bac DESC, timestamp, name LIMIT ? OFFSET ?",
+                (limit, max(offset, 0)),
+            ).fetchall()
+
+    def after(self, row, limit, seen=1):
+        name, bac, ts = row[0], float(row[1]), float(row[2])
+        conn = self._conn()
+        with _SQLITE_READ_TIME.time():
+            (copies,) = conn.execute(
+                "SELECT COUNT(*) FROM readings WHERE name = ? AND timestamp = ? AND bac = ?", (name, ts, bac),
+            ).fetchone()
+            rows = [(name, bac, ts)] * max(min(copies - seen, limit), 0)
+            # range scan on readings_rank from the cursor's bac down, only the rows tied
+            # with it on bac need the finer comparison
+            rows += conn.execute(
+                "SELECT name, bac, timestamp FROM readings"
+                " WHERE bac <= ? AND NOT (bac = ? AND (timestamp < ? OR (timestamp = ? AND name <= ?)))"
+                " ORDER BY bac DESC, timestamp, name LIMIT ?",
+                (bac, bac, ts, ts, name, limit - len(rows)),
+            ).fetchall()
+        return rows
+
+    def latest_timestamp(self, name=None):
+        if name is None:
+            row = self._conn().execute("SELECT MAX(timestamp) FROM readings").fetchone()
+        else:
+            row = self._conn().execute(
+                "SELECT MAX(timestamp) FROM readings WHERE name = ?", (name,)
+            ).fetchone()
+        return row[0]
+
+    def user_stats(self, name):
+        row = self._conn().execute(
+            "SELECT name, count, total, best, best_ts, last, last_ts FROM users WHERE key = ?",
+            (name_key(name),),
+        ).fetchone()
+        if row is None:
+            return None
+        stats = UserStats(row[0])
+        stats.count, stats.total, stats.best, stats.best_ts, stats.last, stats.last_ts = row[1:]
+        return stats.to_dict(self.rank_of(stats.best))
+
+    def snapshot(self):
+        with _SQLITE_READ_TIME.time():
+            return self._conn().execute(
+                "SELECT name, bac, timestamp FROM readings ORDER BY bac DESC, timestamp, name"
+            ).fetchall()
+
+    def recent(self, since):
+        return self._conn().execute(
+            "SELECT name, bac, timestamp FROM readings WHERE timestamp >= ? ORDER BY timestamp",
+            (float(since),),
+        ).fetchall()
+
+    def window(self, seconds):
+        # the boards live in memory, other processes' readings are picked up by id
+        # (a primary key range) whenever one is asked for
+        conn = self._conn()
+        with self._windows_lock:
+            if not self._windows:
+                self._windows_seen = self.version()
+            else:
+                rows = conn.execute(
+                    "SELECT id, name, bac, timestamp FROM readings WHERE id > ? ORDER BY id",
+                    (self._windows_seen,),
+                ).fetchall()
+                for row in rows:
+                    for board in self._windows.values():
+                        board.add(row[1:])
+                if rows:
+                    self._windows_seen = rows[-1][0]
+
+            board = self._windows.get(seconds)
+            if board is None:
+                with _SQLITE_READ_TIME.time():
+                    rows = conn.execute(
+                        "SELECT name, bac, timestamp FROM readings WHERE timestamp >= ? AND id <= ?",
+                        (time.time() - seconds, self._windows_seen),
+                    ).fetchall()
+                board = self._windows[seconds] = WindowedLeaderboard(seconds, rows)
+        return board
+
+    def version(self):
+        # rowids only ever grow, and MAX(id) is a single b-tree lookup
+        (latest,) = self._conn().execute("SELECT MAX(id) FROM readings").fetchone()
+        return latest or 0
+
+    def __len__(self):
+        (count,) = self._conn().execute("SELECT COUNT(*) FROM readings").fetchone()
+        return count
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+class TraceStore():
+    """
+    Raw sample traces of finished blows, each one a file of little-endian uint16 in
+    TRACE_DIR named <timestamp>-<device>.u16. Traces are written straight out of the
+    session's ring buffer with writev, so nothing is copied on the way to disk
+    """
+    def __init__(self, directory=TRACE_DIR):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def save(self, device_id: str, timestamp: float, segments):
+        """
+        Args:
+            segments: buffers to write in order, eg SampleRing.segments()
+
+        Returns:
+            (str): path of the trace file
+        """
+        safe_device = "".join(c if c.isalnum() or c in "-_" else "_" for c in device_id)
+        path = os.path.join(self.directory, f"{int(timestamp * 1000)}-{safe_device}.u16")
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            remaining = sum(len(s) for s in segments)
+            while remaining:
+                written = os.writev(fd, segments)
+                remaining -= written
+                # short write, carry on from where it stopped
+                while segments and written >= len(segments[0]):
+                    written -= len(segments[0])
+                    segments = segments[1:]
+                if segments:
+                    segments = [segments[0][written:]] + list(segments[1:])
+        finally:
+            os.close(fd)
+        return path
+
+
+def validate_reading(name, volts, timestamp):
+    """
+    A (name, volts, timestamp) reading as it would be stored
+
+    Raises:
+        (ValueError): says what's wrong with it
+    """
+    name = clean_name(str(name))
+    if not name:
+        raise ValueError("empty name")
+    volts, timestamp = float(volts), float(timestamp)
+    if not (math.isfinite(volts) and volts >= 0):
+        raise ValueError(f"bad voltage {volts}")
+    if not (math.isfinite(timestamp) and timestamp > 0):
+        raise ValueError(f"bad timestamp {timestamp}")
+    return (name, volts, timestamp)
+
+
+def parse_readings(lines, fmt="csv"):
+    """
+    Readings out of csv (name,bac,timestamp like namesBac.csv, header optional) or
+    NDJSON ({"name", "voltage", "timestamp"} per line), one line at a time
+
+    Yields:
+        (int): line number
+        (tuple): the reading, None if the line is bad
+        (str): what's wrong with it, None if it's fine
+    """
+    from reading_log import FIELDS
+
+    if fmt == "csv":
+        reader = csv.reader(lines)
+        for row in reader:
+            if not row or row == FIELDS:
+                continue
+            try:
+                if len(row) != 3:
+                    raise ValueError(f"expected 3 fields, got {len(row)}")
+                yield reader.line_num, validate_reading(*row), None
+            except ValueError as e:
+                yield reader.line_num, None, str(e)
+        return
+
+    for line_num, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            obj = json.loads(line)
+            yield line_num, validate_reading(obj["name"], obj["voltage"], obj["timestamp"]), None
+        except KeyError as e:
+            yield line_num, None, f"missing {e}"
+        except (ValueError, TypeError) as e:
+            yield line_num, None, str(e)
+
+
+def import_readings(lines, store, fmt="csv", batch_size=5000, max_errors=20):
+    """
+    Validate readings from csv or NDJSON lines (a file, a request stream...) and
+    bulk insert them into a store batch_size at a time. Bad lines are skipped. If the
+    input itself can't be read to the end (not utf-8, broken csv quoting) the batches
+    before that point stay imported
+
+    Returns:
+        (dict): imported and rejected counts, the first max_errors problems and, if
+            the input broke off, "error" saying why
+    """
+    imported = rejected = 0
+    errors = []
+
+    def batches():
+        nonlocal imported, rejected
+        batch = []
+        for line_num, row, error in parse_readings(lines, fmt):
+            if error:
+                rejected += 1
+                if len(errors) < max_errors:
+                    errors.append(f"line {line_num}: {error}")
+                continue
+            batch.append(row)
+            if len(batch) >= batch_size:
+                yield batch
+                # the store only asks for the next batch once this one is recorded
+                imported += len(batch)
+                batch = []
+        if batch:
+            yield batch
+            imported += len(batch)
+
+    result = {}
+    try:
+        store.bulk_insert(batches())
+    except UnicodeDecodeError:
+        result["error"] = "input is not utf-8"
+    except csv.Error as e:
+        result["error"] = f"unreadable csv: {e}"
+    result.update(imported=imported, rejected=rejected, errors=errors)
+    return result
+
+
+def export_readings(store, fmt="csv", batch_size=5000):
+    """
+    Every reading in a store as csv (the namesBac.csv format) or NDJSON, in chunks of
+    batch_size readings, highest first. Only one batch is in memory at a time
+
+    Yields:
+        (bytes): the next chunk
+    """
+    from reading_log import FIELDS
+
+    if fmt == "csv":
+        yield (",".join(FIELDS) + "\r\n").encode()
+    for rows in keyset_batches(store, batch_size):
+        out = io.StringIO()
+        if fmt == "csv":
+            csv.writer(out).writerows(rows)
+        else:
+            for name, volts, ts in rows:
+                out.write(json.dumps({"name": name, "voltage": volts, "timestamp": ts}) + "\n")
+        yield out.getvalue().encode()
+
+
+def import_csv(csv_path, store, batch_size=5000):
+    """
+    One-shot import of a name,bac,timestamp csv (eg the old ../namesBac.csv) into a store
+
+    Returns:
+        (dict): what import_readings returns, imported and rejected counts and the
+            first few errors
+    """
+    with open(csv_path, newline="") as f:
+        return import_readings(f, store, "csv", batch_size)
+
+
+if __name__ == "__main__":
+    # python storage.py [csv_path] [db_path]
+    csv_path = sys.argv[1] if len(sys.argv) > 1 else "../namesBac.csv"
+    db_path = sys.argv[2] if len(sys.argv) > 2 else DB_PATH
+
+    if os.path.exists(db_path):
+        print(f"{db_path} already exists, not importing twice")
+        sys.exit(1)
+
+    result = import_csv(csv_path, SqliteStorage(db_path))
+    if "error" in result:
+        print(f"Stopped early: {result['error']}")
+    print(f"Imported {result['imported']} readings from {csv_path} into {db_path}")
+    if result["rejected"]:
+        print(f"Rejected {result['rejected']} lines, eg:")
+        for error in result["errors"]:
+            print(f"  {error}")
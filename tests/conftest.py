@@ -0,0 +1,30 @@
+import importlib
+import os
+import sys
+
+import pytest
+
+# the modules live flat at the repo root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+ADMIN = {"Authorization": "Bearer letmein"}
+
+
+@pytest.fixture
+def server(tmp_path, monkeypatch):
+    """
+    new_flask_server imported fresh, its stores (which live in ../) under tmp_path.
+    No rate limit, no station cooldown, admin token "letmein"
+    """
+    run = tmp_path / "run"
+    run.mkdir()
+    monkeypatch.chdir(run)
+    monkeypatch.setenv("BREATH_RATE_LIMIT", "0")
+    monkeypatch.setenv("BREATH_COOLDOWN_MINUTES", "0")
+    monkeypatch.setenv("BREATH_ADMIN_TOKEN", "letmein")
+    for name in ("BREATH_STORAGE", "BREATH_SHARED_STATE", "BREATH_NAME_COOLDOWN_MINUTES"):
+        monkeypatch.delenv(name, raising=False)
+    monkeypatch.delitem(sys.modules, "new_flask_server", raising=False)
+    module = importlib.import_module("new_flask_server")
+    module.client = module.app.test_client()
+    return module
@@ -0,0 +1,68 @@
+"""RateLimiter and ConcurrencyLimit, and the 429/503 they turn into"""
+from admission import ConcurrencyLimit, RateLimiter
+
+
+def test_burst_then_refill():
+    limiter = RateLimiter(rate=2.0, burst=3)
+    assert [limiter.allow("a", now=0.0)[0] for _ in range(4)] == [True, True, True, False]
+    assert limiter.allow("a", now=0.0) == (False, 1)
+    assert limiter.allow("b", now=0.0) == (True, 0)  # every client has its own bucket
+    assert limiter.allow("a", now=0.5) == (True, 0)  # half a second at 2/s is one token
+    assert limiter.allow("a", now=0.5)[0] is False
+
+
+def test_refill_never_goes_over_the_burst():
+    limiter = RateLimiter(rate=1.0, burst=2)
+    limiter.allow("a", now=0.0)
+    assert [limiter.allow("a", now=1000.0)[0] for _ in range(3)] == [True, True, False]
+
+
+def test_forgotten_clients_start_with_a_full_bucket():
+    limiter = RateLimiter(rate=1.0, burst=1, max_clients=2)
+    assert limiter.allow("a", now=0.0)[0]
+    assert not limiter.allow("a", now=0.0)[0]
+    limiter.allow("b", now=0.0)
+    limiter.allow("c", now=0.0)  # pushes out a, the least recently seen
+    assert list(limiter.buckets) == ["b", "c"]
+    assert limiter.allow("a", now=0.0)[0]
+
+
+def test_concurrency_limit_turns_away_rather_than_queueing():
+    limit = ConcurrencyLimit(2)
+    assert limit.try_acquire() and limit.try_acquire()
+    assert not limit.try_acquire()
+    limit.release()
+    assert limit.try_acquire()
+
+
+def test_polling_route_gets_429_with_retry_after(server):
+    server.RATE_LIMIT = RateLimiter(rate=0.5, burst=2)
+    statuses = [server.client.get("/stations").status_code for _ in range(3)]
+    assert statuses == [200, 200, 429]
+    assert server.client.get("/stations").headers["Retry-After"] == "2"
+
+
+def test_turned_away_leaderboard_serves_its_last_render(server):
+    server.STORE.append("ann", 0.3, 100.0)
+    fresh = server.client.get("/leaderboard.json")
+    server.RATE_LIMIT = RateLimiter(rate=0.5, burst=0)
+
+    stale = server.client.get("/leaderboard.json")
+    assert stale.status_code == 200
+    assert stale.get_json() == fresh.get_json()
+    assert stale.headers["Cache-Control"] == "no-store"
+    assert "Retry-After" in stale.headers
+    # nothing rendered for this query yet
+    assert server.client.get("/leaderboard.json?limit=5").status_code == 503
+
+
+def test_expensive_route_gets_503_when_slots_are_full(server):
+    server.EXPENSIVE_SLOTS.in_flight = server.EXPENSIVE_SLOTS.limit
+    assert server.client.get("/export").status_code == 503
+    assert server.client.get("/stations").status_code == 200  # cheap routes still go through
+    server.EXPENSIVE_SLOTS.in_flight = 0
+    response = server.client.get("/export")
+    assert server.EXPENSIVE_SLOTS.in_flight == 1  # streamed, holds its slot until it's sent
+    response.get_data()
+    response.close()
+    assert server.EXPENSIVE_SLOTS.in_flight == 0
@@ -0,0 +1,79 @@
+"""BlowDetector on synthetic ADC traces, and /submit-samples around it"""
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from blow_signal import ADC_MAX, ADC_VREF, BlowDetector, decode_samples
+
+RATE = 500
+
+
+def trace(rest=1000, peak=800, before=1.0, blowing=1.0, after=1.5):
+    """At rest, a smooth hump of `peak` counts, then at rest again"""
+    hump = rest + peak * np.sin(np.linspace(0, np.pi, int(blowing * RATE)))
+    return np.concatenate((
+        np.full(int(before * RATE), rest), hump, np.full(int(after * RATE), rest),
+    )).round().astype("<u2")
+
+
+def detect(samples, chunk=None):
+    detector = BlowDetector(RATE)
+    chunk = chunk or len(samples)
+    for i in range(0, len(samples), chunk):
+        detector.feed(samples[i:i + chunk])
+    return detector.result()
+
+
+def test_finds_the_peak_as_an_absolute_voltage():
+    blow = detect(trace())
+    counts = ADC_VREF / ADC_MAX
+    assert blow["baseline_v"] == pytest.approx(1000 * counts, abs=1e-3)
+    assert blow["volts"] == pytest.approx(1800 * counts, abs=0.01)
+    assert blow["volts"] == pytest.approx(blow["baseline_v"] + blow["peak_v"], abs=1e-3)
+    # the smoothing window trails the signal by up to SMOOTH_S
+    assert 1.0 < blow["start_s"] < blow["peak_s"] < blow["end_s"] < 2.1
+    assert blow["peak_s"] == pytest.approx(1.5, abs=0.05)
+
+
+def test_chunking_does_not_change_the_result():
+    samples = trace()
+    whole = detect(samples)
+    assert detect(samples, chunk=137) == whole
+    assert detect(samples, chunk=1) == whole
+
+
+def test_no_blow_is_none():
+    assert detect(trace(peak=20)) is None
+    assert detect(trace()[:RATE // 4]) is None  # not even enough for the baseline
+
+
+def test_rejects_bad_input():
+    with pytest.raises(ValueError):
+        decode_samples(b"\x00\x01\x02")
+    with pytest.raises(ValueError):
+        BlowDetector(0)
+    assert decode_samples(trace().tobytes()).tolist() == trace().tolist()
+
+
+def test_submit_samples_records_the_peak(server):
+    server.SESSIONS.poll("s1")  # station comes online
+    assert server.client.post("/initialize-session", json={"name": "ann"}).get_json()["device"] == "s1"
+
+    body = trace().tobytes()
+    half = len(body) // 2
+    partial = server.client.post(f"/submit-samples?device=s1&rate={RATE}&final=0", data=body[:half])
+    assert partial.get_json()["status"] == "partial"
+    response = server.client.post(f"/submit-samples?device=s1&rate={RATE}", data=body[half:])
+    assert response.status_code == 200, response.get_data()
+    result = response.get_json()
+    assert (result["name"], result["rank"]) == ("ann", 1)
+    assert server.STORE.snapshot()[0][:2] == ("ann", result["blow"]["volts"])
+
+
+def test_submit_samples_without_a_blow_keeps_the_session(server):
+    server.SESSIONS.poll("s1")
+    server.client.post("/initialize-session", json={"name": "ann"})
+    flat = trace(peak=0).tobytes()
+    assert server.client.post(f"/submit-samples?device=s1&rate={RATE}", data=flat).status_code == 422
+    assert server.client.post(f"/submit-samples?device=s1&rate={RATE}", data=trace().tobytes()).status_code == 200
+    assert len(server.STORE) == 1
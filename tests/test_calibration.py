@@ -0,0 +1,64 @@
+"""The voltage -> BAC curve, and the store that keeps it across workers"""
+import pytest
+
+from blow_signal import ADC_VREF
+from calibration import Calibration, CalibrationStore
+
+
+def test_identity_without_points():
+    calibration = Calibration()
+    assert calibration.table is None
+    assert calibration.to_bac(1.234) == 1.234
+    assert calibration.apply([0.5, 2.0]) == [0.5, 2.0]
+
+
+def test_curve_is_never_negative_or_decreasing():
+    np = pytest.importorskip("numpy")
+    # a downward parabola through these would dip below zero and turn over
+    calibration = Calibration([(0.5, 0.0), (2.0, 0.15), (4.0, 0.1)], degree=2)
+    volts = np.linspace(0, ADC_VREF, 1000)
+    bacs = calibration.apply(volts)
+    assert min(bacs) >= 0
+    assert all(a <= b for a, b in zip(bacs, bacs[1:]))
+    assert bacs == [calibration.to_bac(v) for v in volts]
+
+
+def test_follows_the_reference_points():
+    pytest.importorskip("numpy")
+    calibration = Calibration([(1.0, 0.02), (2.0, 0.08), (3.0, 0.18)], degree=2)
+    for volts, bac in calibration.points:
+        assert calibration.to_bac(volts) == pytest.approx(bac, abs=1e-3)
+    assert Calibration([(2.0, 0.1)]).to_bac(1.0) == pytest.approx(0.05, abs=1e-3)
+
+
+def test_version_changes_with_the_curve():
+    pytest.importorskip("numpy")
+    points = [(1.0, 0.02), (2.0, 0.08)]
+    assert Calibration(points).version == Calibration(points).version
+    assert Calibration(points).version != Calibration(points + [(3.0, 0.2)]).version
+    assert Calibration(points).version != Calibration().version
+
+
+def test_store_picks_up_a_curve_saved_by_another_worker(tmp_path):
+    pytest.importorskip("numpy")
+    path = str(tmp_path / "calibration.json")
+    mine, theirs = CalibrationStore(path), CalibrationStore(path)
+    assert mine.current.table is None
+
+    saved = theirs.update([(1.0, 0.02), (2.0, 0.08)])
+    assert mine.reload().version == saved.version
+    assert CalibrationStore(path).current.to_dict() == saved.to_dict()
+
+
+def test_served_bac_follows_the_curve(server):
+    pytest.importorskip("numpy")
+    from conftest import ADMIN
+
+    server.STORE.extend([("ann", 2.0, 100.0), ("bo", 1.0, 101.0)])
+    assert [row["bac"] for row in server.client.get("/leaderboard.json").get_json()["items"]] == [2.0, 1.0]
+
+    server.client.post("/calibration", json={"points": [[1.0, 0.02], [2.0, 0.08]], "degree": 1},
+                       headers=ADMIN)
+    items = server.client.get("/leaderboard.json").get_json()["items"]
+    assert [row["bac"] for row in items] == pytest.approx([0.08, 0.02], abs=1e-3)
+    assert [row["voltage"] for row in items] == [2.0, 1.0]  # the stored readings are untouched
@@ -0,0 +1,38 @@
+"""The per-name Cooldown rule"""
+import time
+
+from cooldown import Cooldown
+
+
+def test_off_by_default():
+    cooldown = Cooldown()
+    cooldown.record("ann", 1000.0)
+    assert cooldown.check("ann", now=1000.0) == (True, 0)
+    assert cooldown.horizon(now=1000.0) == 1000.0
+
+
+def test_blocks_only_that_name_until_the_window_passes():
+    cooldown = Cooldown(per_name_minutes=10)
+    cooldown.record("ann", 1000.0)
+    assert cooldown.check("ann", now=1001.0) == (False, 10)
+    assert cooldown.check("ann", now=1000.0 + 9 * 60 + 1) == (False, 1)
+    assert cooldown.check("ann", now=1000.0 + 10 * 60) == (True, 0)
+    assert cooldown.check("bo", now=1001.0) == (True, 0)
+
+
+def test_seed_keeps_the_latest_blow_per_name():
+    cooldown = Cooldown(per_name_minutes=10)
+    cooldown.seed([("ann", 0.3, 1000.0), ("ann", 0.1, 400.0), ("bo", 0.2, 100.0)])
+    assert cooldown.check("ann", now=1000.0 + 5 * 60) == (False, 5)
+    assert cooldown.check("bo", now=1000.0) == (True, 0)
+
+
+def test_prune_drops_only_names_past_their_window():
+    cooldown = Cooldown(per_name_minutes=10)
+    now = time.time()
+    for i in range(1100):
+        cooldown.record(f"old{i}", now - 3600)
+    cooldown.record("ann", now)
+    assert "ann" in cooldown.last_by_name
+    assert len(cooldown.last_by_name) < 1100
+    assert cooldown.check("ann")[0] is False
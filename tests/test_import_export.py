@@ -0,0 +1,51 @@
+"""/export and /import, and the admin token that /import and POST /calibration need"""
+from conftest import ADMIN
+from storage import import_readings, parse_readings
+
+
+def test_parse_readings_reports_bad_lines():
+    lines = ["name,bac,timestamp\n", "ann,0.3,100\n", ",0.2,100\n", "bo,lots,100\n", "cy,0.1,-5\n"]
+    parsed = list(parse_readings(lines))
+    assert [(n, row) for n, row, _ in parsed if row] == [(2, ("ann", 0.3, 100.0))]
+    assert [error for _, row, error in parsed if not row] == [
+        "empty name", "could not convert string to float: 'lots'", "bad timestamp -5.0"]
+
+
+def test_import_readings_counts_what_went_in(server):
+    body = ["ann,0.3,100\n", "bad line\n"] * 3
+    result = import_readings(body, server.STORE, batch_size=2)
+    assert (result["imported"], result["rejected"]) == (3, 3)
+    assert len(server.STORE) == 3
+
+
+def test_export_then_import_round_trips(server):
+    server.STORE.extend([("ann", 0.3, 100.0), ("bo", 0.2, 101.0), ("ann", 0.3, 100.0)])
+    for fmt, content_type in (("csv", "text/csv"), ("ndjson", "application/x-ndjson")):
+        exported = server.client.get(f"/export?format={fmt}").get_data()
+        before = server.STORE.snapshot()
+        response = server.client.post("/import", data=exported, content_type=content_type, headers=ADMIN)
+        assert response.status_code == 200, response.get_json()
+        assert response.get_json()["imported"] == len(before)
+        assert server.STORE.snapshot() == sorted(before * 2, key=lambda r: (-r[1], r[2], r[0]))
+
+
+def test_import_needs_the_admin_token(server):
+    body = b"ann,0.3,100\n"
+    assert server.client.post("/import", data=body).status_code == 401
+    wrong = {"Authorization": "Bearer guess"}
+    assert server.client.post("/import", data=body, headers=wrong).status_code == 401
+    assert len(server.STORE) == 0
+
+    server.ADMIN_TOKEN = ""  # no token configured: turned off for everyone
+    assert server.client.post("/import", data=body, headers=ADMIN).status_code == 403
+
+
+def test_calibration_needs_the_admin_token(server):
+    curve = {"points": [[0.5, 0.0], [1.5, 0.05], [2.5, 0.12]], "degree": 2}
+    before = server.client.get("/calibration").get_json()
+    assert server.client.post("/calibration", json=curve).status_code == 401
+    assert server.client.get("/calibration").get_json() == before
+
+    response = server.client.post("/calibration", json=curve, headers=ADMIN)
+    assert response.status_code == 200
+    assert server.client.get("/calibration").get_json() == response.get_json() != before
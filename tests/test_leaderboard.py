@@ -0,0 +1,207 @@
+"""
+Randomized checks of the leaderboard structures against a plain sorted list: the
+skiplist index, ReadingLog across an archive compaction and a reload, and the keyset
+cursor walk over both. Bacs and timestamps are drawn from small ranges so there are
+plenty of ties and exact duplicate readings.
+"""
+import random
+import time
+
+import pytest
+
+from leaderboard import LeaderboardIndex, WindowedLeaderboard, keyset_batches, resume_point, row_key
+from reading_log import ReadingLog
+from storage import SqliteStorage
+
+NAMES = ["ann", "bo", "cy", "dee", "ed"]
+
+
+def random_rows(rng, n, start, span):
+    """n (name, bac, timestamp) readings with timestamps in [start, start + span)"""
+    rows = [
+        (rng.choice(NAMES), rng.randrange(0, 40) / 100, float(start + rng.randrange(span)))
+        for _ in range(n)
+    ]
+    # and some exact copies, the case `seen` in a cursor is for
+    return rows + rng.sample(rows, n // 10)
+
+
+def expected_rank(model, bac):
+    return 1 + sum(1 for r in model if r[1] > bac)
+
+
+def walk(board, batch_size):
+    """Every reading on board through the cursor walk, also checking resume_point"""
+    out = []
+    after, seen = None, 0
+    for rows in keyset_batches(board, batch_size):
+        assert 0 < len(rows) <= batch_size
+        out.extend(rows)
+        after, seen = resume_point(rows, after, seen)
+        assert after == tuple(out[-1])
+        assert seen == len(out) - next(i for i in range(len(out)) if tuple(out[i]) == after)
+    return out
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_index_matches_sorted_list(seed):
+    rng = random.Random(seed)
+    rows = random_rows(rng, 300, 0, 50)
+    index = LeaderboardIndex(rows[:150])
+    model = sorted(rows[:150], key=row_key)
+
+    for row in rows[150:]:
+        index.insert(row)
+        model.append(row)
+    model.sort(key=row_key)
+    for row in rng.sample(model, 80):
+        assert index.remove(row)
+        model.remove(row)
+    assert not index.remove(("nobody", 1.0, 0.0))
+
+    extra = random_rows(rng, 60, 0, 50)
+    index.merge(extra)
+    model = sorted(model + extra, key=row_key)
+
+    assert list(index) == model
+    assert len(index) == len(model)
+    for _ in range(50):
+        start = rng.randrange(-5, len(model) + 5)
+        stop = start + rng.randrange(0, 30)
+        assert index.slice(start, stop) == model[max(start, 0):max(stop, 0)]
+    for bac in {r[1] for r in model} | {-1.0, 0.005, 9.0}:
+        assert index.rank_of(bac) == expected_rank(model, bac)
+    for i in rng.sample(range(len(model)), 30):
+        row = model[i]
+        first = model.index(row)
+        for seen in range(1, i - first + 2):
+            assert index.after(row, 10, seen) == model[first + seen:first + seen + 10]
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_cursor_walk_sees_every_reading_once(seed):
+    rng = random.Random(seed)
+    rows = random_rows(rng, 400, 0, 20)
+    board = WindowedLeaderboard(100, rows, clock=lambda: 50.0)
+    model = sorted(rows, key=row_key)
+    for batch_size in (1, 3, 7, 50, 1000):
+        assert walk(board, batch_size) == model
+
+    # readings landing mid-walk: above the cursor they're skipped, below it they're
+    # picked up, and nothing already served comes round again
+    batches = keyset_batches(board, 25)
+    out = next(batches) + next(batches)
+    landed = [("late", 1.0, 10.0), ("late", 0.0, 10.0)]
+    for row in landed:
+        board.add(row)
+    for rows in batches:
+        out.extend(rows)
+    assert out == model[:50] + sorted(model[50:] + landed[1:], key=row_key)
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_reading_log_across_archive_and_reload(tmp_path, seed):
+    pytest.importorskip("numpy")  # the archive is read through numpy
+    rng = random.Random(seed)
+    now = int(time.time())
+    old = random_rows(rng, 300, now - 10 * 86400, 50)  # all well past archive_after
+    new = random_rows(rng, 200, now - 600, 50)
+    paths = dict(
+        snapshot_path=str(tmp_path / "names.csv"),
+        log_path=str(tmp_path / "names.log"),
+        archive_path=str(tmp_path / "names.archive"),
+        archive_after=86400,
+        background=False,
+    )
+
+    def check(log, model):
+        assert len(log) == len(model)
+        assert log.snapshot() == model
+        for _ in range(30):
+            offset = rng.randrange(0, len(model) + 5)
+            assert log.page(offset, 17) == model[offset:offset + 17]
+        for bac in {r[1] for r in model} | {-1.0, 9.0}:
+            assert log.rank_of(bac) == expected_rank(model, bac)
+        for i in rng.sample(range(len(model)), 30):
+            row = model[i]
+            first = model.index(row)
+            seen = i - first + 1
+            assert log.after(row, 9, seen) == model[first + seen:first + seen + 9]
+        for batch_size in (4, 25, 1000):
+            assert walk(log, batch_size) == model
+
+    log = ReadingLog(**paths)
+    for row in old[:100]:
+        log.append(*row)
+    log.compact()
+    log.extend(old[100:])
+    for row in new:
+        log.append(*row)
+    model = sorted(old + new, key=row_key)
+    check(log, model)
+
+    log.compact()
+    assert len(log.archive) == len(old)
+    assert len(log.index) == len(new)
+    check(log, model)
+
+    # a few more after the compaction stay in the log until the next one
+    more = random_rows(rng, 20, now - 300, 50)
+    for row in more:
+        log.append(*row)
+    model = sorted(model + more, key=row_key)
+    log.close()
+
+    reloaded = ReadingLog(**paths)
+    assert len(reloaded.archive) == len(old)
+    check(reloaded, model)
+    for name in NAMES:
+        mine = [r for r in model if r[0] == name]
+        if mine:
+            stats = reloaded.user_stats(name)
+            assert stats["count"] == len(mine)
+            assert stats["best"] == max(r[1] for r in mine)
+    reloaded.close()
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_sqlite_storage_matches_sorted_list_and_reading_log(tmp_path, seed):
+    rng = random.Random(seed)
+    now = int(time.time())
+    rows = random_rows(rng, 300, now - 3600, 3000)
+    store = SqliteStorage(str(tmp_path / "names.db"))
+    log = ReadingLog(str(tmp_path / "names.csv"), str(tmp_path / "names.log"),
+                     archive_path=str(tmp_path / "names.archive"), archive_after=None, background=False)
+    versions = [store.version()]
+    for row in rows[:50]:
+        assert store.append(*row) == log.append(*row)
+        versions.append(store.version())
+    assert versions == sorted(set(versions))  # every append moves it on
+    store.extend(rows[50:])
+    log.extend(rows[50:])
+    model = sorted(rows, key=row_key)
+
+    assert len(store) == len(model)
+    assert store.snapshot() == model
+    for _ in range(30):
+        offset = rng.randrange(0, len(model) + 5)
+        assert store.page(offset, 17) == model[offset:offset + 17]
+    assert store.around(5, 2) == (3, model[2:7])
+    for bac in {r[1] for r in model} | {-1.0, 9.0}:
+        assert store.rank_of(bac) == expected_rank(model, bac)
+    for i in rng.sample(range(len(model)), 30):
+        row = model[i]
+        first = model.index(row)
+        seen = i - first + 1
+        assert store.after(row, 9, seen) == model[first + seen:first + seen + 9]
+    assert walk(store, 13) == model
+
+    since = now - 1800
+    recent = store.recent(since)
+    assert sorted(recent) == sorted(r for r in rows if r[2] >= since)
+    assert [r[2] for r in recent] == sorted(r[2] for r in recent)
+    assert store.window(1800).snapshot() == log.window(1800).snapshot()
+    for name in NAMES + ["nobody"]:
+        assert store.user_stats(name) == log.user_stats(name)
+        assert store.latest_timestamp(name) == log.latest_timestamp(name)
+    log.close()
@@ -0,0 +1,81 @@
+"""SampleRing and TracePool, the fixed buffers raw blow samples go into"""
+from array import array
+
+import models
+from models import BlowSession, SampleRing, TracePool
+
+
+def samples(*values):
+    return array("H", values).tobytes()
+
+
+def contents(ring):
+    return array("H", b"".join(bytes(s) for s in ring.segments())).tolist()
+
+
+def test_ring_keeps_the_newest_samples_in_order():
+    ring = SampleRing(capacity=5)
+    ring.extend(samples(1, 2, 3))
+    assert contents(ring) == [1, 2, 3] and len(ring.segments()) == 1
+    ring.extend(samples(4, 5, 6, 7))
+    assert contents(ring) == [3, 4, 5, 6, 7]
+    assert len(ring.segments()) == 2  # wrapped, handed back without a copy
+    assert len(ring) == 5
+
+
+def test_ring_batch_bigger_than_the_ring_keeps_its_tail():
+    ring = SampleRing(capacity=4)
+    ring.extend(samples(9))
+    ring.extend(samples(*range(10)))
+    assert contents(ring) == [6, 7, 8, 9]
+    ring.clear()
+    assert len(ring) == 0 and contents(ring) == []
+
+
+def test_ring_buffer_is_never_reallocated():
+    ring = SampleRing(capacity=8)
+    buffer = ring.buf
+    for i in range(20):
+        ring.extend(samples(i, i + 1, i + 2))
+    assert ring.buf is buffer and len(buffer) == 8
+
+
+def test_pool_hands_out_cleared_rings_until_it_runs_dry():
+    pool = TracePool(slots=2, capacity=4)
+    a, b = pool.acquire(), pool.acquire()
+    assert a is not b and pool.acquire() is None
+    a.extend(samples(1, 2))
+    pool.release(a)
+    pool.release(None)  # a session that never got one
+    again = pool.acquire()
+    assert again is a and len(again) == 0
+
+
+def test_session_without_a_free_ring_still_blows(monkeypatch):
+    monkeypatch.setattr(models, "TRACES", TracePool(slots=1, capacity=4))
+    first, second = BlowSession("ann", "s1"), BlowSession("bo", "s2")
+    first.record_samples(samples(1, 2))
+    second.record_samples(samples(3, 4))
+    assert first.trace is not None and second.trace is None
+
+    first.release_trace()
+    second.record_samples(samples(5))
+    assert contents(second.trace) == [5]
+
+
+def test_recorded_and_expired_sessions_give_their_ring_back(server, monkeypatch):
+    pool = TracePool(slots=1, capacity=4)
+    monkeypatch.setattr(models, "TRACES", pool)
+    server.SESSIONS.poll("s1")
+    server.client.post("/initialize-session", json={"name": "ann"})
+    server.SESSIONS.active("s1").record_samples(samples(1, 2))
+    assert not pool.free
+    assert server.client.post("/submit-bac", json={"device": "s1", "bac": 1.5}).status_code == 200
+    assert len(pool.free) == 1
+
+    server.client.post("/initialize-session", json={"name": "bo"})
+    server.SESSIONS.active("s1").record_samples(samples(1, 2))
+    monkeypatch.setattr("sessions.SESSION_TIMEOUT", -1)  # bo walked away
+    server.SESSIONS.poll("s1")
+    assert server.SESSIONS.active("s1") is None
+    assert len(pool.free) == 1
@@ -0,0 +1,55 @@
+"""The waiting line as the pages see it: /initialize-session, /queue-position, /can-cache"""
+import json
+
+
+def start(server, name):
+    return server.client.post("/initialize-session", json={"name": name})
+
+
+def test_queued_session_follows_its_ticket_to_a_station(server):
+    server.SESSIONS.poll("s1")
+    assert start(server, "ann").get_json() == {"status": "SESSION INITIALIZED", "device": "s1"}
+
+    queued = start(server, "bo").get_json()
+    assert (queued["status"], queued["position"]) == ("QUEUED", 1)
+    assert queued["estimated_wait_s"] > 0
+    ticket = queued["ticket"]
+    waiting = server.client.get(f"/queue-position?ticket={ticket}")
+    assert waiting.get_json()["position"] == 1 and waiting.get_json()["device"] is None
+    assert waiting.headers["Cache-Control"] == "no-store"
+
+    server.client.post("/submit-bac", json={"device": "s1", "bac": 1.0})
+    assert server.client.get("/should-start-blow?device=s1").get_data() == b"TRUE"
+    assert server.client.get(f"/queue-position?ticket={ticket}").get_json() == {
+        "position": 0, "estimated_wait_s": 0, "device": "s1"}
+    assert server.client.get("/stations").get_json() == {"s1": "bo"}
+
+
+def test_full_queue_turns_people_away(server):
+    server.SESSIONS.max_queue = 1
+    server.SESSIONS.poll("s1")
+    start(server, "ann")
+    assert server.client.get("/can-cache").get_data() == b"READY"
+    start(server, "bo")
+    assert server.client.get("/can-cache").get_data().startswith(b"WAIT ")
+    assert start(server, "cy").status_code == 409
+
+
+def test_joining_the_queue_is_announced(server):
+    q = server.EVENTS.subscribe()
+    server.SESSIONS.poll("s1")
+    start(server, "ann")
+    start(server, "bo")
+    events = []
+    while not q.empty():
+        lines = q.get_nowait().splitlines()
+        events.append((lines[1][len("event: "):], json.loads(lines[2][len("data: "):])))
+    assert events == [
+        ("session", {"name": "ann", "device": "s1", "state": "preblow"}),
+        ("queue", {"length": 1}),
+    ]
+
+
+def test_ticket_required(server):
+    assert server.client.get("/queue-position").status_code == 400
+    assert server.client.get("/queue-position?ticket=soon").status_code == 400
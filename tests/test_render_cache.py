@@ -0,0 +1,98 @@
+"""Leaderboard ETags and the RenderCache behind them"""
+import gzip
+
+import pytest
+from conftest import ADMIN
+from render_cache import RenderCache
+
+
+def renderer(body):
+    calls = []
+
+    def render():
+        calls.append(1)
+        return body
+    render.calls = calls
+    return render
+
+
+def test_renders_once_per_version_and_key():
+    cache = RenderCache()
+    render = renderer(b"board")
+    assert cache.get("v1", "a", render) == (b"board", False)
+    assert cache.get("v1", "a", render) == (b"board", False)
+    assert len(render.calls) == 1
+    cache.get("v1", "b", render)
+    cache.get("v2", "a", render)
+    assert len(render.calls) == 3
+
+
+def test_gzip_copy_is_made_once_and_matches():
+    cache = RenderCache()
+    body, gzipped = cache.get("v1", "a", renderer(b"x" * 1000), want_gzip=True)
+    assert gzipped and gzip.decompress(body) == b"x" * 1000
+    assert cache.get("v1", "a", renderer(b"other"), want_gzip=True)[0] is body
+
+
+def test_last_serves_the_previous_version_after_a_bump():
+    cache = RenderCache()
+    cache.get("v1", "a", renderer(b"old"))
+    cache.get("v2", "b", renderer(b"new"))  # first request for v2 drops v1's entries
+    assert cache.last("a") == (b"old", False)
+    assert cache.last("b") == (b"new", False)
+    assert cache.last("c") is None
+    cache.get("v3", "b", renderer(b"newer"))
+    assert cache.last("a") is None  # only one version back is kept
+
+
+def test_least_recently_used_goes_first():
+    cache = RenderCache(max_entries=2)
+    for key in ("a", "b"):
+        cache.get("v1", key, renderer(key.encode()))
+    cache.get("v1", "a", renderer(b"a"))
+    cache.get("v1", "c", renderer(b"c"))
+    assert list(cache.entries) == ["a", "c"]
+
+
+def test_unchanged_leaderboard_is_a_304(server):
+    server.STORE.append("ann", 0.3, 100.0)
+    for path in ("/leaderboard.json", "/leaderboard", "/user/ann"):
+        first = server.client.get(path)
+        etag = first.headers["ETag"]
+        again = server.client.get(path, headers={"If-None-Match": etag})
+        assert (again.status_code, again.get_data()) == (304, b""), path
+        assert again.headers["ETag"] == etag
+
+
+def test_new_reading_or_curve_changes_the_etag(server):
+    server.STORE.append("ann", 0.3, 100.0)
+    etag = server.client.get("/leaderboard.json").headers["ETag"]
+
+    server.STORE.append("bo", 0.2, 101.0)
+    changed = server.client.get("/leaderboard.json", headers={"If-None-Match": etag})
+    assert changed.status_code == 200 and changed.get_json()["total"] == 2
+    etag = changed.headers["ETag"]
+
+    pytest.importorskip("numpy")  # fitting a curve needs it
+    server.client.post("/calibration", json={"points": [[1.0, 0.05]]}, headers=ADMIN)
+    assert server.client.get("/leaderboard.json", headers={"If-None-Match": etag}).status_code == 200
+
+
+def test_polls_reuse_one_render(server, monkeypatch):
+    render = server.render_leaderboard_json
+    calls = []
+
+    def counting(*args):
+        calls.append(1)
+        return render(*args)
+    monkeypatch.setattr(server, "render_leaderboard_json", counting)
+
+    server.STORE.append("ann", 0.3, 100.0)
+    bodies = {server.client.get("/leaderboard.json").get_data() for _ in range(5)}
+    zipped = server.client.get("/leaderboard.json", headers={"Accept-Encoding": "gzip"})
+    assert len(calls) == 1 and len(bodies) == 1
+    assert gzip.decompress(zipped.get_data()) in bodies
+
+    server.STORE.append("bo", 0.2, 101.0)
+    server.client.get("/leaderboard.json")
+    assert len(calls) == 2
@@ -0,0 +1,87 @@
+"""Station assignment, queueing, timeouts and the per-station cooldown, for both managers"""
+import time
+
+import pytest
+
+import sessions
+from sessions import SessionManager, SqliteSessionManager
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def make(request, tmp_path, monkeypatch):
+    monkeypatch.setattr(sessions, "POLL_INTERVAL", 0.01)
+
+    def make(**kwargs):
+        kwargs.setdefault("cooldown_s", 0)
+        if request.param == "memory":
+            return SessionManager(**kwargs)
+        return SqliteSessionManager(str(tmp_path / "shared.db"), **kwargs)
+    return make
+
+
+def test_session_goes_to_the_idlest_free_station(make):
+    manager = make()
+    manager.poll("s1")
+    manager.poll("s2")
+    assert manager.start("ann").device_id == "s1"
+    assert manager.start("bo").device_id == "s2"
+    assert manager.poll("s1").name == "ann"
+    assert manager.stations() == {"s1": "ann", "s2": "bo"}
+
+
+def test_queue_is_fifo_and_bounded(make):
+    manager = make(max_queue=2)
+    manager.poll("s1")
+    manager.start("ann")
+    bo, cy = manager.start("bo"), manager.start("cy")
+    assert (bo.device_id, cy.device_id) == (None, None)
+    assert manager.start("dee") is None
+    assert manager.queue_length() == 2
+    assert manager.position(cy.queue_no)[0] == 2
+
+    assert manager.finish("s1", 1.0).name == "ann"
+    assert manager.poll("s1").name == "bo"
+    assert manager.position(bo.queue_no) == (0, 0.0, "s1")
+    assert manager.position(cy.queue_no)[0] == 1
+
+
+def test_no_station_online_queues_for_the_first_to_poll(make):
+    manager = make()
+    ann = manager.start("ann")
+    assert ann.device_id is None
+    assert manager.poll("station-1").name == "ann"
+    # and whoever comes next waits behind them, not on their station
+    assert manager.start("bo").device_id is None
+
+
+def test_session_on_a_station_that_went_away_expires(make, monkeypatch):
+    monkeypatch.setattr(sessions, "SESSION_TIMEOUT", 0.05)
+    manager = make()
+    manager.poll("s1")
+    assert manager.start("ann").device_id == "s1"
+    assert manager.start("bo").device_id is None
+
+    time.sleep(0.1)
+    # s1 never polls again; the next station to turn up gets the queue
+    assert manager.poll("s2").name == "bo"
+    assert manager.active("s1") is None
+
+
+def test_station_cools_down_before_its_next_session(make):
+    manager = make(cooldown_s=0.3)
+    manager.poll("s1")
+    manager.poll("s2")
+    manager.start("ann")
+    manager.finish("s1", 1.0)
+
+    # s1 is cooling down, so the next one goes to s2 and the one after waits
+    assert manager.start("bo").device_id == "s2"
+    cy = manager.start("cy")
+    assert cy.device_id is None
+    assert manager.poll("s1") is None
+    assert manager.wait_estimate() > 0
+
+    start = time.time()
+    session = manager.poll("s1", wait=2)
+    assert session.name == "cy"
+    assert 0.15 < time.time() - start < 1.5
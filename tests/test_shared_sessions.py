@@ -0,0 +1,76 @@
+"""SqliteSessionManager shared between workers: each test opens several on one file"""
+import threading
+import time
+
+import pytest
+
+import sessions
+from sessions import SqliteSessionManager
+
+
+@pytest.fixture
+def workers(tmp_path, monkeypatch):
+    monkeypatch.setattr(sessions, "POLL_INTERVAL", 0.01)
+    path = str(tmp_path / "shared.db")
+    return [SqliteSessionManager(path, cooldown_s=0) for _ in range(3)]
+
+
+def test_a_session_started_on_one_worker_is_blown_through_another(workers):
+    web, device, other = workers
+    device.poll("s1")
+    assert web.start("ann").device_id == "s1"
+
+    session = device.poll("s1")
+    assert session.name == "ann"
+    assert other.stations() == {"s1": "ann"}
+    assert device.finish("s1", 1.5).bac == 1.5
+    assert web.active("s1") is None and other.stations() == {"s1": None}
+
+
+def test_queue_positions_agree_across_workers(workers):
+    web, device, other = workers
+    device.poll("s1")
+    web.start("ann")
+    bo, cy = web.start("bo"), other.start("cy")
+    assert cy.queue_no == bo.queue_no + 1
+    assert device.queue_length() == 2
+    assert web.position(cy.queue_no)[0] == other.position(cy.queue_no)[0] == 2
+
+    device.finish("s1", 1.0)
+    assert device.poll("s1").name == "bo"
+    assert other.position(bo.queue_no) == (0, 0.0, "s1")
+    assert web.position(cy.queue_no)[0] == 1
+
+
+def test_long_poll_wakes_for_a_session_started_elsewhere(workers):
+    web, device, _ = workers
+    device.poll("s1")
+    threading.Timer(0.1, web.start, ("ann",)).start()
+    start = time.time()
+    assert device.poll("s1", wait=2).name == "ann"
+    assert time.time() - start < 1
+
+
+def test_racing_starts_never_share_a_station(tmp_path, monkeypatch):
+    monkeypatch.setattr(sessions, "POLL_INTERVAL", 0.01)
+    path = str(tmp_path / "shared.db")
+    station = SqliteSessionManager(path, cooldown_s=0)
+    for device_id in ("s1", "s2"):
+        station.poll(device_id)
+
+    started = []
+    def worker(i):
+        manager = SqliteSessionManager(path, cooldown_s=0)
+        for j in range(5):
+            started.append(manager.start(f"p{i}.{j}"))
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assigned = [s.device_id for s in started if s.device_id is not None]
+    assert sorted(assigned) == ["s1", "s2"]
+    queued = sorted(s.queue_no for s in started if s.device_id is None)
+    assert queued == list(range(queued[0], queued[0] + len(started) - 2))
+    assert station.queue_length() == len(started) - 2
@@ -0,0 +1,68 @@
+"""StaticAssets: fingerprinting, ETags, gzip and big files, served through Flask"""
+import gzip
+
+import pytest
+from flask import Flask, request
+
+import static_assets
+from static_assets import IMMUTABLE, StaticAssets
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.setattr(static_assets, "PRELOAD_LIMIT", 1024)
+    root = tmp_path / "static"
+    root.mkdir()
+    (root / "index.html").write_text('<script src="/static/script.js"></script>')
+    (root / "script.js").write_text("console.log('hi');\n" * 50)
+    (root / "photo.jpg").write_bytes(b"\xff" * 4096)
+
+    assets = StaticAssets(roots=((str(root), "/static/"),))
+    app = Flask(__name__, static_folder=None)
+
+    @app.route("/", defaults={"path": ""})
+    @app.route("/<path:path>")
+    def serve(path):
+        return assets.response(request.path, request) or ("File not found", 404)
+
+    client = app.test_client()
+    client.assets = assets
+    return client
+
+
+def test_index_points_at_a_fingerprinted_script(client):
+    html = client.get("/").get_data(as_text=True)
+    url = html.split('"')[1]
+    assert url.startswith("/static/script.") and url != "/static/script.js"
+
+    response = client.get(url)
+    assert response.headers["Cache-Control"] == IMMUTABLE
+    assert response.get_data(as_text=True).startswith("console.log")
+
+
+def test_matching_etag_gets_304(client):
+    etag = client.get("/static/script.js").headers["ETag"]
+    response = client.get("/static/script.js", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.get_data() == b""
+
+
+def test_gzip_only_when_accepted(client):
+    plain = client.get("/static/script.js")
+    zipped = client.get("/static/script.js", headers={"Accept-Encoding": "gzip, br"})
+    assert "Content-Encoding" not in plain.headers
+    assert zipped.headers["Content-Encoding"] == "gzip"
+    assert zipped.headers["Vary"] == "Accept-Encoding"
+    assert gzip.decompress(zipped.get_data()) == plain.get_data()
+
+
+def test_big_file_streams_from_disk(client):
+    assert client.assets.lookup("/static/photo.jpg").body is None
+    response = client.get("/static/photo.jpg")
+    assert response.status_code == 200
+    assert response.get_data() == b"\xff" * 4096
+    assert response.headers["ETag"] == client.assets.lookup("/static/photo.jpg").etag
+
+
+def test_unknown_path(client):
+    assert client.get("/static/nope.js").status_code == 404
@@ -0,0 +1,138 @@
+"""Behaviour of the two Storage backends: what gets written, and what survives a reload"""
+import os
+import sys
+import time
+
+import pytest
+
+from archive import Archive
+import reading_log
+from reading_log import ReadingLog
+from storage import SqliteStorage
+
+
+def open_log(tmp_path, **kwargs):
+    kwargs.setdefault("archive_after", None)
+    return ReadingLog(str(tmp_path / "names.csv"), str(tmp_path / "names.log"),
+                      archive_path=str(tmp_path / "names.archive"), background=False, **kwargs)
+
+
+def test_reading_log_append_without_a_name_is_kept(tmp_path):
+    log = open_log(tmp_path)
+    assert log.append(None, 0.3, 100.0) == 1
+    log.append(" Sam,  B ", "0.2", 101)
+    log.compact()
+    log.close()
+
+    reloaded = open_log(tmp_path)
+    assert reloaded.snapshot() == [("", 0.3, 100.0), ("Sam B", 0.2, 101.0)]
+    assert reloaded.user_stats("sam b")["count"] == 1
+    reloaded.close()
+
+
+def test_reading_log_bad_reading_writes_nothing(tmp_path):
+    log = open_log(tmp_path)
+    with pytest.raises(ValueError):
+        log.append("ann", "lots", 100.0)
+    with pytest.raises(ValueError):
+        log.extend([("bo", 0.1, 100.0), ("cy", 0.1, "noon")])
+    log.close()
+
+    assert (tmp_path / "names.log").read_text() == ""
+    assert len(open_log(tmp_path)) == 0
+
+
+def test_sqlite_append_without_a_name_is_kept(tmp_path):
+    store = SqliteStorage(str(tmp_path / "names.db"))
+    assert store.append(None, 0.3, 100.0) == 1
+    store.extend([(" Sam,  B ", "0.2", 101)])
+    assert store.snapshot() == [("", 0.3, 100.0), ("Sam B", 0.2, 101.0)]
+    with pytest.raises(ValueError):
+        store.append("ann", "lots", 100.0)
+    assert len(store) == 2
+
+
+def test_first_sqlite_run_imports_the_whole_csv_log(tmp_path, monkeypatch):
+    pytest.importorskip("numpy")  # the compaction archives the old readings
+    from server_utils import open_storage
+
+    run = tmp_path / "run"
+    run.mkdir()
+    monkeypatch.chdir(run)  # the stores live in ../
+    (tmp_path / "namesBac.csv").write_text("name,bac,timestamp\n,0.5,50.0\nold,0.1,60.0\n")
+
+    log = open_storage("csv", background=False)
+    log.append("ann", 0.3, 100.0)
+    log.compact()
+    log.append("bo", 0.2, 101.0)
+    log.append("cy", 0.4, 102.0)  # these two are only in the log
+    expected = log.snapshot()
+    assert len(log.archive) == 3
+
+    store = open_storage("sqlite")
+    assert len(expected) == 5
+    assert store.snapshot() == expected
+
+
+def test_reading_log_without_numpy_compacts_without_archiving(tmp_path, monkeypatch):
+    monkeypatch.setitem(sys.modules, "numpy", None)
+    log = open_log(tmp_path, archive_after=3600)
+    assert log.archive_after is None
+    log.extend([("ann", 0.3, 100.0), ("bo", 0.2, time.time())])
+    log.compact()
+
+    assert not os.path.exists(tmp_path / "names.log.compacting")
+    assert not os.path.exists(tmp_path / "names.archive")
+    assert len(open_log(tmp_path)) == 2
+
+
+def test_reading_log_compacts_even_if_archiving_fails(tmp_path, monkeypatch):
+    def broken(*args):
+        raise OSError("disk full")
+    monkeypatch.setattr(Archive, "merged", broken)
+    log = open_log(tmp_path, archive_after=3600)
+    log.extend([("ann", 0.3, 100.0), ("bo", 0.2, time.time())])
+    log.compact()
+
+    assert not os.path.exists(tmp_path / "names.log.compacting")
+    assert (tmp_path / "names.log").read_text() == ""
+    assert len(log.index) == 2
+    assert len(open_log(tmp_path)) == 2
+
+
+def test_bulk_insert_lets_go_of_the_lock_between_chunks(tmp_path, monkeypatch):
+    monkeypatch.setattr(reading_log, "INSERT_CHUNK", 3)
+    log = open_log(tmp_path)
+    holds = []
+
+    class CountingLock():
+        def __init__(self, lock):
+            self.lock = lock
+
+        def __enter__(self):
+            self.lock.acquire()
+            holds.append(len(log.index))
+
+        def __exit__(self, *exc):
+            self.lock.release()
+
+    log.lock = CountingLock(log.lock)
+    rows = [(f"p{i}", i / 100, 100.0 + i) for i in range(10)]
+    assert log.bulk_insert([rows[:7], rows[7:]]) == 10
+    # per batch: one hold for the log write, then one per chunk of the index insert
+    assert holds == [0, 0, 3, 6, 7, 7]
+    assert len(log) == 10
+
+
+def test_bulk_insert_keeps_batches_before_a_failure(tmp_path):
+    log = open_log(tmp_path)
+
+    def batches():
+        yield [("ann", 0.3, 100.0), ("bo", 0.2, 101.0)]
+        raise UnicodeDecodeError("utf-8", b"\xff", 0, 1, "bad byte")
+
+    with pytest.raises(UnicodeDecodeError):
+        log.bulk_insert(batches())
+    assert len(log) == 2
+    log.compact()
+    assert len(open_log(tmp_path)) == 2